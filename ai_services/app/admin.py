@@ -0,0 +1,26 @@
+# Admin token for operational endpoints: every /debug/* route (traces, slow captures, profiles,
+# admission/degraded/security state, behavior sessions and model reload)
+# - Header X-Admin-Token: <AI_ADMIN_TOKEN>; compared in constant time
+# - Independent of profiling: AI_PROFILE_TOKEN / AI_PROFILE_SAMPLE_RATE only decide what gets
+#   profiled. For existing deployments AI_PROFILE_TOKEN (header X-Profile-Token) is still
+#   accepted when AI_ADMIN_TOKEN is not set.
+# - Without a token every admin endpoint answers 404, so nothing is advertised.
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+ADMIN_TOKEN = os.getenv("AI_ADMIN_TOKEN", "") or os.getenv("AI_PROFILE_TOKEN", "")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """Constant-time check of the admin token."""
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None), x_profile_token: Optional[str] = Header(None)):
+    """FastAPI dependency for admin-only endpoints."""
+    if not is_admin(x_admin_token or x_profile_token):
+        # 404 thay vì 401/403: không lộ endpoint khi chưa có token
+        raise HTTPException(status_code=404, detail="Not found")
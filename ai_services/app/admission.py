@@ -0,0 +1,281 @@
+# Admission control for the grading endpoints
+# - At most AI_GRADING_CONCURRENCY gradings run at once; the rest wait in a bounded priority
+#   queue (AI_GRADING_QUEUE_DEPTH): regrade (instructor-triggered) > bulk (exam grading) > recovery
+# - Priority: X-Grading-Priority header (AIService.js), else the route default
+# - Queue full: a lower-priority waiter is displaced, otherwise the request is rejected at once
+#   with 429 + Retry-After computed from the measured service rate; waiters older than
+#   AI_GRADING_QUEUE_WAIT seconds are rejected the same way
+# Everything runs on the event loop thread (pure ASGI middleware), so no locks are needed.
+# Under overload (app/degraded.py) bulk/recovery /grade requests bypass the queue and are
+# flagged scope["state"]["degraded"] for the lexical path.
+# Disable with AI_ADMISSION_ENABLED=0.
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from app.deadline import DeadlineExceeded, check_deadline
+from app.degraded import DEGRADE_ENABLED, DETECTOR
+from app.metrics import REGISTRY
+from app.tracing import span
+
+ADMISSION_ENABLED = os.getenv("AI_ADMISSION_ENABLED", "1").lower() not in ("0", "false", "no")
+MAX_CONCURRENT = int(os.getenv("AI_GRADING_CONCURRENCY", str(max(2, os.cpu_count() or 2))))
+MAX_QUEUE_DEPTH = int(os.getenv("AI_GRADING_QUEUE_DEPTH", "64"))
+MAX_QUEUE_WAIT = float(os.getenv("AI_GRADING_QUEUE_WAIT", "30"))
+
+PRIORITIES = {"regrade": 0, "bulk": 1, "recovery": 2}
+ROUTE_PRIORITY = {"/grade": "bulk", "/grade/batch": "bulk", "/questions/regrade": "regrade"}
+
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 120
+RETRY_AFTER_DEFAULT = 5
+RATE_WINDOW = 60.0  # seconds of completions used for the service rate
+
+ADMISSION_REJECTED_TOTAL = REGISTRY.counter(
+    "ai_admission_rejected_total", "Grading requests rejected with 429.", ("priority", "reason"))
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "ai_admission_wait_seconds", "Time admitted requests waited in the queue.", ("priority",))
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future", "removed", "enqueued_at", "timer")
+
+    def __init__(self, priority: int, seq: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.removed = False
+        self.enqueued_at = time.perf_counter()
+        self.timer = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, max_depth: int = MAX_QUEUE_DEPTH,
+                 max_wait: float = MAX_QUEUE_WAIT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_depth = max(0, max_depth)
+        self.max_wait = max_wait
+        self.running = 0
+        self._heap: List[_Waiter] = []
+        self._queued = {p: 0 for p in PRIORITIES.values()}
+        self._seq = itertools.count()
+        self._completions: deque = deque()
+        self._service_ewma: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+
+    # ----- service rate -----
+
+    def service_rate(self) -> Optional[float]:
+        """Completions per second over the last RATE_WINDOW seconds (None until measured)."""
+        now = time.monotonic()
+        while self._completions and now - self._completions[0] > RATE_WINDOW:
+            self._completions.popleft()
+        if len(self._completions) >= 3:
+            span_s = max(now - self._completions[0], 1e-3)
+            return len(self._completions) / span_s
+        if self._service_ewma:
+            return self.max_concurrent / self._service_ewma
+        return None
+
+    def retry_after(self, priority: int) -> int:
+        """Seconds until the queue ahead of this priority (+ this request) would have drained."""
+        ahead = sum(n for p, n in self._queued.items() if p <= priority) + 1
+        rate = self.service_rate()
+        if not rate:
+            return RETRY_AFTER_DEFAULT
+        return int(min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, math.ceil(ahead / rate))))
+
+    # ----- queue -----
+
+    def queued(self) -> int:
+        return sum(self._queued.values())
+
+    def _drop(self, waiter: _Waiter):
+        if not waiter.removed:
+            waiter.removed = True
+            self._queued[waiter.priority] -= 1
+
+    def _expire(self, waiter: _Waiter):
+        if not waiter.removed:
+            self._drop(waiter)
+            if not waiter.future.done():
+                waiter.future.set_result("queue_timeout")
+
+    def _worst_waiter(self) -> Optional[_Waiter]:
+        live = [w for w in self._heap if not w.removed]
+        return max(live, key=lambda w: (w.priority, w.seq)) if live else None
+
+    async def acquire(self, priority: int) -> Optional[str]:
+        """None once a slot is held, else the rejection reason."""
+        if self.running < self.max_concurrent and not self.queued():
+            self.running += 1
+            self.admitted += 1
+            return None
+        if self.queued() >= self.max_depth:
+            worst = self._worst_waiter()
+            if worst is None or worst.priority <= priority:
+                return "queue_full"
+            # Regrade / bulk request takes the place of the newest lower-priority waiter
+            self._drop(worst)
+            worst.future.set_result("displaced")
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), loop.create_future())
+        heapq.heappush(self._heap, waiter)
+        self._queued[priority] += 1
+        waiter.timer = loop.call_later(self.max_wait, self._expire, waiter)
+        try:
+            outcome = await waiter.future
+        except asyncio.CancelledError:
+            # Client went away while queued; give the slot back if it was already handed over
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.result() is None:
+                self.release(None)
+            else:
+                self._drop(waiter)
+            raise
+        finally:
+            waiter.timer.cancel()
+        if outcome is None:
+            self.admitted += 1
+        return outcome
+
+    def release(self, service_seconds: Optional[float]):
+        """Free a slot and hand it to the best waiter."""
+        self.running = max(0, self.running - 1)
+        if service_seconds is not None:
+            self._completions.append(time.monotonic())
+            self._service_ewma = service_seconds if self._service_ewma is None else 0.8 * self._service_ewma + 0.2 * service_seconds
+        while self._heap and self.running < self.max_concurrent:
+            waiter = heapq.heappop(self._heap)
+            if waiter.removed:
+                continue
+            self._drop(waiter)
+            self.running += 1
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        names = {v: k for k, v in PRIORITIES.items()}
+        rate = self.service_rate()
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "queued": {names[p]: n for p, n in self._queued.items()},
+            "max_queue_depth": self.max_depth,
+            "max_queue_wait_s": self.max_wait,
+            "service_rate_per_s": round(rate, 3) if rate else None,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+ADMISSION = AdmissionController()
+
+
+def _queue_samples():
+    names = {v: k for k, v in PRIORITIES.items()}
+    for p, n in list(ADMISSION._queued.items()):
+        yield "ai_admission_queue_depth", "gauge", "Grading requests waiting for a slot.", {"priority": names[p]}, n
+    yield "ai_admission_running", "gauge", "Grading requests holding a slot.", {}, ADMISSION.running
+    rate = ADMISSION.service_rate()
+    if rate:
+        yield "ai_admission_service_rate", "gauge", "Measured grading completions per second.", {}, rate
+
+
+REGISTRY.register_collector(_queue_samples)
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware: one slot per grading request, 429 + Retry-After when overloaded."""
+
+    def __init__(self, app, controller: AdmissionController = ADMISSION):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED or scope.get("method") != "POST":
+            await self.app(scope, receive, send)
+            return
+        default = ROUTE_PRIORITY.get(scope.get("path", ""))
+        if default is None:
+            await self.app(scope, receive, send)
+            return
+
+        requested = ""
+        for key, value in scope.get("headers", []):
+            if key == b"x-grading-priority":
+                requested = value.decode("latin-1").strip().lower()
+                break
+        name = requested if requested in PRIORITIES else default
+        priority = PRIORITIES[name]
+        path = scope.get("path", "")
+
+        if (DEGRADE_ENABLED and path == "/grade" and name != "regrade"
+                and DETECTOR.check(self.controller.queued())):
+            # Lexical scoring is cheap: no slot, no queue
+            scope.setdefault("state", {})["degraded"] = name
+            await self.app(scope, receive, send)
+            return
+
+        with span("admission.wait", priority=name) as wait_span:
+            start = time.perf_counter()
+            rejection = await self.controller.acquire(priority)
+            waited = time.perf_counter() - start
+            wait_span.set(outcome=rejection or "admitted", queued=self.controller.queued())
+        if rejection is not None:
+            self.controller.rejected += 1
+            ADMISSION_REJECTED_TOTAL.inc(priority=name, reason=rejection)
+            await self._reject(send, name, rejection)
+            return
+
+        ADMISSION_WAIT_SECONDS.observe(waited, priority=name)
+        try:
+            # Caller may have given up while this request was queued
+            check_deadline("admission.wait")
+        except DeadlineExceeded as e:
+            self.controller.release(None)
+            await _send_json(send, 504, {"detail": str(e), "reason": e.reason})
+            return
+        service_start = time.perf_counter()
+        completed = False
+        try:
+            await self.app(scope, receive, send)
+            completed = True
+        finally:
+            service = time.perf_counter() - service_start
+            self.controller.release(service if completed else None)
+            if completed and path == "/grade":
+                DETECTOR.observe(waited + service)
+
+    async def _reject(self, send, priority: str, reason: str):
+        retry_after = self.controller.retry_after(PRIORITIES[priority])
+        await _send_json(send, 429, {
+            "detail": "AI service overloaded, retry later",
+            "reason": reason,
+            "priority": priority,
+            "retry_after": retry_after,
+        }, [(b"retry-after", str(retry_after).encode("latin-1"))])
+
+
+async def _send_json(send, status: int, payload: Dict[str, Any], headers: Optional[List] = None):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            *(headers or []),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,202 @@
+# Streaming behavior sessions: per-(student, exam) state on the server
+# - Clients send only the events since their last call; the session aggregates them:
+#   exam-long counters, running mean/max blur duration, exponentially decayed counters
+#   (half-life AI_BEHAVIOR_DECAY_HALF_LIFE) and a ring of fixed-size time buckets
+#   (AI_BEHAVIOR_BUCKETS x AI_BEHAVIOR_BUCKET_SECONDS) for sliding-window features.
+# - Scoring uses the window features (what the model was trained on) over the request's
+#   window_duration_seconds, read from the ring: no event history is kept or resent.
+# - Event timestamps (client ms) keep their spacing but are shifted onto the server clock
+#   (latest event = now), so client clock skew does not matter.
+# - Sessions idle for AI_BEHAVIOR_SESSION_TTL seconds are evicted (LRU, at most
+#   AI_BEHAVIOR_SESSIONS_MAX); DELETE ends one explicitly (exam submitted).
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.metrics import REGISTRY
+
+BUCKET_SECONDS = float(os.getenv("AI_BEHAVIOR_BUCKET_SECONDS", "1"))
+BUCKETS = int(os.getenv("AI_BEHAVIOR_BUCKETS", "120"))
+SESSION_TTL = float(os.getenv("AI_BEHAVIOR_SESSION_TTL", "1800"))
+SESSIONS_MAX = int(os.getenv("AI_BEHAVIOR_SESSIONS_MAX", "20000"))
+DECAY_HALF_LIFE = float(os.getenv("AI_BEHAVIOR_DECAY_HALF_LIFE", "300"))
+
+# Counter features (BehaviorDetectionModel.process_raw_events) and the event types feeding them
+COUNTERS = [
+    'tab_switches', 'blur_events', 'blocked_keys', 'fullscreen_exits',
+    'copy_attempts', 'paste_attempts', 'mouse_outside_count', 'screenshot_attempts'
+]
+EVENT_COUNTER = {
+    'tab_switch': 0, 'window_blur': 1, 'visibility_hidden': 1, 'blocked_key': 2, 'fullscreen_lost': 3,
+    'copy': 4, 'paste': 5, 'mouse_outside': 6, 'screenshot_attempt': 7,
+}
+# Blur ring columns
+_SUM, _COUNT, _MAX = 0, 1, 2
+# Array payload of one session: ring (ids + counters + blur) + totals + decayed
+SESSION_BYTES = BUCKETS * (8 + 4 * len(COUNTERS) + 8 * 3) + 16 * len(COUNTERS)
+
+SESSION_EVENTS_TOTAL = REGISTRY.counter(
+    "ai_behavior_session_events_total", "Behavior events aggregated into streaming sessions.")
+SESSION_EVICTED_TOTAL = REGISTRY.counter(
+    "ai_behavior_sessions_evicted_total", "Streaming behavior sessions dropped.", ("reason",))
+
+
+class BehaviorSession:
+    """Aggregated state of one (student, exam); a few KB regardless of exam length."""
+    __slots__ = ("key", "started_at", "last_seen", "events_total", "totals", "blur_sum", "blur_count",
+                 "blur_max", "decayed", "decayed_at", "bucket_ids", "counts", "blur")
+
+    def __init__(self, key: Tuple[int, int], now: float):
+        self.key = key
+        self.started_at = now
+        self.last_seen = now
+        self.events_total = 0
+        self.totals = np.zeros(len(COUNTERS), dtype=np.int64)
+        self.blur_sum = 0.0
+        self.blur_count = 0
+        self.blur_max = 0.0
+        self.decayed = np.zeros(len(COUNTERS), dtype=np.float64)
+        self.decayed_at = now
+        self.bucket_ids = np.full(BUCKETS, -1, dtype=np.int64)  # absolute bucket held by each slot
+        self.counts = np.zeros((BUCKETS, len(COUNTERS)), dtype=np.int32)
+        self.blur = np.zeros((BUCKETS, 3), dtype=np.float64)
+
+    def _slot(self, bucket: int) -> int:
+        slot = bucket % BUCKETS
+        if self.bucket_ids[slot] != bucket:
+            # Slot still holds a bucket from a previous lap: reuse it
+            self.bucket_ids[slot] = bucket
+            self.counts[slot] = 0
+            self.blur[slot] = 0.0
+        return slot
+
+    def add_events(self, events: List[Dict[str, Any]], now: float):
+        self._decay(now)
+        stamps = [e.get('timestamp') or 0 for e in events]
+        latest = max(stamps) if stamps else 0
+        # Older events land in the oldest bucket still inside the ring (never the current slot's previous lap)
+        oldest_allowed = now - (BUCKETS - 1) * BUCKET_SECONDS
+        for e, ts in zip(events, stamps):
+            at = now - (latest - ts) / 1000.0 if ts > 0 and latest > 0 else now
+            slot = self._slot(int(max(at, oldest_allowed) // BUCKET_SECONDS))
+            counter = EVENT_COUNTER.get(e.get('event_type'))
+            if counter is not None:
+                self.counts[slot, counter] += 1
+                self.totals[counter] += 1
+                self.decayed[counter] += 1.0
+            duration = (e.get('details') or {}).get('duration_ms', 0)
+            if duration > 0:
+                blur = self.blur[slot]
+                blur[_SUM] += duration
+                blur[_COUNT] += 1
+                blur[_MAX] = max(blur[_MAX], duration)
+                self.blur_sum += duration
+                self.blur_count += 1
+                self.blur_max = max(self.blur_max, duration)
+        self.events_total += len(events)
+        self.last_seen = now
+
+    def _decay(self, now: float):
+        if DECAY_HALF_LIFE > 0 and now > self.decayed_at:
+            self.decayed *= math.pow(0.5, (now - self.decayed_at) / DECAY_HALF_LIFE)
+        self.decayed_at = now
+
+    def window_features(self, window_seconds: float, now: float) -> Dict[str, Any]:
+        """Model features over the last window_seconds (same keys/values as process_raw_events)."""
+        current = int(now // BUCKET_SECONDS)
+        width = min(BUCKETS, max(1, math.ceil(window_seconds / BUCKET_SECONDS)))
+        live = self.bucket_ids > current - width
+        counts = self.counts[live].sum(axis=0)
+        features: Dict[str, Any] = {name: int(counts[i]) for i, name in enumerate(COUNTERS)}
+        blur = self.blur[live]
+        blur_count = blur[:, _COUNT].sum()
+        features['max_blur_duration_ms'] = float(blur[:, _MAX].max()) if blur_count else 0
+        features['avg_blur_duration_ms'] = float(blur[:, _SUM].sum() / blur_count) if blur_count else 0
+        return features
+
+    def summary(self, now: float) -> Dict[str, Any]:
+        self._decay(now)
+        return {
+            "started_at": self.started_at,
+            "duration_s": round(now - self.started_at, 3),
+            "events_total": self.events_total,
+            "totals": {name: int(self.totals[i]) for i, name in enumerate(COUNTERS)},
+            "avg_blur_duration_ms": self.blur_sum / self.blur_count if self.blur_count else 0,
+            "max_blur_duration_ms": self.blur_max,
+            "decayed": {name: round(float(self.decayed[i]), 4) for i, name in enumerate(COUNTERS)},
+        }
+
+
+class SessionStore:
+    """(student_id, exam_id) -> BehaviorSession, LRU + idle TTL. Endpoints run in the threadpool."""
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSIONS_MAX):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self._sessions: "OrderedDict[Tuple[int, int], BehaviorSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ingest(self, student_id: int, exam_id: int, events: List[Dict[str, Any]],
+               window_seconds: float, now: Optional[float] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Add new events; returns (window features for scoring, session summary)."""
+        now = time.time() if now is None else now
+        key = (student_id, exam_id)
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = BehaviorSession(key, now)
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    SESSION_EVICTED_TOTAL.inc(reason="capacity")
+            else:
+                self._sessions.move_to_end(key)
+            session.add_events(events, now)
+            SESSION_EVENTS_TOTAL.inc(len(events))
+            return session.window_features(window_seconds, now), session.summary(now)
+
+    def end(self, student_id: int, exam_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.pop((student_id, exam_id), None)
+        if session is None:
+            return None
+        SESSION_EVICTED_TOTAL.inc(reason="ended")
+        return session.summary(time.time())
+
+    def _evict(self, now: float):
+        # Oldest-touched first: stop at the first session that is still live
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            SESSION_EVICTED_TOTAL.inc(reason="ttl")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict(time.time())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_s": self.ttl,
+                "window_max_s": BUCKETS * BUCKET_SECONDS,
+                "bytes_per_session": SESSION_BYTES,
+            }
+
+
+SESSIONS = SessionStore()
+
+
+def _session_samples():
+    yield "ai_behavior_sessions", "gauge", "Live streaming behavior sessions.", {}, len(SESSIONS)
+
+
+REGISTRY.register_collector(_session_samples)
@@ -1,17 +1,110 @@
 # Dataset Learning Module for AI Grading (Rubric-based)
+# Indexes live in an immutable DatasetSnapshot. Reloads (auto-retrain, teacher corrections) build
+# a new snapshot off to the side and publish it with one reference swap (RCU style): graders read
+# current_snapshot() once per call, never take a lock and never see a half-built index.
+# Startup loads a prebuilt pickle (AI_DATASET_SNAPSHOT) with the normalized keys precomputed; it
+# is rebuilt from the JSON sources whenever their checksum changes (python -m app.dataset_learning build).
+import argparse
+import hashlib
+import itertools
 import json
 import os
+import pickle
+import sys
+import threading
+import time
+from types import MappingProxyType
 from typing import Dict, List, Optional, Tuple
 
 # Path to unified training data file
 UNIFIED_DATA_PATH = os.path.join(os.path.dirname(__file__), 'ai_training_data.json')
+UNIVERSITY_DATA_PATH = os.path.join(os.path.dirname(__file__), 'university_training_data.json')
+LEARNED_DATA_PATH = os.path.join(os.path.dirname(__file__), 'learned_data.json')
+SOURCE_PATHS = (UNIFIED_DATA_PATH, UNIVERSITY_DATA_PATH, LEARNED_DATA_PATH)
+
+# Prebuilt snapshot (written by this service only; "" disables). Bump SNAPSHOT_FORMAT whenever
+# the payload layout or _normalize_key changes so old files are rebuilt.
+SNAPSHOT_PATH = os.getenv("AI_DATASET_SNAPSHOT", os.path.join(os.path.dirname(__file__), 'dataset_snapshot.pkl'))
+SNAPSHOT_FORMAT = 1
+
+_CANDIDATE_CACHE_MAX = 4096
+
+
+def _question_keys(question: Dict) -> Tuple[str, Tuple[str, ...]]:
+    # (normalized model answer, normalized student answer of every grading sample)
+    return (
+        _normalize_key(question.get('model_answer', '')),
+        tuple(_normalize_key(s.get('student_answer', '')) for s in question.get('grading_samples', [])),
+    )
 
-# Singleton
-_data = None
-_synonyms = None
-_contradictions = None
-_questions = None
-_model_index: Dict[str, Dict] = {}
+
+class DatasetSnapshot:
+    """
+    One published version of the datasets. Never mutated after publication except for
+    candidate_cache, a memo of lookups against this very snapshot (a new snapshot starts empty).
+    keys: _question_keys() per question, precomputed (snapshot file / previous snapshot).
+    """
+    __slots__ = ("version", "questions", "model_index", "synonyms", "contradictions", "candidate_cache",
+                 "built_at", "checksum", "_keys")
+
+    def __init__(self, version: int, questions: List[Dict], synonyms: Dict, contradictions: Dict,
+                 keys: Optional[List[Tuple[str, Tuple[str, ...]]]] = None, checksum: Optional[str] = None):
+        self.version = version
+        self.questions: Tuple[Dict, ...] = tuple(questions)
+        if keys is None:
+            keys = [_question_keys(q) for q in self.questions]
+        index: Dict[str, List[Dict]] = {}
+        # id(question) -> keys; the snapshot holds the questions, so ids stay valid
+        self._keys: Dict[int, Tuple[str, Tuple[str, ...]]] = {}
+        for q, q_keys in zip(self.questions, keys):
+            self._keys[id(q)] = q_keys
+            if q_keys[0]:
+                index.setdefault(q_keys[0], []).append(q)
+        # Normalized model answer -> questions
+        self.model_index = MappingProxyType({k: tuple(v) for k, v in index.items()})
+        self.synonyms = MappingProxyType(dict(synonyms))
+        self.contradictions = MappingProxyType(dict(contradictions))
+        # Normalized model answer -> candidates found by the fuzzy fallback (incl. "none found")
+        self.candidate_cache: Dict[str, Tuple[Dict, ...]] = {}
+        self.built_at = time.time()
+        self.checksum = checksum
+
+    def question_keys(self, question: Dict) -> Tuple[str, Tuple[str, ...]]:
+        q_keys = self._keys.get(id(question))
+        return q_keys if q_keys is not None else _question_keys(question)
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "checksum": self.checksum,
+            "questions": len(self.questions),
+            "indexed_model_answers": len(self.model_index),
+            "synonym_groups": len(self.synonyms),
+            "contradictions": len(self.contradictions),
+            "built_at": self.built_at,
+        }
+
+
+_snapshot: Optional[DatasetSnapshot] = None
+_versions = itertools.count(1)
+# Serializes writers (build + publish); readers never take it
+_publish_lock = threading.RLock()
+
+
+def _publish(questions: List[Dict], synonyms: Dict, contradictions: Dict, keys=None, checksum=None) -> DatasetSnapshot:
+    global _snapshot
+    with _publish_lock:
+        snapshot = DatasetSnapshot(next(_versions), questions, synonyms, contradictions, keys, checksum)
+        _snapshot = snapshot  # the one atomic swap
+    return snapshot
+
+
+def current_snapshot() -> DatasetSnapshot:
+    snapshot = _snapshot
+    if snapshot is None:
+        load_all_datasets()
+        snapshot = _snapshot
+    return snapshot
 
 def _normalize_key(text: str) -> str:
     # Normalize text for indexing (remove punctuation, lower, compact spaces).
@@ -27,59 +120,27 @@ def _normalize_key(text: str) -> str:
     return text
 
 def load_data() -> dict:
-    # Load unified training data from JSON file.
-    global _data, _synonyms, _contradictions, _questions, _model_index
-    
-    if _data is not None:
-        return _data
-    
-    try:
-        with open(UNIFIED_DATA_PATH, 'r', encoding='utf-8') as f:
-            _data = json.load(f)
-        
-        # Extract components
-        _synonyms = _data.get('synonyms', {})
-        _contradictions = _data.get('contradictions', {})
-        _questions = _data.get('grading_questions', [])
-        
-        # Build Index
-        _model_index = {}
-        for q in _questions:
-            m_ans = q.get('model_answer', '')
-            if m_ans:
-                norm_key = _normalize_key(m_ans)
-                if norm_key:
-                    _model_index[norm_key] = q
-        
-        print(f"[AI Training] Loaded rubric-based data:")
-        print(f"   - {len(_questions)} grading questions")
-        print(f"   - {len(_model_index)} indexed model answers")
-        print(f"   - {len(_synonyms)} synonym groups")
-        print(f"   - {len(_contradictions)} contradiction pairs")
-        
-        # Count total samples
-        total_samples = sum(len(q.get('grading_samples', [])) for q in _questions)
-        print(f"   - {total_samples} total grading samples")
-        
-        return _data
-    except Exception as e:
-        print(f"[AI Training] Error loading data: {e}")
-        return {}
+    # Unified view of the current snapshot (shares its objects, no second copy of the datasets).
+    snapshot = current_snapshot()
+    return {
+        "grading_questions": list(snapshot.questions),
+        "synonyms": dict(snapshot.synonyms),
+        "contradictions": dict(snapshot.contradictions),
+    }
 
 
 def get_synonyms(word: str) -> List[str]:
     # Get synonyms for a word.
-    if _synonyms is None:
-        load_data()
+    all_synonyms = current_snapshot().synonyms
     
     word_lower = word.lower()
     
     # Direct lookup
-    if word_lower in _synonyms:
-        return _synonyms[word_lower]
+    if word_lower in all_synonyms:
+        return all_synonyms[word_lower]
     
     # Reverse lookup (find the word in synonym lists)
-    for key, synonyms in _synonyms.items():
+    for key, synonyms in all_synonyms.items():
         if word_lower in [s.lower() for s in synonyms]:
             return [key] + [s for s in synonyms if s.lower() != word_lower]
     
@@ -88,13 +149,12 @@ def get_synonyms(word: str) -> List[str]:
 
 def get_contradictions(word: str) -> List[str]:
     # Get contradicting terms for a word.
-    if _contradictions is None:
-        load_data()
+    contradictions = current_snapshot().contradictions
     
     word_lower = word.lower()
     
-    if word_lower in _contradictions:
-        return _contradictions[word_lower]
+    if word_lower in contradictions:
+        return contradictions[word_lower]
     
     return []
 
@@ -107,10 +167,8 @@ def find_similar_grading(
 
     # Find a similar grading sample from the training data.
     # Uses rubric-based matching for better accuracy.
-    if _questions is None:
-        load_data()
-    
-    if not _questions:
+    snapshot = current_snapshot()
+    if not snapshot.questions:
         return None
     
     student_lower = student_answer.lower().strip()
@@ -121,16 +179,13 @@ def find_similar_grading(
     best_similarity = 0.0
     
     # Use O(1) lookup
-    target_questions = []
-    if model_key in _model_index:
-        target_questions = [_model_index[model_key]]
-    else:
-        target_questions = _questions
+    indexed = model_key in snapshot.model_index
+    target_questions = snapshot.model_index[model_key] if indexed else snapshot.questions
 
-    # Search through target questions (1 if hit, all if miss)
+    # Search through target questions (indexed ones if hit, all if miss)
     for question in target_questions:
         question_model = question.get('model_answer', '').lower()
-        if len(target_questions) > 1:
+        if not indexed:
             model_sim = _text_similarity(model_answer.lower(), question_model)
             if model_sim <= 0.5:
                 continue
@@ -161,21 +216,22 @@ def find_similar_grading(
 
 def get_rubric_for_answer(model_answer: str) -> Optional[List[Dict]]:
     # Get rubric for a model answer if available.
-    if _questions is None:
-        load_data()
-    
-    if not _questions:
+    snapshot = current_snapshot()
+    if not snapshot.questions:
         return None
     
     model_key = _normalize_key(model_answer)
     
     # Optimizer: Use O(1) lookup
-    if model_key in _model_index:
-        return _model_index[model_key].get('rubric', [])
+    if model_key in snapshot.model_index:
+        for question in snapshot.model_index[model_key]:
+            if question.get('rubric'):
+                return question['rubric']
+        return []
     
     # Fallback to linear scan
     model_lower = model_answer.lower().strip()
-    for question in _questions:
+    for question in snapshot.questions:
         question_model = question.get('model_answer', '').lower()
         if _text_similarity(model_lower, question_model) > 0.7:
             return question.get('rubric', [])
@@ -188,28 +244,23 @@ def grade_by_rubric(
     model_answer: str,
     max_points: float
 ) -> Optional[Dict]:
-    if _questions is None:
-        load_data()
-    
-    if not _questions:
+    snapshot = current_snapshot()
+    if not snapshot.questions:
         return None
     
     student_lower = student_answer.lower().strip()
     model_key = _normalize_key(model_answer)
     
     # Optimizer: Use O(1) lookup
-    target_questions = []
-    if model_key in _model_index:
-        target_questions = [_model_index[model_key]]
-    else:
-        target_questions = _questions
+    indexed = model_key in snapshot.model_index
+    target_questions = snapshot.model_index[model_key] if indexed else snapshot.questions
     
     # Find matching question
     for question in target_questions:
         question_model = question.get('model_answer', '').lower()
         
         # Only check similarity if fallback
-        if len(target_questions) > 1:
+        if not indexed:
             if _text_similarity(model_answer.lower(), question_model) <= 0.6:
                 continue
 
@@ -295,16 +346,14 @@ def _text_similarity(s1: str, s2: str) -> float:
 
 def expand_with_synonyms(text: str) -> str:
     # Expand text with synonyms.
-    if _synonyms is None:
-        load_data()
-    
-    if not _synonyms:
+    synonyms = current_snapshot().synonyms
+    if not synonyms:
         return text
     
     expanded = text
     text_lower = text.lower()
     
-    for word, syns in _synonyms.items():
+    for word, syns in synonyms.items():
         if word in text_lower and syns:
             syn_str = f' ({syns[0]})'
             expanded = expanded.replace(word, word + syn_str)
@@ -316,13 +365,12 @@ def expand_with_synonyms(text: str) -> str:
 def check_for_contradictions(student_text: str, model_text: str) -> Tuple[bool, str]:
     # Check if student answer contradicts model answer.
     # Returns (has_contradiction, reason)
-    if _contradictions is None:
-        load_data()
+    contradictions = current_snapshot().contradictions
     
     student_lower = student_text.lower()
     model_lower = model_text.lower()
     
-    for model_term, wrong_terms in _contradictions.items():
+    for model_term, wrong_terms in contradictions.items():
         if model_term in model_lower:
             for wrong in wrong_terms:
                 if wrong in student_lower:
@@ -331,82 +379,186 @@ def check_for_contradictions(student_text: str, model_text: str) -> Tuple[bool,
     return False, ""
 
 
-# Auto-load on import
-# load_data()
-def load_all_datasets() -> Dict:
-    global _data, _synonyms, _contradictions, _questions, _model_index
-    # Initialize containers
-    _questions = []
-    _model_index = {}
-    _synonyms = {}
-    _contradictions = {}
+def _read_sources() -> Tuple[Dict[str, Optional[bytes]], str]:
+    # Raw bytes of every source + checksum over all of them (and the snapshot format).
+    raw: Dict[str, Optional[bytes]] = {}
+    digest = hashlib.sha256(f"format={SNAPSHOT_FORMAT}".encode())
+    for path in SOURCE_PATHS:
+        try:
+            with open(path, 'rb') as f:
+                raw[path] = f.read()
+        except FileNotFoundError:
+            raw[path] = None
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(hashlib.sha256(raw[path]).digest() if raw[path] is not None else b"missing")
+    return raw, digest.hexdigest()
+
+
+def _parse_sources(raw: Dict[str, Optional[bytes]]) -> Tuple[List[Dict], Dict, Dict]:
+    questions: List[Dict] = []
+    synonyms: Dict = {}
+    contradictions: Dict = {}
     
     # 1. Load Base Data (ai_training_data.json)
     try:
-        if os.path.exists(UNIFIED_DATA_PATH):
-            with open(UNIFIED_DATA_PATH, 'r', encoding='utf-8') as f:
-                base_data = json.load(f)
-                _questions.extend(base_data.get('grading_questions', []))
-                _synonyms.update(base_data.get('synonyms', {}))
-                _contradictions.update(base_data.get('contradictions', {}))
-                print(f"[Dataset] Loaded {len(base_data.get('grading_questions', []))} base questions")
+        if raw.get(UNIFIED_DATA_PATH) is not None:
+            base_data = json.loads(raw[UNIFIED_DATA_PATH])
+            questions.extend(base_data.get('grading_questions', []))
+            synonyms.update(base_data.get('synonyms', {}))
+            contradictions.update(base_data.get('contradictions', {}))
+            print(f"[Dataset] Loaded {len(base_data.get('grading_questions', []))} base questions")
     except Exception as e:
         print(f"[Dataset] Error loading base data: {e}")
 
     # 2. Load University Data
-    uni_path = os.path.join(os.path.dirname(__file__), 'university_training_data.json')
     try:
-        if os.path.exists(uni_path):
-            with open(uni_path, 'r', encoding='utf-8') as f:
-                uni_data = json.load(f)
-                _questions.extend(uni_data.get('grading_questions', []))
-                print(f"[Dataset] Loaded {len(uni_data.get('grading_questions', []))} university questions")
+        if raw.get(UNIVERSITY_DATA_PATH) is not None:
+            uni_data = json.loads(raw[UNIVERSITY_DATA_PATH])
+            questions.extend(uni_data.get('grading_questions', []))
+            print(f"[Dataset] Loaded {len(uni_data.get('grading_questions', []))} university questions")
     except Exception as e:
         print(f"[Dataset] Error loading university data: {e}")
 
     # 3. Load Learned Data (Learned Patterns)
-    learned_path = os.path.join(os.path.dirname(__file__), 'learned_data.json')
     try:
-        if os.path.exists(learned_path):
-            with open(learned_path, 'r', encoding='utf-8') as f:
-                learned_list = json.load(f)
-                if isinstance(learned_list, list):
-                    print(f"[Dataset] Loaded {len(learned_list)} learned patterns")
-                    # Convert to grading_questions format for consistency
-                    for item in learned_list:
-                        # Create a pseudo question object
-                        q_obj = {
-                            "id": "learned_" + str(hash(item.get('model_answer', ''))),
-                            "model_answer": item.get('model_answer', ''),
-                            "max_points": item.get('max_points', 1.0),
-                            "grading_samples": [{
-                                "student_answer": item.get('student_answer', ''),
-                                "score": item.get('confirmed_score', 0.0),
-                                "feedback": "Learned Pattern (Instructor Confirmed)",
-                                "answer_type": "learned_pattern"
-                            }]
-                        }
-                        _questions.append(q_obj)
+        if raw.get(LEARNED_DATA_PATH) is not None:
+            learned_list = json.loads(raw[LEARNED_DATA_PATH])
+            if isinstance(learned_list, list):
+                print(f"[Dataset] Loaded {len(learned_list)} learned patterns")
+                # Convert to grading_questions format for consistency
+                for item in learned_list:
+                    # Create a pseudo question object
+                    q_obj = {
+                        "id": "learned_" + str(hash(item.get('model_answer', ''))),
+                        "model_answer": item.get('model_answer', ''),
+                        "max_points": item.get('max_points', 1.0),
+                        "grading_samples": [{
+                            "student_answer": item.get('student_answer', ''),
+                            "score": item.get('confirmed_score', 0.0),
+                            "feedback": "Learned Pattern (Instructor Confirmed)",
+                            "answer_type": "learned_pattern"
+                        }]
+                    }
+                    questions.append(q_obj)
     except Exception as e:
         print(f"[Dataset] Error loading learned data: {e}")
+    return questions, synonyms, contradictions
+
 
-    # 4. Re-Build Index (Model Answer -> Question List)
-    _model_index = {}
-    for q in _questions:
-        m_ans = q.get('model_answer', '')
-        if m_ans:
-            norm_key = _normalize_key(m_ans)
-            if norm_key:
-                if norm_key not in _model_index:
-                    _model_index[norm_key] = []
-                _model_index[norm_key].append(q)
+def _load_snapshot_file(checksum: str) -> Optional[Dict]:
+    # Payload of the prebuilt snapshot if it was built from exactly these sources.
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return None
+    try:
+        with open(SNAPSHOT_PATH, 'rb') as f:
+            payload = pickle.load(f)
+        if payload.get("format") == SNAPSHOT_FORMAT and payload.get("checksum") == checksum:
+            return payload
+        print(f"[Dataset] Snapshot {os.path.basename(SNAPSHOT_PATH)} is stale, rebuilding")
+    except Exception as e:
+        print(f"[Dataset] Could not read snapshot {SNAPSHOT_PATH}: {e}")
+    return None
+
+
+def _write_snapshot_file(snapshot: DatasetSnapshot, checksum: str) -> bool:
+    if not SNAPSHOT_PATH:
+        return False
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "checksum": checksum,
+        "built_at": snapshot.built_at,
+        "questions": list(snapshot.questions),
+        "synonyms": dict(snapshot.synonyms),
+        "contradictions": dict(snapshot.contradictions),
+        "keys": [snapshot.question_keys(q) for q in snapshot.questions],
+    }
+    tmp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, SNAPSHOT_PATH)  # readers never see a partial file
+        return True
+    except OSError as e:
+        print(f"[Dataset] Could not write snapshot {SNAPSHOT_PATH}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def load_all_datasets(rebuild: bool = False) -> Dict:
+    # Publish a new snapshot of every dataset: from the prebuilt file when its checksum matches
+    # the sources, else parsed from the JSON sources (and the file rewritten). Returns its model index.
+    raw, checksum = _read_sources()
+    payload = None if rebuild else _load_snapshot_file(checksum)
+    if payload is not None:
+        snapshot = _publish(payload["questions"], payload["synonyms"], payload["contradictions"],
+                            payload["keys"], checksum)
+        source = "snapshot"
+    else:
+        questions, synonyms, contradictions = _parse_sources(raw)
+        # Build Index (Model Answer -> Question List) off to the side, then swap it in
+        snapshot = _publish(questions, synonyms, contradictions, checksum=checksum)
+        _write_snapshot_file(snapshot, checksum)
+        source = "json"
     
-    print(f"[Dataset] Final Index: {len(_model_index)} unique model answers from {len(_questions)} total questions")
-    return _model_index
+    print(f"[Dataset] Final Index: {len(snapshot.model_index)} unique model answers from {len(snapshot.questions)} total questions (v{snapshot.version}, {source})")
+    return snapshot.model_index
 
 # Load once on start
 load_all_datasets()
 
+def _length_ratio_bound(a: str, b: str, threshold: float) -> bool:
+    # Upper bound of SequenceMatcher.ratio() from lengths alone (cheap pre-filter).
+    total = len(a) + len(b)
+    return total > 0 and 2.0 * min(len(a), len(b)) / total > threshold
+
+def _candidate_questions(model_answer: str, snapshot: Optional[DatasetSnapshot] = None) -> Tuple[Dict, ...]:
+    # Questions whose model answer matches (exact normalized key, else fuzzy > 0.90).
+    snapshot = snapshot or current_snapshot()
+    normalized_model = _normalize_key(model_answer)
+    if normalized_model in snapshot.model_index:
+        return snapshot.model_index[normalized_model]
+    candidate_cache = snapshot.candidate_cache
+    if normalized_model in candidate_cache:
+        return candidate_cache[normalized_model]
+
+    # Fallback: fuzzy search model answer (slower)
+    from difflib import SequenceMatcher
+    candidate_questions = []
+    model_lower = model_answer.lower().strip()
+    for key, q_list in snapshot.model_index.items():
+        if q_list:
+            ref_model = q_list[0].get('model_answer', '').lower()
+            # Length bound: ratio() <= 2*min/(sum), skip pairs that can never pass
+            if not _length_ratio_bound(model_lower, ref_model, 0.90):
+                continue
+            # Use SequenceMatcher for better fuzzy matching
+            matcher = SequenceMatcher(None, model_lower, ref_model)
+            if matcher.quick_ratio() > 0.90 and matcher.ratio() > 0.90:
+                candidate_questions.extend(q_list)
+
+    if len(candidate_cache) >= _CANDIDATE_CACHE_MAX:
+        candidate_cache.clear()
+    candidate_questions = tuple(candidate_questions)
+    candidate_cache[normalized_model] = candidate_questions
+    return candidate_questions
+
+def prepare_model_answer(model_answer: str) -> Dict:
+    # Warm-up: resolve dataset candidates + rubric for a model answer before grading starts.
+    candidates = _candidate_questions(model_answer)
+    rubric = None
+    for q in candidates:
+        if q.get('rubric'):
+            rubric = q['rubric']
+            break
+    return {
+        "dataset_questions": len(candidates),
+        "dataset_samples": sum(len(q.get('grading_samples', [])) for q in candidates),
+        "rubric_items": len(rubric) if rubric else 0,
+    }
+
 def find_similar_to_grading(
     student_answer: str, 
     model_answer: str,
@@ -415,27 +567,11 @@ def find_similar_to_grading(
 
     # PRIORITY LOOKUP: Find existing graded sample in ALL datasets.
     # Returns result if match found, else None.
-    if not _model_index:
-        load_all_datasets()
-        
-    normalized_model = _normalize_key(model_answer)
     normalized_student = _normalize_key(student_answer)
     
-    # 1. Direct Model Lookup (O(1))
-    candidate_questions = []
-    if normalized_model in _model_index:
-        candidate_questions = _model_index[normalized_model]
-    else:
-        # Fallback: fuzzy search model answer (slower)
-        from difflib import SequenceMatcher
-        model_lower = model_answer.lower().strip()
-        for key, q_list in _model_index.items():
-            if q_list:
-                ref_model = q_list[0].get('model_answer', '')
-                # Use SequenceMatcher for better fuzzy matching
-                ratio = SequenceMatcher(None, model_lower, ref_model.lower()).ratio()
-                if ratio > 0.90:
-                    candidate_questions.extend(q_list)
+    # 1. Model Lookup (O(1), fuzzy fallback memoized per model answer)
+    snapshot = current_snapshot()
+    candidate_questions = _candidate_questions(model_answer, snapshot)
     
     if not candidate_questions:
         return None
@@ -448,9 +584,8 @@ def find_similar_to_grading(
         q_max = float(q.get('max_points', 1.0))
         scale_factor = max_points / q_max if q_max > 0 else 1.0
         
-        for sample in q.get('grading_samples', []):
-            sample_student = sample.get('student_answer', '')
-            sample_norm = _normalize_key(sample_student)
+        # Normalized sample answers are precomputed in the snapshot
+        for sample, sample_norm in zip(q.get('grading_samples', []), snapshot.question_keys(q)[1]):
             
             # A. Exact/Normalized Match
             if normalized_student == sample_norm:
@@ -462,6 +597,8 @@ def find_similar_to_grading(
                 }
             
             # B. High Similarity Match (> 0.95) using SequenceMatcher
+            if not _length_ratio_bound(normalized_student, sample_norm, 0.95):
+                continue
             ratio = SequenceMatcher(None, normalized_student, sample_norm).ratio()
             if ratio > 0.95:
                 return {
@@ -474,9 +611,7 @@ def find_similar_to_grading(
     return None
 
 # ACTIVE LEARNING: Learn from Teacher Corrections
-import threading
 _learn_lock = threading.Lock()
-LEARNED_DATA_PATH = os.path.join(os.path.dirname(__file__), 'learned_data.json')
 
 
 def learn_correction(
@@ -488,7 +623,6 @@ def learn_correction(
 ) -> bool:
     # Learn from teacher correction. Saves the correction to learned_data.json
     # so AI repeats this grading for future similar answers.
-    global _model_index, _questions
     
     if not student_text or not model_text:
         return False
@@ -559,9 +693,9 @@ def learn_correction(
 
 def _reload_learned_patterns():
 
-    # Hot-reload learned patterns into the in-memory index.
-    global _model_index, _questions
-    
+    # Hot-reload learned patterns: new snapshot = current one + learned patterns not indexed yet.
+    # Built off to the side and published with one swap; a fresh snapshot also starts with an
+    # empty fuzzy-candidate cache (new model answers may now match where nothing did).
     try:
         if not os.path.exists(LEARNED_DATA_PATH):
             return
@@ -571,44 +705,52 @@ def _reload_learned_patterns():
             if not isinstance(learned_list, list):
                 return
         
-        # Convert to grading_questions format and add to index
-        for item in learned_list:
-            model_ans = item.get('model_answer', '')
-            if not model_ans:
-                continue
-                
-            norm_key = _normalize_key(model_ans)
-            if not norm_key:
-                continue
+        with _publish_lock:
+            base = current_snapshot()
+            questions = list(base.questions)
+            # norm model key -> normalized student answers already indexed
+            known: Dict[str, set] = {}
             
-            # Create pseudo question object
-            q_obj = {
-                "id": "learned_" + str(hash(model_ans)),
-                "model_answer": model_ans,
-                "max_points": item.get('max_points', 1.0),
-                "grading_samples": [{
-                    "student_answer": item.get('student_answer', ''),
-                    "score": item.get('confirmed_score', 0.0),
-                    "feedback": item.get('feedback', 'Learned Pattern'),
-                    "answer_type": "learned_pattern"
-                }]
-            }
-            
-            # Initialize key if not exists
-            if norm_key not in _model_index:
-                _model_index[norm_key] = []
-            
-            # Check if this student answer already exists in the list
-            existing_students = set()
-            for q in _model_index[norm_key]:
-                for sample in q.get('grading_samples', []):
-                    existing_students.add(_normalize_key(sample.get('student_answer', '')))
+            # Convert to grading_questions format and add to index
+            for item in learned_list:
+                model_ans = item.get('model_answer', '')
+                if not model_ans:
+                    continue
+                    
+                norm_key = _normalize_key(model_ans)
+                if not norm_key:
+                    continue
+                
+                # Check if this student answer already exists for this model answer
+                if norm_key not in known:
+                    known[norm_key] = {
+                        student_key
+                        for q in base.model_index.get(norm_key, ())
+                        for student_key in base.question_keys(q)[1]
+                    }
+                student_norm = _normalize_key(item.get('student_answer', ''))
+                if student_norm in known[norm_key]:
+                    continue
+                
+                # Create pseudo question object
+                q_obj = {
+                    "id": "learned_" + str(hash(model_ans)),
+                    "model_answer": model_ans,
+                    "max_points": item.get('max_points', 1.0),
+                    "grading_samples": [{
+                        "student_answer": item.get('student_answer', ''),
+                        "score": item.get('confirmed_score', 0.0),
+                        "feedback": item.get('feedback', 'Learned Pattern'),
+                        "answer_type": "learned_pattern"
+                    }]
+                }
+                known[norm_key].add(student_norm)
+                questions.append(q_obj)
             
-            student_norm = _normalize_key(item.get('student_answer', ''))
-            if student_norm not in existing_students:
-                _model_index[norm_key].append(q_obj)
-                if q_obj not in _questions:
-                    _questions.append(q_obj)
+            if len(questions) != len(base.questions):
+                # Existing questions keep their precomputed keys
+                keys = [base.question_keys(q) for q in questions]
+                _publish(questions, base.synonyms, base.contradictions, keys)
     
     except Exception as e:
         print(f"[AI Learning] Error reloading patterns: {e}")
@@ -634,7 +776,8 @@ def get_learning_stats() -> Dict:
         
         return {
             "total": len(learned_list),
-            "by_question": by_question
+            "by_question": by_question,
+            "snapshot": current_snapshot().stats()
         }
     
     except Exception as e:
@@ -645,7 +788,6 @@ def clear_learned_patterns() -> bool:
     """
     Clear all learned patterns. Use with caution!
     """
-    global _model_index, _questions
     
     with _learn_lock:
         try:
@@ -662,3 +804,31 @@ def clear_learned_patterns() -> bool:
             return False
 
 
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.dataset_learning", description="Prebuilt dataset snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="rebuild the snapshot file from the JSON sources")
+    sub.add_parser("info", help="show whether the snapshot file matches the sources")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        load_all_datasets(rebuild=True)
+        print(f"Wrote {SNAPSHOT_PATH} in {time.perf_counter() - start:.2f}s")
+        return 0
+
+    _, checksum = _read_sources()
+    payload = _load_snapshot_file(checksum)
+    print(json.dumps({
+        "path": SNAPSHOT_PATH,
+        "exists": bool(SNAPSHOT_PATH) and os.path.exists(SNAPSHOT_PATH),
+        "size_bytes": os.path.getsize(SNAPSHOT_PATH) if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH) else 0,
+        "sources_checksum": checksum,
+        "up_to_date": payload is not None,
+        "loaded": current_snapshot().stats(),
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
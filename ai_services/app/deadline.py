@@ -0,0 +1,133 @@
+# Request deadlines: stop grading work nobody is waiting for any more
+# - X-Deadline-Ms: remaining budget in milliseconds (relative, so no clock sync with the Node
+#   backend is needed). AIService.js sends its GRADING_TIMEOUT; requests without it get
+#   AI_DEFAULT_DEADLINE_MS (0 = none).
+# - The deadline lives in a contextvar (copied into the threadpool with the request) and is
+#   checked on every StageClock mark (stage listener) and before every model batch.
+# - Client disconnect (http.disconnect after the body was read) cancels the deadline too.
+# - Aborted work raises DeadlineExceeded -> 504; counted in ai_cancelled_total{reason,where}.
+# Disable with AI_DEADLINE_ENABLED=0.
+import asyncio
+import contextvars
+import os
+import time
+from typing import Optional
+
+from app.metrics import REGISTRY, add_stage_listener
+
+DEADLINE_ENABLED = os.getenv("AI_DEADLINE_ENABLED", "1").lower() not in ("0", "false", "no")
+DEFAULT_DEADLINE_MS = float(os.getenv("AI_DEFAULT_DEADLINE_MS", "0"))
+DEADLINE_HEADER = b"x-deadline-ms"
+
+CANCELLED_TOTAL = REGISTRY.counter(
+    "ai_cancelled_total", "Grading work aborted because its deadline passed or the client left.", ("reason", "where"))
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, reason: str, where: str):
+        super().__init__(f"Request {reason} at {where}")
+        self.reason = reason
+        self.where = where
+
+
+class Deadline:
+    __slots__ = ("expires_at", "cancelled", "finished")
+
+    def __init__(self, budget_s: Optional[float]):
+        self.expires_at = time.monotonic() + budget_s if budget_s else None
+        self.cancelled: Optional[str] = None  # "disconnect" once the client is gone
+        self.finished = False
+
+    def remaining(self) -> Optional[float]:
+        return None if self.expires_at is None else self.expires_at - time.monotonic()
+
+    def reason(self) -> Optional[str]:
+        if self.cancelled:
+            return self.cancelled
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            return "deadline"
+        return None
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("ai_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def check_deadline(where: str):
+    """Raise DeadlineExceeded if the current request's deadline passed or its client left."""
+    deadline = _current.get()
+    if deadline is None:
+        return
+    reason = deadline.reason()
+    if reason:
+        CANCELLED_TOTAL.inc(reason=reason, where=where)
+        raise DeadlineExceeded(reason, where)
+
+
+def _stage_listener(stage: str, start: float, end: float):
+    check_deadline(stage)
+
+
+if DEADLINE_ENABLED:
+    add_stage_listener(_stage_listener)
+
+
+def _parse_budget(headers) -> Optional[float]:
+    for key, value in headers:
+        if key == DEADLINE_HEADER:
+            try:
+                ms = float(value.decode("latin-1"))
+            except ValueError:
+                break
+            return ms / 1000 if ms > 0 else None
+    return DEFAULT_DEADLINE_MS / 1000 if DEFAULT_DEADLINE_MS > 0 else None
+
+
+class DeadlineMiddleware:
+    """Pure ASGI middleware: per-request Deadline + disconnect watcher."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DEADLINE_ENABLED or scope.get("method") != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(_parse_budget(scope.get("headers", [])))
+        watcher: Optional[asyncio.Task] = None
+
+        async def watch_disconnect():
+            message = await receive()
+            if message["type"] == "http.disconnect" and not deadline.finished:
+                deadline.cancelled = "disconnect"
+            return message
+
+        async def wrapped_receive():
+            nonlocal watcher
+            if watcher is not None:
+                # Body already read: whoever asks next gets the watcher's message
+                return await asyncio.shield(watcher)
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                watcher = asyncio.ensure_future(watch_disconnect())
+            elif message["type"] == "http.disconnect" and not deadline.finished:
+                deadline.cancelled = "disconnect"
+            return message
+
+        async def wrapped_send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                deadline.finished = True
+            await send(message)
+
+        token = _current.set(deadline)
+        try:
+            await self.app(scope, wrapped_receive, wrapped_send)
+        finally:
+            deadline.finished = True
+            _current.reset(token)
+            if watcher is not None and not watcher.done():
+                watcher.cancel()
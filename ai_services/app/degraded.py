@@ -0,0 +1,309 @@
+# Degraded grading under overload
+# - While the admission queue is deep (AI_DEGRADE_QUEUE_DEPTH) or recent /grade latency is high
+#   (p95 >= AI_DEGRADE_LATENCY_MS), bulk/recovery /grade requests skip the queue and are scored by
+#   UniversityGrader.grade_degraded (lexical layers + dataset memory, no transformer models).
+#   Hysteresis: leave degraded mode only when the queue is back under a quarter of the threshold,
+#   p95 under half of it, and at least AI_DEGRADE_MIN_SECONDS after entering.
+# - Degraded responses carry degraded=true + regrade_id. A background thread regrades them with
+#   the full pipeline once the service is idle (not degraded, nothing queued, a slot free), keeps
+#   the corrected result for GET /grade/regrades and POSTs it to the request's callback_url.
+# - Regrade priority (instructor-triggered) is never degraded.
+# Disable with AI_DEGRADE_ENABLED=0.
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEGRADE_ENABLED = os.getenv("AI_DEGRADE_ENABLED", "1").lower() not in ("0", "false", "no")
+DEGRADE_QUEUE_DEPTH = int(os.getenv("AI_DEGRADE_QUEUE_DEPTH", "16"))
+DEGRADE_LATENCY_MS = float(os.getenv("AI_DEGRADE_LATENCY_MS", "20000"))
+DEGRADE_MIN_SECONDS = float(os.getenv("AI_DEGRADE_MIN_SECONDS", "10"))
+REGRADE_PENDING_MAX = int(os.getenv("AI_DEGRADE_PENDING_MAX", "5000"))
+REGRADE_RESULTS_MAX = int(os.getenv("AI_DEGRADE_RESULTS_MAX", "5000"))
+# callback_url must match one of these origins, scheme://host[:port] with no port = any port
+# (the AI service should not POST anywhere it is told to)
+CALLBACK_ORIGINS = tuple(p.strip() for p in os.getenv(
+    "AI_DEGRADE_CALLBACK_ORIGINS", "http://localhost,http://127.0.0.1").split(",") if p.strip())
+CALLBACK_ATTEMPTS = 3
+
+LATENCY_WINDOW = 30.0  # seconds of full-pipeline latencies used for the p95
+LATENCY_SAMPLES = 200
+IDLE_POLL = 0.5
+
+DEGRADED_TOTAL = REGISTRY.counter(
+    "ai_degraded_responses_total", "Grading responses served by the degraded lexical path.", ("priority",))
+DEGRADED_REGRADES_TOTAL = REGISTRY.counter(
+    "ai_degraded_regrades_total", "Background full regrades of degraded responses.", ("outcome",))
+DEGRADED_CALLBACKS_TOTAL = REGISTRY.counter(
+    "ai_degraded_callbacks_total", "Corrected results pushed to callback_url.", ("outcome",))
+
+
+class OverloadDetector:
+    """Degraded on/off with hysteresis; checked by AdmissionMiddleware (event loop) and the regrade worker."""
+
+    def __init__(self, queue_depth: int = DEGRADE_QUEUE_DEPTH, latency_ms: float = DEGRADE_LATENCY_MS,
+                 min_seconds: float = DEGRADE_MIN_SECONDS):
+        self.queue_depth = max(1, queue_depth)
+        self.latency_ms = latency_ms
+        self.min_seconds = min_seconds
+        self.active = False
+        self.since: Optional[float] = None
+        self.entered = 0
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()  # state transitions (event loop + degraded-regrade thread)
+
+    def observe(self, seconds: float):
+        """Latency (queue wait + service) of one full-pipeline /grade request."""
+        self._latencies.append((time.monotonic(), seconds * 1000))
+
+    def p95_ms(self) -> float:
+        from app.slowlog import percentile
+        cutoff = time.monotonic() - LATENCY_WINDOW
+        # Snapshot: stats() reads this from the threadpool while the event loop appends
+        return percentile([ms for t, ms in list(self._latencies) if t >= cutoff], 95)
+
+    def check(self, queued: int) -> bool:
+        p95 = self.p95_ms()
+        with self._lock:
+            if not self.active:
+                if queued >= self.queue_depth or p95 >= self.latency_ms:
+                    self.since = time.monotonic()
+                    self.active = True
+                    self.entered += 1
+                    logger.warning(f"[Degraded] ⚠️ Quá tải (queue={queued}, p95={p95:.0f}ms): chuyển sang chấm lexical")
+            elif (time.monotonic() - self.since >= self.min_seconds
+                  and queued <= self.queue_depth // 4 and p95 < self.latency_ms / 2):
+                self.active = False
+                logger.warning(f"[Degraded] ✅ Hết quá tải (queue={queued}, p95={p95:.0f}ms): chấm đầy đủ trở lại")
+            return self.active
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active, since = self.active, self.since
+        return {
+            "enabled": DEGRADE_ENABLED,
+            "active": active,
+            "active_for_s": round(time.monotonic() - since, 3) if active else None,
+            "times_entered": self.entered,
+            "queue_depth_threshold": self.queue_depth,
+            "latency_threshold_ms": self.latency_ms,
+            "p95_ms": round(self.p95_ms(), 3),
+        }
+
+
+DETECTOR = OverloadDetector()
+
+
+class RegradeQueue:
+    """Degraded results waiting for a full regrade + the corrected results (bounded, thread-safe)."""
+
+    def __init__(self, pending_max: int = REGRADE_PENDING_MAX, results_max: int = REGRADE_RESULTS_MAX):
+        self.pending_max = pending_max
+        self.results_max = results_max
+        self._lock = threading.Lock()
+        self._pending: deque = deque()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.dropped = 0
+
+    def submit(self, request: Dict[str, Any], provisional: Dict[str, Any], callback_url: Optional[str]) -> Optional[str]:
+        """regrade_id, or None when the backlog is full (the provisional score then stands)."""
+        with self._lock:
+            if len(self._pending) >= self.pending_max:
+                self.dropped += 1
+                DEGRADED_REGRADES_TOTAL.inc(outcome="dropped")
+                return None
+            regrade_id = uuid.uuid4().hex
+            entry = {
+                "regrade_id": regrade_id,
+                "status": "pending",
+                "provisional_score": provisional.get("score"),
+                "request": request,
+                "callback_url": callback_url,
+                "created_at": time.time(),
+            }
+            self._entries[regrade_id] = entry
+            self._pending.append(regrade_id)
+            while len(self._entries) > self.results_max:
+                # Oldest finished results first; pending ones are never evicted
+                victim = next((k for k, e in self._entries.items() if e["status"] != "pending"), None)
+                if victim is None:
+                    break
+                del self._entries[victim]
+            return regrade_id
+
+    def next_pending(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            while self._pending:
+                entry = self._entries.get(self._pending.popleft())
+                if entry is not None:
+                    return entry
+            return None
+
+    def finish(self, regrade_id: str, **fields):
+        with self._lock:
+            entry = self._entries.get(regrade_id)
+            if entry is not None:
+                entry.update(fields)
+
+    def get(self, regrade_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(regrade_id)
+            return _public(entry) if entry else None
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for e in self._entries.values():
+                statuses[e["status"]] = statuses.get(e["status"], 0) + 1
+            return {"pending": len(self._pending), "stored": statuses, "dropped": self.dropped}
+
+
+def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in entry.items() if k not in ("request", "callback_url")}
+
+
+REGRADES = RegradeQueue()
+
+
+def _origin(url: str):
+    """(scheme, host, port or None) of a URL; None if it has userinfo, no host or stray whitespace."""
+    if url != url.strip():
+        return None
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    if "@" in parts.netloc or not parts.hostname:
+        return None
+    return parts.scheme.lower(), parts.hostname, port
+
+
+_ALLOWED_ORIGINS = [o for o in (_origin(p) for p in CALLBACK_ORIGINS) if o is not None]
+
+
+def callback_allowed(url: Optional[str]) -> bool:
+    """Parsed scheme/host/port against CALLBACK_ORIGINS (no string prefixes: http://127.0.0.1:@evil/ is evil)."""
+    origin = _origin(url) if url else None
+    if origin is None:
+        return False
+    scheme, host, port = origin
+    return any(scheme == s and host == h and (p is None or port == p) for s, h, p in _ALLOWED_ORIGINS)
+
+
+def grade_degraded(student_answer: str, model_answer: str, max_points: float, grading_mode: str,
+                   priority: str, callback_url: Optional[str] = None) -> Dict[str, Any]:
+    """Provisional lexical score + queued full regrade (called from the /grade endpoint)."""
+    from app.nlp import get_grader
+    result = get_grader().grade_degraded(student_answer, model_answer, max_points, grading_mode)
+    DEGRADED_TOTAL.inc(priority=priority)
+    request = {"student_answer": student_answer, "model_answer": model_answer,
+               "max_points": max_points, "grading_mode": grading_mode}
+    regrade_id = REGRADES.submit(request, result, callback_url if callback_allowed(callback_url) else None)
+    return {**result, "degraded": True, "regrade_id": regrade_id}
+
+
+# ===== BACKGROUND REGRADE =====
+
+def _idle() -> bool:
+    from app.admission import ADMISSION
+    queued = ADMISSION.queued()
+    # Re-evaluated here too: with no incoming /grade traffic nothing else would leave degraded mode
+    return (not DETECTOR.check(queued) and queued == 0
+            and ADMISSION.running < ADMISSION.max_concurrent)
+
+
+def _push(url: str, payload: Dict[str, Any]) -> bool:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    for attempt in range(CALLBACK_ATTEMPTS):
+        try:
+            req = urllib.request.Request(url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                if resp.status < 400:
+                    DEGRADED_CALLBACKS_TOTAL.inc(outcome="delivered")
+                    return True
+        except Exception as e:
+            logger.warning(f"[Degraded] callback {url} lần {attempt + 1} lỗi: {e}")
+        if attempt + 1 < CALLBACK_ATTEMPTS:
+            time.sleep(2 ** attempt)
+    DEGRADED_CALLBACKS_TOTAL.inc(outcome="failed")
+    return False
+
+
+def _regrade_one(entry: Dict[str, Any]):
+    from app.nlp import get_grader
+    req = entry["request"]
+    try:
+        result = get_grader().grade(req["student_answer"], req["model_answer"], req["max_points"], req["grading_mode"])
+    except Exception as e:
+        logger.error(f"[Degraded] ❌ Chấm lại {entry['regrade_id']} lỗi: {e}")
+        REGRADES.finish(entry["regrade_id"], status="failed", error=str(e), finished_at=time.time())
+        DEGRADED_REGRADES_TOTAL.inc(outcome="failed")
+        return
+    REGRADES.finish(entry["regrade_id"], status="done", result=result, finished_at=time.time())
+    DEGRADED_REGRADES_TOTAL.inc(outcome="done")
+    if entry.get("callback_url"):
+        delivered = _push(entry["callback_url"], {"regrade_id": entry["regrade_id"],
+                                                  "provisional_score": entry["provisional_score"], **result})
+        REGRADES.finish(entry["regrade_id"], delivered=delivered)
+
+
+def _worker_loop(stop: threading.Event):
+    while not stop.is_set():
+        if not _idle():
+            stop.wait(IDLE_POLL)
+            continue
+        entry = REGRADES.next_pending()
+        if entry is None:
+            stop.wait(IDLE_POLL)
+            continue
+        _regrade_one(entry)
+
+
+_worker: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def start_regrade_worker():
+    global _worker
+    if not DEGRADE_ENABLED or (_worker is not None and _worker.is_alive()):
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_worker_loop, args=(_stop,), name="degraded-regrade", daemon=True)
+    _worker.start()
+
+
+def stop_regrade_worker():
+    _stop.set()
+
+
+def get_regrades(ids: List[str]) -> List[Dict[str, Any]]:
+    return [r for r in (REGRADES.get(i) for i in ids) if r is not None]
+
+
+def stats() -> Dict[str, Any]:
+    return {**DETECTOR.stats(), "regrades": REGRADES.stats(),
+            "worker_alive": bool(_worker and _worker.is_alive())}
+
+
+def _degraded_samples():
+    yield "ai_degraded_active", "gauge", "1 while /grade is served by the degraded lexical path.", {}, int(DETECTOR.active)
+    yield "ai_degraded_regrade_pending", "gauge", "Degraded responses waiting for a full regrade.", {}, REGRADES.pending()
+
+
+REGISTRY.register_collector(_degraded_samples)
@@ -0,0 +1,363 @@
+# IP reputation table: allow/block by IP or CIDR (IPv4 + IPv6), blocks with optional expiry
+# - Lookup: per family, the CIDRs are flattened into sorted non-overlapping [lo, hi] integer
+#   intervals; one bisect per check (O(log n)). Allow entries win over blocks (whitelist first).
+# - Persistence: data/ip_reputation.tsv (AI_IP_REPUTATION_FILE), one line per change (added, action, cidr, expires, reason),
+#   appended by a background writer (app/log_pipeline.BatchedAppender); loaded and compacted
+#   once at startup. The legacy blacklist.txt is imported once on first load.
+# - Auto-blocks (SecurityMiddleware) last AI_SECURITY_BLOCK_TTL seconds (0 = permanent).
+#
+#   python -m app.ip_reputation block 203.0.113.0/24 --ttl 86400 --reason "scanner subnet"
+#   python -m app.ip_reputation allow 10.0.0.0/8
+#   python -m app.ip_reputation unblock 203.0.113.0/24
+#   python -m app.ip_reputation list
+# CLI changes take effect when the service restarts (the table is loaded once).
+import argparse
+import bisect
+import ipaddress
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.log_pipeline import batched_appender
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPUTATION_FILE = os.getenv("AI_IP_REPUTATION_FILE", os.path.join(BASE_DIR, "data", "ip_reputation.tsv"))
+LEGACY_BLACKLIST_FILE = "blacklist.txt"
+BLOCK_TTL = float(os.getenv("AI_SECURITY_BLOCK_TTL", "0"))
+MIGRATED_MARK = f"#migrated\t{LEGACY_BLACKLIST_FILE}"
+
+ALLOW, BLOCK, REMOVE = "allow", "block", "remove"
+INF = float("inf")
+
+
+class _Entry:
+    __slots__ = ("key", "action", "expires_at", "reason", "added_at", "lo", "hi", "version")
+
+    def __init__(self, key: str, action: str, expires_at: Optional[float], reason: str, added_at: float):
+        self.key = key  # normalized CIDR ("1.2.3.4/32") or a host name ("localhost")
+        self.action = action
+        self.expires_at = expires_at
+        self.reason = reason
+        self.added_at = added_at
+        network = _network(key)
+        self.version = network.version if network else None
+        self.lo = int(network.network_address) if network else None
+        self.hi = int(network.broadcast_address) if network else None
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+
+def _network(key: str):
+    try:
+        network = ipaddress.ip_network(key, strict=False)
+    except ValueError:
+        return None
+    if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped:
+        # ::ffff:a.b.c.d/N is the IPv4 network a.b.c.d/(N-96)
+        return ipaddress.ip_network(f"{network.network_address.ipv4_mapped}/{network.prefixlen - 96}", strict=False)
+    return network
+
+
+def _parse(ip: str) -> Optional[Tuple[int, int]]:
+    """(version, integer) of an address; inet_pton is ~10x cheaper than ipaddress.ip_address."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    except OSError:
+        return None
+    if value >> 32 == 0xFFFF:  # ::ffff:a.b.c.d
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+def normalize(ip_or_cidr: str) -> str:
+    network = _network(ip_or_cidr.strip())
+    return str(network) if network else ip_or_cidr.strip().lower()
+
+
+class _IntervalTable:
+    """Sorted disjoint intervals of one family; each carries the entry that decides it."""
+    __slots__ = ("starts", "ends", "entries")
+
+    def __init__(self, entries: List[_Entry]):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.entries: List[Tuple[_Entry, float]] = []  # (innermost entry, latest expiry over the nesting)
+        # CIDRs are either nested or disjoint: sweep outer-first, emitting the gaps between children
+        stack: List[Tuple[_Entry, float]] = []
+        cursor = 0
+        for e in sorted(entries, key=lambda e: (e.lo, -e.hi)):
+            while stack and stack[-1][0].hi < e.lo:
+                cursor = self._close(stack.pop(), cursor)
+            if stack and cursor < e.lo:
+                self._emit(cursor, e.lo - 1, stack[-1])
+            cursor = e.lo
+            outer = stack[-1][1] if stack else -INF
+            stack.append((e, max(outer, INF if e.expires_at is None else e.expires_at)))
+        while stack:
+            cursor = self._close(stack.pop(), cursor)
+
+    def _close(self, item: Tuple[_Entry, float], cursor: int) -> int:
+        if cursor <= item[0].hi:
+            self._emit(cursor, item[0].hi, item)
+        return max(cursor, item[0].hi + 1)
+
+    def _emit(self, lo: int, hi: int, item: Tuple[_Entry, float]):
+        self.starts.append(lo)
+        self.ends.append(hi)
+        self.entries.append(item)
+
+    def find(self, value: int) -> Optional[Tuple[_Entry, float]]:
+        i = bisect.bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self.entries[i]
+        return None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class IPReputation:
+    """Allow/block table. Reads take no lock (tables are swapped whole); writers serialize."""
+
+    def __init__(self, path: Optional[str] = REPUTATION_FILE):
+        self.path = path
+        self._entries: Dict[Tuple[str, str], _Entry] = {}  # (action, key) -> entry
+        self._lock = threading.Lock()
+        self._tables: Dict[Tuple[str, int], _IntervalTable] = {}
+        self._names: Dict[Tuple[str, str], _Entry] = {}
+        self._next_expiry = INF
+        self._journal = batched_appender(path) if path else None
+        self.loaded = False
+
+    # ----- lookup -----
+
+    def check(self, ip: str, now: Optional[float] = None) -> Optional[str]:
+        """ALLOW, BLOCK or None (unknown)."""
+        now = time.time() if now is None else now
+        if now >= self._next_expiry:
+            self._rebuild()
+        parsed = _parse(ip)
+        if self._match(ALLOW, ip, now, parsed) is not None:
+            return ALLOW
+        return BLOCK if self._match(BLOCK, ip, now, parsed) is not None else None
+
+    def block_reason(self, ip: str) -> Optional[str]:
+        entry = self._match(BLOCK, ip, time.time(), _parse(ip))
+        return entry.reason if entry else None
+
+    def _match(self, action: str, ip: str, now: float, parsed: Optional[Tuple[int, int]]) -> Optional[_Entry]:
+        if parsed is None:
+            entry = self._names.get((action, ip.strip().lower()))
+            return entry if entry is not None and not entry.expired(now) else None
+        table = self._tables.get((action, parsed[0]))
+        found = table.find(parsed[1]) if table else None
+        if found is None or found[1] <= now:
+            return None
+        return found[0]
+
+    # ----- changes -----
+
+    def allow(self, ip_or_cidr: str, reason: str = "", persist: bool = True):
+        self._set(ALLOW, ip_or_cidr, None, reason, persist)
+
+    def block(self, ip_or_cidr: str, reason: str = "", ttl: Optional[float] = None, persist: bool = True) -> bool:
+        """Block (ttl seconds, None/0 = permanent); False if it is allowed or already blocked."""
+        key = normalize(ip_or_cidr)
+        now = time.time()
+        existing = self._entries.get((BLOCK, key))
+        if (existing is not None and not existing.expired(now)) or self._match(ALLOW, key.split("/")[0], now, _parse(key.split("/")[0])):
+            return False
+        self._set(BLOCK, key, now + ttl if ttl else None, reason, persist)
+        return True
+
+    def remove(self, ip_or_cidr: str, persist: bool = True) -> bool:
+        key = normalize(ip_or_cidr)
+        with self._lock:
+            removed = [self._entries.pop((a, key), None) for a in (ALLOW, BLOCK)]
+            if not any(removed):
+                return False
+            self._rebuild_locked()
+        if persist:
+            self._write(REMOVE, key, None, "")
+        return True
+
+    def _set(self, action: str, ip_or_cidr: str, expires_at: Optional[float], reason: str, persist: bool):
+        key = normalize(ip_or_cidr)
+        entry = _Entry(key, action, expires_at, reason, time.time())
+        with self._lock:
+            self._entries[(action, key)] = entry
+            self._rebuild_locked()
+        if persist:
+            self._write(action, key, expires_at, reason, entry.added_at)
+
+    def _rebuild(self):
+        with self._lock:
+            self._rebuild_locked()
+
+    def _rebuild_locked(self):
+        now = time.time()
+        for k in [k for k, e in self._entries.items() if e.expired(now)]:
+            del self._entries[k]
+        grouped: Dict[Tuple[str, int], List[_Entry]] = {}
+        names: Dict[Tuple[str, str], _Entry] = {}
+        for (action, key), e in self._entries.items():
+            if e.version is None:
+                names[(action, key)] = e
+            else:
+                grouped.setdefault((action, e.version), []).append(e)
+        expiries = [e.expires_at for e in self._entries.values() if e.expires_at is not None]
+        # Publish whole tables: readers on the event loop never see a half-built one
+        self._tables = {k: _IntervalTable(v) for k, v in grouped.items()}
+        self._names = names
+        self._next_expiry = min(expiries) if expiries else INF
+
+    # ----- persistence -----
+
+    def _write(self, action: str, key: str, expires_at: Optional[float], reason: str, added_at: Optional[float] = None):
+        if self._journal is not None:
+            self._journal.append(_line(action, key, expires_at, reason, added_at or time.time()))
+
+    def load(self) -> int:
+        """Read the table once (startup), import blacklist.txt on first run, compact the file."""
+        now = time.time()
+        lines = 0
+        migrated = False
+        with self._lock:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for raw in f:
+                        raw = raw.rstrip("\n")
+                        if raw == MIGRATED_MARK:
+                            migrated = True
+                            continue
+                        if not raw or raw.startswith("#"):
+                            continue
+                        lines += 1
+                        parts = raw.split("\t", 4)
+                        if len(parts) < 5:
+                            continue
+                        added, action, key, expires, reason = parts
+                        if action == REMOVE:
+                            for a in (ALLOW, BLOCK):
+                                self._entries.pop((a, key), None)
+                            continue
+                        expires_at = float(expires) if expires else None
+                        if expires_at is not None and expires_at <= now:
+                            self._entries.pop((action, key), None)
+                            continue
+                        self._entries[(action, key)] = _Entry(key, action, expires_at, reason, float(added))
+            imported = 0 if migrated else self._import_legacy()
+            self._rebuild_locked()
+            if self.path and (imported or lines != len(self._entries) or not migrated):
+                self._compact_locked()
+            self.loaded = True
+        logger.info(f"[Security] IP reputation: {len(self._entries)} entries"
+                    + (f" ({imported} imported from {LEGACY_BLACKLIST_FILE})" if imported else ""))
+        return len(self._entries)
+
+    def _import_legacy(self) -> int:
+        imported = 0
+        try:
+            with open(LEGACY_BLACKLIST_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    # "<iso time> - <ip> - <reason>"
+                    parts = line.strip().split(" - ", 2)
+                    if line.startswith("#") or len(parts) < 2 or _network(parts[1]) is None:
+                        continue
+                    key = normalize(parts[1])
+                    if (BLOCK, key) not in self._entries:
+                        self._entries[(BLOCK, key)] = _Entry(key, BLOCK, None, parts[2] if len(parts) > 2 else "", time.time())
+                        imported += 1
+        except FileNotFoundError:
+            pass
+        return imported
+
+    def _compact_locked(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(MIGRATED_MARK + "\n")
+            for e in sorted(self._entries.values(), key=lambda e: e.added_at):
+                f.write(_line(e.action, e.key, e.expires_at, e.reason, e.added_at))
+        os.replace(tmp_path, self.path)
+
+    def flush(self):
+        if self._journal is not None:
+            self._journal.flush()
+
+    # ----- introspection -----
+
+    def entries(self) -> List[Dict]:
+        now = time.time()
+        return [{"cidr": e.key, "action": e.action, "reason": e.reason, "added_at": e.added_at,
+                 "expires_at": e.expires_at}
+                for e in sorted(self._entries.values(), key=lambda e: e.added_at) if not e.expired(now)]
+
+    def stats(self) -> Dict:
+        counts: Dict[str, int] = {}
+        for action, _ in list(self._entries):
+            counts[action] = counts.get(action, 0) + 1
+        return {
+            "file": self.path,
+            "entries": counts,
+            "intervals": {f"{a}_v{v}": len(t) for (a, v), t in self._tables.items()},
+            "names": len(self._names),
+            "next_expiry": None if self._next_expiry == INF else self._next_expiry,
+            "block_ttl_s": BLOCK_TTL or None,
+        }
+
+
+def _line(action: str, key: str, expires_at: Optional[float], reason: str, added_at: float) -> str:
+    reason = reason.replace("\t", " ").replace("\n", " ")
+    expires = f"{expires_at:.3f}" if expires_at is not None else ""
+    return f"{added_at:.3f}\t{action}\t{key}\t{expires}\t{reason}\n"
+
+
+REPUTATION = IPReputation()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.ip_reputation", description="IP allow/block table.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("block", "allow", "unblock"):
+        p = sub.add_parser(name)
+        p.add_argument("cidr")
+        p.add_argument("--reason", default="manual")
+        if name == "block":
+            p.add_argument("--ttl", type=float, default=0, help="seconds (0 = permanent)")
+    p = sub.add_parser("check")
+    p.add_argument("ip")
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    REPUTATION.load()
+    if args.command == "block":
+        if not REPUTATION.block(args.cidr, args.reason, args.ttl):
+            print(f"{args.cidr}: allowed or already blocked")
+    elif args.command == "allow":
+        REPUTATION.allow(args.cidr, args.reason)
+    elif args.command == "unblock":
+        if not REPUTATION.remove(args.cidr):
+            print(f"{args.cidr}: not in the table")
+    elif args.command == "check":
+        print(REPUTATION.check(args.ip) or "unknown")
+    else:
+        for e in REPUTATION.entries():
+            expires = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["expires_at"])) if e["expires_at"] else "never"
+            print(f"{e['action']:<6} {e['cidr']:<40} expires {expires:<17} {e['reason']}")
+    REPUTATION.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,12 @@
 import os
 import json
 import re
+import threading
 from typing import Dict, List, Optional, Tuple, Set
 from sentence_transformers import SentenceTransformer, util
 from datetime import datetime
 from underthesea import word_tokenize as vn_word_tokenize
+from app.tracing import span
 
 
 SYNONYMS_FILE = os.path.join(os.path.dirname(__file__), "learned_synonyms.json")
@@ -282,11 +284,15 @@ LEARNED_DATA_PATH = os.path.join(os.path.dirname(__file__), "learned_data.json")
 class LearningEngine:
 
     # AI Learning Engine that learns from instructor feedback.
+    # patterns_cache / synonyms are copy-on-write: writers build a new list/dict and publish it
+    # with one attribute assignment (version += 1), readers just grab the current reference.
     def __init__(self, model: SentenceTransformer = None):
         self.model = model
-        self.patterns_cache: List[Dict] = []  # Cached confirmed patterns
-        self.synonyms: Dict[str, Set[str]] = {}  # Learned synonyms
+        self.patterns_cache: List[Dict] = []  # Cached confirmed patterns (never mutated in place)
+        self.synonyms: Dict[str, Set[str]] = {}  # Learned synonyms (never mutated in place)
         self.last_reload: datetime = None
+        self.version = 0
+        self._write_lock = threading.RLock()  # Serializes writers only
         
         # Load base Vietnamese synonyms
         self._load_base_synonyms()
@@ -312,6 +318,11 @@ class LearningEngine:
                 self.synonyms[normalized_v].add(normalized_key)
 
 
+    def _publish_patterns(self, patterns: List[Dict]):
+        # Caller holds _write_lock
+        self.patterns_cache = patterns
+        self.version += 1
+
     def _load_patterns_from_file(self):
         # Load learned patterns from JSON file
         try:
@@ -319,8 +330,9 @@ class LearningEngine:
                 with open(LEARNED_DATA_PATH, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     if isinstance(data, list):
-                        self.patterns_cache = data
-                        print(f"[Learning] Loaded {len(self.patterns_cache)} learned patterns from file")
+                        with self._write_lock:
+                            self._publish_patterns(data)
+                        print(f"[Learning] Loaded {len(data)} learned patterns from file")
                     else:
                         print("[Learning] Warning: learned_data.json is not a list")
         except Exception as e:
@@ -328,10 +340,11 @@ class LearningEngine:
 
     def _save_patterns_to_file(self):
         # Save learned patterns to JSON file
+        patterns = self.patterns_cache
         try:
             with open(LEARNED_DATA_PATH, 'w', encoding='utf-8') as f:
-                json.dump(self.patterns_cache, f, ensure_ascii=False, indent=2)
-            print(f"[Learning] Saved {len(self.patterns_cache)} patterns to file")
+                json.dump(patterns, f, ensure_ascii=False, indent=2)
+            print(f"[Learning] Saved {len(patterns)} patterns to file")
         except Exception as e:
             print(f"[Learning] Could not save patterns file: {e}")
     
@@ -418,52 +431,52 @@ class LearningEngine:
                   AND al.model_answer IS NOT NULL
             """
             print("[Learning] Executing DB query...")
-            cursor.execute(query)
-            results = cursor.fetchall()
+            with span("db.query", table="ai_logs") as query_span:
+                cursor.execute(query)
+                results = cursor.fetchall()
+                query_span.set(rows=len(results))
             print(f"[Learning] DB Query returned {len(results)} rows")
             synonym_candidates = []
             count_new = 0
             
-            for row in results:
-                pattern = {
-                    "student_answer": row["student_answer"],
-                    "model_answer": row["model_answer"],
-                    "confirmed_score": float(row["confirmed_score"]) if row["confirmed_score"] else 0,
-                    "ai_score": float(row["ai_suggested_score"]) if row["ai_suggested_score"] else 0,
-                    "max_points": float(row["max_points"]) if row["max_points"] else 1.0
-                }
-                
-                # Check for duplicates efficiently
-                is_duplicate = False
-                p_stud_norm = self._normalize(pattern["student_answer"])
-                p_mod_norm = self._normalize(pattern["model_answer"])
-
-                for existing in self.patterns_cache:
-                    if (self._normalize(existing["student_answer"]) == p_stud_norm and
-                        self._normalize(existing["model_answer"]) == p_mod_norm):
-                        is_duplicate = True
-                        break
+            # Merge into a copy, published below in one swap (graders keep reading the old list)
+            with self._write_lock:
+                patterns = list(self.patterns_cache)
+                seen = {(self._normalize(p["student_answer"]), self._normalize(p["model_answer"])) for p in patterns}
+            
+                for row in results:
+                    pattern = {
+                        "student_answer": row["student_answer"],
+                        "model_answer": row["model_answer"],
+                        "confirmed_score": float(row["confirmed_score"]) if row["confirmed_score"] else 0,
+                        "ai_score": float(row["ai_suggested_score"]) if row["ai_suggested_score"] else 0,
+                        "max_points": float(row["max_points"]) if row["max_points"] else 1.0
+                    }
                 
-                if not is_duplicate:
-                    self.patterns_cache.append(pattern)
-                    count_new += 1
+                    # Check for duplicates efficiently
+                    key = (self._normalize(pattern["student_answer"]), self._normalize(pattern["model_answer"]))
+                    if key not in seen:
+                        seen.add(key)
+                        patterns.append(pattern)
+                        count_new += 1
                 
-                # Detect potential synonyms (logic remains same)
-                if pattern["max_points"] > 0:
-                    ai_ratio = pattern["ai_score"] / pattern["max_points"]
-                    confirmed_ratio = pattern["confirmed_score"] / pattern["max_points"]
+                    # Detect potential synonyms (logic remains same)
+                    if pattern["max_points"] > 0:
+                        ai_ratio = pattern["ai_score"] / pattern["max_points"]
+                        confirmed_ratio = pattern["confirmed_score"] / pattern["max_points"]
                     
-                    if ai_ratio < 0.6 and confirmed_ratio > 0.8:
-                        synonym_candidates.append({
-                            "student_words": self._tokenize(row["student_answer"]),
-                            "model_words": self._tokenize(row["model_answer"]),
-                            "score_diff": confirmed_ratio - ai_ratio
-                        })
+                        if ai_ratio < 0.6 and confirmed_ratio > 0.8:
+                            synonym_candidates.append({
+                                "student_words": self._tokenize(row["student_answer"]),
+                                "model_words": self._tokenize(row["model_answer"]),
+                                "score_diff": confirmed_ratio - ai_ratio
+                            })
 
-            # Save merged result to file
-            if count_new > 0:
-                self._save_patterns_to_file()
-                print(f"[Learning] DB Sync: Merged {count_new} new patterns from DB. Total cache: {len(self.patterns_cache)}")
+                # Save merged result to file
+                if count_new > 0:
+                    self._publish_patterns(patterns)
+                    self._save_patterns_to_file()
+                    print(f"[Learning] DB Sync: Merged {count_new} new patterns from DB. Total cache: {len(patterns)}")
             
             # Learn synonyms from candidates
             print(f"[Learning] Processing {len(synonym_candidates)} synonym candidates...")
@@ -497,6 +510,11 @@ class LearningEngine:
         SIMILARITY_THRESHOLD = 0.60  # Learn if similarity > 60% (lowered to catch real synonyms)
         MIN_WORD_LENGTH = 6  # Skip single-syllable words (dưới, giỏi = 4 chars) to avoid false positives
         
+        # Pairs are found without the lock (model encoding is slow), then merged under _write_lock
+        # into a fresh copy of the current synonyms and published in one swap
+        synonyms = self.synonyms
+        found: List[Tuple[str, str]] = []
+        
         for candidate in candidates:
             student_words = candidate["student_words"]  # Already tokenized with underthesea
             model_words = candidate["model_words"]
@@ -566,7 +584,7 @@ class LearningEngine:
                             print(f"[Learning] 🎯 Pair meets threshold ({sim:.0%}): '{s_phrase}' ↔ '{m_phrase}'")
                             
                             # Skip if already known
-                            if m_phrase in self.synonyms and s_phrase in self.synonyms[m_phrase]:
+                            if m_phrase in synonyms and s_phrase in synonyms[m_phrase]:
                                 print(f"[Learning] ⏭️ Skipping (already known): '{s_phrase}' ↔ '{m_phrase}'")
                                 continue
                             
@@ -575,16 +593,7 @@ class LearningEngine:
                                 print(f"[Learning] ⏭️ Skipping (same phrase): '{s_phrase}'")
                                 continue
                             
-                            # Add bidirectional mapping
-                            if m_phrase not in self.synonyms:
-                                self.synonyms[m_phrase] = set()
-                            self.synonyms[m_phrase].add(s_phrase)
-                            
-                            if s_phrase not in self.synonyms:
-                                self.synonyms[s_phrase] = set()
-                            self.synonyms[s_phrase].add(m_phrase)
-                            
-                            new_synonyms_count += 1
+                            found.append((s_phrase, m_phrase))
                             print(f"[Learning] ✅ NEW synonym added: '{s_phrase}' ↔ '{m_phrase}'")
                             
             except Exception as e:
@@ -593,6 +602,20 @@ class LearningEngine:
                 traceback.print_exc()
                 continue
         
+        if found:
+            with self._write_lock:
+                # Re-read under the lock: concurrent runs / DB reloads published since are kept
+                synonyms = {k: set(v) for k, v in self.synonyms.items()}
+                for s_phrase, m_phrase in found:
+                    # Add bidirectional mapping
+                    if s_phrase in synonyms.get(m_phrase, ()):
+                        continue
+                    synonyms.setdefault(m_phrase, set()).add(s_phrase)
+                    synonyms.setdefault(s_phrase, set()).add(m_phrase)
+                    new_synonyms_count += 1
+                if new_synonyms_count > 0:
+                    self.synonyms = synonyms
+                    self.version += 1
         if new_synonyms_count > 0:
             # self._save_learned_synonyms() # Disabled file saving
             print(f"[Learning] Found {new_synonyms_count} potential synonym pairs (in-memory only)")
@@ -600,12 +623,13 @@ class LearningEngine:
     def expand_with_synonyms(self, text: str) -> str:
         words = self._tokenize(text)
         expanded_words = []
+        synonyms = self.synonyms
         
         for word in words:
             expanded_words.append(word)
             # Add synonyms if available
-            if word in self.synonyms:
-                for syn in self.synonyms[word]:
+            if word in synonyms:
+                for syn in synonyms[word]:
                     if syn not in expanded_words:
                         expanded_words.append(syn)
         
@@ -613,7 +637,8 @@ class LearningEngine:
     
     def find_similar_pattern(self, student_answer: str, model_answer: str, 
                             threshold: float = 0.88) -> Optional[Dict]:
-        if not self.patterns_cache:
+        patterns = self.patterns_cache
+        if not patterns:
             return None
         
         student_norm = self._normalize(student_answer)
@@ -627,7 +652,7 @@ class LearningEngine:
         best_match = None
         best_sim = 0.0
         
-        for pattern in self.patterns_cache:
+        for pattern in patterns:
             # Check if model answer matches (same question context)
             pattern_model_norm = self._normalize(pattern["model_answer"])
             if pattern_model_norm != model_norm:
@@ -676,22 +701,25 @@ class LearningEngine:
         stud_norm = self._normalize(student_answer)
         mod_norm = self._normalize(model_answer)
         
-        updated = False
-        for p in self.patterns_cache:
-            if (self._normalize(p["student_answer"]) == stud_norm and 
-                self._normalize(p["model_answer"]) == mod_norm):
-                # Update existing score
-                p["confirmed_score"] = float(confirmed_score)
-                updated = True
-                print(f"[Learning] Updated existing pattern in cache: '{student_answer[:20]}...'")
-                break
+        with self._write_lock:
+            patterns = list(self.patterns_cache)
+            updated = False
+            for i, p in enumerate(patterns):
+                if (self._normalize(p["student_answer"]) == stud_norm and 
+                    self._normalize(p["model_answer"]) == mod_norm):
+                    # Update existing score (new dict: readers may hold the old one)
+                    patterns[i] = {**p, "confirmed_score": float(confirmed_score)}
+                    updated = True
+                    print(f"[Learning] Updated existing pattern in cache: '{student_answer[:20]}...'")
+                    break
 
-        if not updated:
-            self.patterns_cache.append(pattern)
-            print(f"[Learning] Added new live pattern to cache: '{student_answer[:20]}...' (Score: {confirmed_score})")
+            if not updated:
+                patterns.append(pattern)
+                print(f"[Learning] Added new live pattern to cache: '{student_answer[:20]}...' (Score: {confirmed_score})")
             
-        # Save to file immediately
-        self._save_patterns_to_file()
+            self._publish_patterns(patterns)
+            # Save to file immediately
+            self._save_patterns_to_file()
     
     def get_stats(self) -> Dict:
         #Get learning statistics
@@ -700,7 +728,8 @@ class LearningEngine:
             "total_synonym_groups": len(self.synonyms),
             "base_synonyms": len(VIETNAMESE_SYNONYMS),
             "learned_synonyms": len(self.synonyms) - len(VIETNAMESE_SYNONYMS),
-            "last_reload": self.last_reload.isoformat() if self.last_reload else None
+            "last_reload": self.last_reload.isoformat() if self.last_reload else None,
+            "version": self.version
         }
 
 
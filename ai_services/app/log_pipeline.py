@@ -0,0 +1,130 @@
+# Non-blocking logging for the request path
+# - Every record goes through a QueueHandler on the root logger; one QueueListener thread does the
+#   console + security.log writes, so a slow disk never adds to request (grading) latency.
+# - security.log rotates by size (AI_LOG_MAX_BYTES, AI_LOG_BACKUPS).
+# - BatchedAppender: append-only text files written in batches by a background thread
+#   (the data/ip_reputation.tsv journal), flushed every AI_LOG_FLUSH_SECONDS and on shutdown.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import List, Optional
+
+LOG_FILE = os.getenv("AI_LOG_FILE", "security.log")
+LOG_MAX_BYTES = int(os.getenv("AI_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("AI_LOG_BACKUPS", "5"))
+FLUSH_SECONDS = float(os.getenv("AI_LOG_FLUSH_SECONDS", "1.0"))
+FLUSH_LINES = 1000  # write early when this many lines are pending
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Route root logging through a queue to console + rotating LOG_FILE (idempotent)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers: List[logging.Handler] = [logging.StreamHandler()]
+        if LOG_FILE:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def stop_logging():
+    """Drain the queue and stop the writer thread (pending records are written first)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    root.removeHandler(handler)
+
+
+class BatchedAppender:
+    """Append-only text file; lines are buffered and written by a background thread in batches."""
+
+    def __init__(self, path: str, flush_seconds: float = FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+
+    def append(self, line: str):
+        """Never touches the disk; starts the writer thread on first use."""
+        with self._lock:
+            self._pending.append(line if line.endswith("\n") else line + "\n")
+            if len(self._pending) >= FLUSH_LINES:
+                self._wake.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"append-{os.path.basename(self.path)}", daemon=True)
+                self._thread.start()
+
+    def flush(self) -> int:
+        """Write everything pending now (writer thread, shutdown, tests); returns lines written."""
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if not lines:
+            return 0
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError as e:
+            logging.getLogger(__name__).error(f"[Log] Không ghi được {self.path}: {e}")
+            with self._lock:
+                self._pending[:0] = lines  # retry with the next batch
+            return 0
+        self.written += len(lines)
+        return len(lines)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+_appenders: List[BatchedAppender] = []
+
+
+def batched_appender(path: str) -> BatchedAppender:
+    appender = BatchedAppender(path)
+    _appenders.append(appender)
+    return appender
+
+
+def flush_all():
+    """Shutdown hook: write pending batched lines, then drain the log queue."""
+    for appender in _appenders:
+        appender.flush()
+    stop_logging()
+
+
+atexit.register(flush_all)
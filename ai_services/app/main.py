@@ -1,9 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from app.schemas import GradeRequest, GradeResponse
-from app.nlp import calculate_score, get_model
-from app.security import SecurityMiddleware, load_blacklist
+from app.schemas import GradeRequest, GradeResponse, BatchGradeRequest, BatchGradeResponse, PrepareQuestionsRequest, RegradeQuestionRequest
+from app.nlp import calculate_score, calculate_scores_clustered, get_grader, regrade_question, get_model, get_ai_model
+from app.security import RATE_LIMITER, SecurityMiddleware, load_blacklist
+from app.ip_reputation import REPUTATION
+from app.admission import ADMISSION, AdmissionMiddleware
+from app.deadline import DeadlineExceeded, DeadlineMiddleware
+from app import behavior_sessions, degraded, log_pipeline
+from app.metrics import METRICS_ENABLED, REGISTRY, MetricsMiddleware
+from app.tracing import TRACING_ENABLED, TracingMiddleware, get_traces, span
+from app.slowlog import SLOW_CAPTURE, SLOW_CAPTURE_ENABLED
+from app.profiling import PROFILING_ENABLED, ProfilingMiddleware, get_profile, list_profiles, profile_process
+from app.admin import require_admin
 import uvicorn
 import os
 import json
@@ -20,6 +30,12 @@ except ImportError:
 
 app = FastAPI(title="AI Grading Service", version="1.2.0")
 
+# Admission control innermost: only requests that pass the security checks take a grading slot
+app.add_middleware(AdmissionMiddleware)
+
+# X-Deadline-Ms / client disconnect -> abort grading nobody waits for (wraps the admission wait)
+app.add_middleware(DeadlineMiddleware)
+
 # Add security middleware FIRST
 app.add_middleware(SecurityMiddleware)
 
@@ -36,10 +52,23 @@ app.add_middleware(
         "http://localhost:5000",
     ],
     allow_credentials=True,
-    allow_methods=["POST", "GET", "OPTIONS"],
+    allow_methods=["POST", "GET", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
 
+# Latency / in-flight metrics for every request (incl. rejected ones)
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in profiling (X-Profile-Token / AI_PROFILE_SAMPLE_RATE); profile id = trace id
+app.add_middleware(ProfilingMiddleware)
+
+# Outermost: trace id from the Node backend (X-Trace-Id / traceparent) + root span
+app.add_middleware(TracingMiddleware)
+
+@app.exception_handler(DeadlineExceeded)
+def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc), "reason": exc.reason})
+
 # ===== AUTO-RETRAIN SYSTEM =====
 RETRAIN_THRESHOLD = int(os.getenv("RETRAIN_THRESHOLD", "1"))  # Số corrections cần đạt để auto-retrain
 RETRAIN_LOG_PATH = os.path.join(os.path.dirname(__file__), "retrain_history.json")
@@ -118,7 +147,8 @@ def _do_auto_retrain():
                     "database": os.getenv("DB_NAME", "oem_mini"),
                     "charset": "utf8mb4"
                 }
-                conn = mysql.connector.connect(**db_config)
+                with span("db.connect", database=db_config["database"]):
+                    conn = mysql.connector.connect(**db_config)
                 db_count = engine.load_patterns_from_db(conn)
                 conn.close()
             except Exception as e:
@@ -214,7 +244,8 @@ def startup_event():
                 "charset": "utf8mb4"
             }
             print(f"[Learning] Connecting to database {db_config['database']}@{db_config['host']}...")
-            conn = mysql.connector.connect(**db_config)
+            with span("db.connect", database=db_config["database"]):
+                conn = mysql.connector.connect(**db_config)
             count = engine.load_patterns_from_db(conn)
             conn.close()
             print(f"[Learning] ✅ Loaded {count} instructor-confirmed patterns from database")
@@ -225,11 +256,29 @@ def startup_event():
             print(f"[Learning] ⚠️ Could not load patterns from DB: {e}")
             print("[Learning] ℹ️ Using file-based synonyms only")
     
+    degraded.start_regrade_worker()
     print("[Ready] AI Service Ready!")
 
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Pending blacklist lines + queued log records hit the disk before exit
+    log_pipeline.flush_all()
+
 @app.post("/grade", response_model=GradeResponse)
-def grade_answer(request: GradeRequest):
+def grade_answer(request: GradeRequest, http_request: Request):
     try:
+        degraded_priority = getattr(http_request.state, "degraded", None)
+        if degraded_priority:
+            # Quá tải: chấm tạm không dùng model, chấm lại đầy đủ ở background
+            return degraded.grade_degraded(
+                request.student_answer,
+                request.model_answer,
+                request.max_points,
+                request.grading_mode,
+                degraded_priority,
+                request.callback_url
+            )
         result = calculate_score(
             request.student_answer,
             request.model_answer,
@@ -237,14 +286,185 @@ def grade_answer(request: GradeRequest):
             request.grading_mode
         )
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error grading: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/grade/regrades")
+def get_regrades(ids: str = ""):
+    """Kết quả chấm lại của các bài đã chấm tạm (ids cách nhau bởi dấu phẩy)."""
+    return {"results": degraded.get_regrades([i for i in ids.split(",") if i.strip()])}
+
+@app.get("/grade/regrades/{regrade_id}")
+def get_regrade(regrade_id: str):
+    result = degraded.REGRADES.get(regrade_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown regrade_id")
+    return result
+
+@app.post("/grade/batch", response_model=BatchGradeResponse)
+def grade_answers_batch(request: BatchGradeRequest):
+    """
+    Chấm tất cả bài của 1 câu hỏi trong kỳ thi.
+    Bài giống nhau (hash chuẩn hoá / embedding rất gần) chỉ chấm 1 lần rồi lan truyền điểm.
+    """
+    try:
+        batch = calculate_scores_clustered(
+            [a.student_answer for a in request.answers],
+            request.model_answer,
+            request.max_points,
+            request.grading_mode
+        )
+        results = [
+            {**result, "answer_id": answer.answer_id}
+            for answer, result in zip(request.answers, batch["results"])
+        ]
+        return {"results": results, "cluster_stats": batch["stats"]}
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error batch grading: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/questions/prepare")
+def prepare_questions(request: PrepareQuestionsRequest):
+    """
+    Gọi khi giảng viên công bố/sửa đề: tính sẵn và ghim artifact của đáp án mẫu
+    để đợt nộp bài đầu tiên không phải chịu cold cache.
+    """
+    import time
+    grader = get_grader()
+    start = time.perf_counter()
+    for old in request.release:
+        grader.release_model_answer(old.model_answer, old.grading_mode)
+
+    prepared = []
+    for q in request.questions:
+        try:
+            summary = grader.prepare_model_answer(q.model_answer, q.grading_mode)
+            prepared.append({"question_id": q.question_id, "status": "ok", **summary})
+        except Exception as e:
+            print(f"Error preparing question {q.question_id}: {e}")
+            prepared.append({"question_id": q.question_id, "status": "error", "error": str(e)})
+
+    return {
+        "status": "ok",
+        "prepared": prepared,
+        "released": len(request.release),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+@app.post("/questions/regrade")
+def regrade_question_endpoint(request: RegradeQuestionRequest):
+    """
+    Chấm lại cả lớp sau khi sửa đáp án mẫu. Trả về NDJSON (stream):
+    1 dòng "plan" (diff các ý), 1 dòng "result" mỗi bài, 1 dòng "summary".
+    """
+    from fastapi.responses import StreamingResponse
+
+    def stream():
+        try:
+            for event in regrade_question(
+                [a.dict() for a in request.answers],
+                request.old_model_answer,
+                request.new_model_answer,
+                request.max_points,
+                request.grading_mode
+            ):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error regrading: {e}")
+            yield json.dumps({"event": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "AI Grading Service", "version": "1.2.0"}
 
+@app.get("/model/stats")
+def model_stats():
+    """Encoder tiers: cache hit rate, memory (params + cached embeddings), cascade usage."""
+    return {"status": "ok", "stats": get_ai_model().get_stats()}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: stage latency, early exits, cache hit rates, batch sizes, in-flight requests."""
+    from fastapi.responses import PlainTextResponse
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled (AI_METRICS_ENABLED=0)")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Every /debug/* route is admin-only (X-Admin-Token, see app/admin.py); 404 without a valid token
+debug = APIRouter(prefix="/debug", dependencies=[Depends(require_admin)])
+
+@debug.get("/traces")
+def debug_traces(limit: int = 50, trace_id: Optional[str] = None, min_duration_ms: float = 0.0):
+    """Recent request traces (ring buffer). trace_id = id sent by AIService.js (X-Trace-Id)."""
+    if not TRACING_ENABLED:
+        raise HTTPException(status_code=404, detail="Tracing disabled (AI_TRACING_ENABLED=0)")
+    return {"status": "ok", "traces": get_traces(limit, trace_id, min_duration_ms)}
+
+@debug.get("/admission")
+def debug_admission():
+    """Grading slots, queue depth per priority and the measured service rate."""
+    return {"status": "ok", **ADMISSION.stats()}
+
+@debug.get("/degraded")
+def debug_degraded():
+    return degraded.stats()
+
+@debug.get("/security")
+def debug_security():
+    """IP reputation table (entries, interval counts) and rate limiter keys."""
+    return {"status": "ok", **REPUTATION.stats(), "rate_limited_keys": len(RATE_LIMITER)}
+
+@debug.get("/slow")
+def debug_slow(limit: int = 50, format: str = "json"):
+    """Captured slow gradings (GradeRequest + stage timings + result; contains student answers).
+    format=jsonl feeds `python -m app.slowlog replay`."""
+    if not SLOW_CAPTURE_ENABLED:
+        raise HTTPException(status_code=404, detail="Slow capture disabled (AI_SLOW_CAPTURE_ENABLED=0)")
+    entries = SLOW_CAPTURE.recent(limit)
+    if format == "jsonl":
+        return PlainTextResponse("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in reversed(entries)),
+                                 media_type="application/x-ndjson")
+    return {"status": "ok", "stats": SLOW_CAPTURE.stats(), "captures": entries}
+
+def _require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not found")
+
+@debug.get("/profile")
+def debug_profile(seconds: float = 10.0, interval_ms: float = 10.0, include_idle: bool = False, format: str = "collapsed"):
+    """Sample every thread of the process for N seconds (max 60). Collapsed stacks for flamegraph.pl/speedscope."""
+    _require_profiling()
+    result = profile_process(seconds, interval_ms, include_idle)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Another process profile is running")
+    if format == "json":
+        return {"status": "ok", **result}
+    return PlainTextResponse(result["collapsed"])
+
+@debug.get("/profiles")
+def debug_profiles():
+    """Recent per-request profiles (without the stack payloads)."""
+    _require_profiling()
+    return {"status": "ok", "profiles": list_profiles()}
+
+@debug.get("/profile/{profile_id}")
+def debug_profile_result(profile_id: str, format: str = "text"):
+    """One per-request profile (id from the X-Profile-Id response header)."""
+    _require_profiling()
+    result = get_profile(profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "json":
+        return {"status": "ok", **result}
+    return PlainTextResponse(result.get("collapsed") or result.get("stats") or "")
+
 @app.get("/favicon.ico")
 def favicon():
     """Return 204 to prevent 404 spam in logs"""
@@ -273,7 +493,8 @@ def reload_learning_patterns(db_host: str = "localhost", db_user: str = "root",
             "charset": "utf8mb4"
         }
         
-        conn = mysql.connector.connect(**db_config)
+        with span("db.connect", database=db_config["database"]):
+            conn = mysql.connector.connect(**db_config)
         engine = get_learning_engine()
         count = engine.load_patterns_from_db(conn)
         conn.close()
@@ -549,25 +770,100 @@ class DetectBehaviorRequest(BaseModel):
     events: list[BehaviorEvent]
     window_duration_seconds: int = 10
 
+MAX_BEHAVIOR_BATCH = int(os.getenv("AI_BEHAVIOR_BATCH_MAX", "2000"))
+
+class BehaviorWindow(BaseModel):
+    student_id: int
+    exam_id: int
+    events: list[BehaviorEvent]
+    window_duration_seconds: int = 10
+
+class DetectBehaviorBatchRequest(BaseModel):
+    windows: list[BehaviorWindow]
+
+def _behavior_response(result: dict) -> dict:
+    return {
+        "is_cheating": result["is_cheating"],
+        "confidence": result["confidence"],
+        "cheating_type": result["reason"],
+        "features": result["features_extracted"]
+    }
+
+# Plain def: FastAPI runs it in the threadpool, predict_proba never blocks the event loop
 @app.post("/api/ai/detect-behavior")
-async def detect_behavior(req: DetectBehaviorRequest):
+def detect_behavior(req: DetectBehaviorRequest):
     try:
         from app.nlp.behavior_detection import behavior_model
         # Parse events to dict
         raw_events = [e.dict() for e in req.events]
         result = behavior_model.detect_cheating(raw_events)
+        return {"success": True, **_behavior_response(result)}
+    except Exception as e:
+        import logging
+        logging.error(f"Error in detect_behavior: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/ai/detect-behavior/batch")
+def detect_behavior_batch(req: DetectBehaviorBatchRequest):
+    """Nhiều cửa sổ (student, exam, events) một lần: một ma trận features, một predict_proba."""
+    if len(req.windows) > MAX_BEHAVIOR_BATCH:
+        raise HTTPException(status_code=413, detail=f"Tối đa {MAX_BEHAVIOR_BATCH} cửa sổ mỗi batch")
+    try:
+        from app.nlp.behavior_detection import behavior_model
+        results = behavior_model.detect_cheating_batch([[e.dict() for e in w.events] for w in req.windows])
         return {
             "success": True,
-            "is_cheating": result["is_cheating"],
-            "confidence": result["confidence"],
-            "cheating_type": result["reason"],
-            "features": result["features_extracted"]
+            "results": [
+                {"student_id": w.student_id, "exam_id": w.exam_id, **_behavior_response(r)}
+                for w, r in zip(req.windows, results)
+            ]
         }
     except Exception as e:
         import logging
-        logging.error(f"Error in detect_behavior: {e}")
+        logging.error(f"Error in detect_behavior_batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Streaming: client sends only new events, features come from server-side session state
+@app.post("/api/ai/behavior/session/events")
+def behavior_session_events(req: DetectBehaviorRequest):
+    try:
+        from app.nlp.behavior_detection import behavior_model
+        features, session = behavior_sessions.SESSIONS.ingest(
+            req.student_id, req.exam_id, [e.dict() for e in req.events], req.window_duration_seconds)
+        result = behavior_model.score_features_batch([features])[0]
+        return {"success": True, **_behavior_response(result), "session": session}
+    except Exception as e:
+        import logging
+        logging.error(f"Error in behavior_session_events: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/api/ai/behavior/session/{student_id}/{exam_id}")
+def end_behavior_session(student_id: int, exam_id: int):
+    """Kết thúc session (nộp bài): trả về tổng hợp cả bài thi."""
+    session = behavior_sessions.SESSIONS.end(student_id, exam_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "session": session}
+
+@debug.get("/behavior-sessions")
+def debug_behavior_sessions():
+    return {"status": "ok", **behavior_sessions.SESSIONS.stats()}
+
+@debug.get("/behavior-model")
+def debug_behavior_model():
+    """Active behavior model version (data/behavior_models/CURRENT or bundled) and its runtime."""
+    from app.nlp.behavior_detection import behavior_model
+    model = behavior_model.model
+    return {"status": "ok", "version": behavior_model.version, "runtime": type(model).__name__ if model else None}
+
+@debug.post("/behavior-model/reload")
+def debug_behavior_model_reload():
+    """Load the active version now instead of waiting for AI_BEHAVIOR_MODEL_CHECK_SECONDS."""
+    from app.nlp.behavior_detection import behavior_model
+    behavior_model.maybe_reload(force=True)
+    return debug_behavior_model()
+
+app.include_router(debug)
 
 if __name__ == "__main__":
     import os
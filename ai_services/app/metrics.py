@@ -0,0 +1,285 @@
+# Prometheus metrics for the AI service (text exposition format, no extra dependency)
+# - Grader stage latency histograms + early-exit counters (StageClock)
+# - Model batch sizes / batch latency
+# - HTTP latency + in-flight requests (queue depth)
+# - Cache hit rates via collectors evaluated at scrape time
+# Disable with AI_METRICS_ENABLED=0: nothing is recorded (stage clocks are no-ops unless a
+# stage listener such as tracing is registered).
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("AI_METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket", _format_labels(names, key + (_format_value(bound),)), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]):
+        """collector() yields (name, type, help, labels, value) at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+
+        collected: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collector in self._collectors:
+            try:
+                for name, kind, documentation, labels, value in collector():
+                    entry = collected.setdefault(name, (kind, documentation, []))
+                    entry[2].append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+            except Exception as e:
+                lines.append(f"# collector error: {e}")
+        for name, (kind, documentation, samples) in collected.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+GRADER_STAGE_SECONDS = REGISTRY.histogram(
+    "ai_grader_stage_seconds", "Time spent in each UniversityGrader pipeline stage.", ("stage",))
+GRADER_EXIT_TOTAL = REGISTRY.counter(
+    "ai_grader_exit_total", "Gradings by the pipeline stage that produced the final result.", ("stage",))
+GRADE_SECONDS = REGISTRY.histogram(
+    "ai_grade_seconds", "End-to-end UniversityGrader.grade() latency.", ("mode",))
+MODEL_BATCH_SIZE = REGISTRY.histogram(
+    "ai_model_batch_size", "Items per model forward pass (after length bucketing).", ("model",), BATCH_SIZE_BUCKETS)
+MODEL_BATCH_SECONDS = REGISTRY.histogram(
+    "ai_model_batch_seconds", "Latency of one model forward pass.", ("model",))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "ai_http_request_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "ai_http_requests_in_flight", "Requests currently being processed or waiting for a worker (queue depth).", ("route",))
+
+
+# ===== STAGE CLOCK =====
+
+# Called as listener(stage, start_perf, end_perf) on every mark (tracing spans, ...)
+_stage_listeners: List[Callable[[str, float, float], None]] = []
+
+
+def add_stage_listener(listener: Callable[[str, float, float], None]):
+    if listener not in _stage_listeners:
+        _stage_listeners.append(listener)
+
+class StageClock:
+    """
+    Per-grading stopwatch: mark(stage) attributes the time since the previous mark
+    to that stage; exit(stage, result) also counts the stage as the early exit.
+    """
+    __slots__ = ("_last", "stages")
+
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        start, self._last = self._last, now
+        elapsed = now - start
+        self.stages.append((name, elapsed))
+        if METRICS_ENABLED:
+            GRADER_STAGE_SECONDS.observe(elapsed, stage=name)
+        for listener in _stage_listeners:
+            listener(name, start, now)
+
+    def exit(self, name: str, result: Any) -> Any:
+        self.mark(name)
+        if METRICS_ENABLED:
+            GRADER_EXIT_TOTAL.inc(stage=name)
+        return result
+
+
+class _NullClock:
+    __slots__ = ()
+    stages: Tuple = ()
+
+    def mark(self, name: str):
+        pass
+
+    def exit(self, name: str, result: Any) -> Any:
+        return result
+
+
+NULL_CLOCK = _NullClock()
+
+
+def stage_clock():
+    return StageClock() if METRICS_ENABLED or _stage_listeners else NULL_CLOCK
+
+
+def observe_batch(model: str, size: int, seconds: float):
+    if METRICS_ENABLED:
+        MODEL_BATCH_SIZE.observe(size, model=model)
+        MODEL_BATCH_SECONDS.observe(seconds, model=model)
+
+
+def cache_samples(caches: Dict[str, Dict[str, Any]]) -> Iterable[Tuple[str, str, str, Dict[str, Any], float]]:
+    """Turn LRUCache.stats() dicts into collector samples."""
+    for cache, stats in caches.items():
+        labels = {"cache": cache}
+        yield "ai_cache_hits_total", "counter", "Cache hits.", labels, stats["hits"]
+        yield "ai_cache_misses_total", "counter", "Cache misses.", labels, stats["misses"]
+        yield "ai_cache_evictions_total", "counter", "Cache evictions.", labels, stats["evictions"]
+        yield "ai_cache_entries", "gauge", "Entries currently cached.", labels, stats["entries"]
+        yield "ai_cache_hit_ratio", "gauge", "hits / (hits + misses).", labels, stats["hit_rate"]
+
+
+# ===== HTTP MIDDLEWARE =====
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: request latency by route + in-flight gauge."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_of(self, scope) -> str:
+        if self._routes is None:
+            app = scope.get("app")
+            self._routes = {getattr(r, "path", None) for r in getattr(app, "routes", [])} - {None}
+        path = scope.get("path", "")
+        return path if path in self._routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route_of(scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(route=route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(route=route)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope.get("method", ""), route=route, status=status["code"])
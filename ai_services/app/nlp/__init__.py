@@ -1,7 +1,7 @@
 # NLP Module - Vietnamese NLP for Essay Grading
 # Bi-Encoder + Cross-Encoder.
 from .model import get_ai_model, AIModel
-from .grader import UniversityGrader, calculate_score
+from .grader import UniversityGrader, calculate_score, calculate_scores_clustered, get_grader, regrade_question
 
 # Keep tokenizer/similarity utilities if they exist and are valid
 try:
@@ -33,6 +33,9 @@ def get_model():
 __all__ = [
     'UniversityGrader',
     'calculate_score',
+    'calculate_scores_clustered',
+    'get_grader',
+    'regrade_question',
     'get_model',
     'get_ai_model',
     'extract_propositions',
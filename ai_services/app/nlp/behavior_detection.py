@@ -1,19 +1,22 @@
 import os
-import pandas as pd
+import threading
+import time
 import numpy as np
-import joblib
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report
 import logging
 import json
 
+from app.nlp.compiled_forest import COMPILED_PATH, CompiledForest, load_compiled
+
 logger = logging.getLogger(__name__)
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DATASET_PATH = os.path.join(BASE_DIR, "data", "comprehensive_cheating_dataset.csv")
 MODEL_PATH = os.path.join(BASE_DIR, "data", "behavior_model.pkl")
+# Versioned models from app.nlp.behavior_training; CURRENT holds the active version name
+MODELS_DIR = os.getenv("AI_BEHAVIOR_MODELS_DIR", os.path.join(BASE_DIR, "data", "behavior_models"))
+CURRENT_PATH = os.path.join(MODELS_DIR, "CURRENT")
+MODEL_CHECK_SECONDS = float(os.getenv("AI_BEHAVIOR_MODEL_CHECK_SECONDS", "30"))
 
 # Các features dùng để predict
 FEATURES = [
@@ -22,28 +25,90 @@ FEATURES = [
     'mouse_outside_count', 'screenshot_attempts'  # Prtsc, Ctrl+PrtSc, Alt+PrtSc
 ]
 
+
+def _current_stamp():
+    try:
+        return os.stat(CURRENT_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def active_model_paths():
+    """(version, model.pkl, model.npz): the version named in CURRENT, else the bundled model"""
+    try:
+        with open(CURRENT_PATH, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        version = ""
+    if version:
+        directory = os.path.join(MODELS_DIR, version)
+        if os.path.exists(os.path.join(directory, "model.pkl")):
+            return version, os.path.join(directory, "model.pkl"), os.path.join(directory, "model.npz")
+        logger.warning(f"⚠️ {CURRENT_PATH} trỏ tới version không tồn tại: {version}")
+    return "bundled", MODEL_PATH, COMPILED_PATH
+
+
 class BehaviorDetectionModel:
     def __init__(self):
         self.model = None
+        self.version = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
         self._load_model()
-        
+
     def _load_model(self):
-        """Load pretrained model if exists"""
-        if os.path.exists(MODEL_PATH):
+        """Load pretrained model if exists (compiled NumPy forest first: no pandas/sklearn needed)"""
+        self._stamp = _current_stamp()
+        self._checked_at = time.monotonic()
+        version, model_path, compiled_path = active_model_paths()
+        try:
+            compiled = load_compiled(compiled_path, model_path)
+            if compiled is not None and compiled.feature_names in ([], FEATURES):
+                self.model, self.version = compiled, version
+                logger.info(f"✅ Load Behavior Model (compiled NumPy, {version}) thành công.")
+                return
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được compiled model {compiled_path}: {e}")
+        if os.path.exists(model_path):
             try:
-                self.model = joblib.load(MODEL_PATH)
-                logger.info("✅ Load Behavior Model thành công.")
+                import joblib
+                self.model, self.version = joblib.load(model_path), version
+                logger.info(f"✅ Load Behavior Model ({version}) thành công.")
             except Exception as e:
                 logger.error(f"❌ Failed to load model: {str(e)}")
         else:
             logger.warning("⚠️ Chưa có file model. Hệ thống sẽ tự train hoặc dùng rule-based heuristic.")
 
+    def maybe_reload(self, force=False):
+        """Swap in a newly activated version; CURRENT is stat'ed at most every MODEL_CHECK_SECONDS"""
+        if not force and time.monotonic() - self._checked_at < MODEL_CHECK_SECONDS:
+            return False
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            if not force and _current_stamp() == self._stamp:
+                return False
+            previous = self.version
+            self._load_model()
+            if self.version != previous:
+                logger.info(f"🔄 Behavior model: {previous} -> {self.version}")
+            return True
+
     def train_model(self):
-        """Huấn luyện mô hình từ comprehensive_cheating_dataset.csv"""
+        """
+        Huấn luyện nhanh mô hình từ comprehensive_cheating_dataset.csv (bundled model).
+        Tìm hyperparameter bằng k-fold CV + model có version: python -m app.nlp.behavior_training train
+        """
         if not os.path.exists(DATASET_PATH):
             logger.error(f"Khong tim thay dataset file {DATASET_PATH}")
             return False
             
+        import joblib
+        import pandas as pd
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.metrics import accuracy_score, classification_report
+        from sklearn.model_selection import train_test_split
+
         logger.info(f"Đang đọc dataset từ: {DATASET_PATH}...")
         df = pd.read_csv(DATASET_PATH)
         
@@ -65,6 +130,12 @@ class BehaviorDetectionModel:
         joblib.dump(clf, MODEL_PATH)
         self.model = clf
         logger.info(f"✅ Lưu model thành công tại: {MODEL_PATH}")
+        try:
+            from app.nlp.compiled_forest import export
+            export(MODEL_PATH, COMPILED_PATH)
+            logger.info(f"✅ Compiled model: {COMPILED_PATH}")
+        except (Exception, SystemExit) as e:
+            logger.warning(f"⚠️ Không compile được model: {e}")
         return True
 
     def process_raw_events(self, events):
@@ -95,68 +166,97 @@ class BehaviorDetectionModel:
             
         return features
 
+    def features_matrix(self, feature_dicts):
+        """Feature dicts -> one (n, len(FEATURES)) float64 matrix, columns in FEATURES order"""
+        X = np.zeros((len(feature_dicts), len(FEATURES)), dtype=np.float64)
+        for i, features in enumerate(feature_dicts):
+            X[i] = [features[f] for f in FEATURES]
+        return X
+
     def detect_cheating(self, events):
         """
         Nhận mảng event dict, phân tích features và predict.
         Dùng cho endpoint API để realtime detection.
         """
-        features_dict = self.process_raw_events(events)
-        
+        return self.detect_cheating_batch([events])[0]
+
+    def detect_cheating_batch(self, events_list):
+        """
+        Nhiều cửa sổ event cùng lúc: trích features vào một ma trận NumPy, gọi predict_proba
+        một lần cho cả batch. Kết quả theo thứ tự đầu vào, giống detect_cheating từng cửa sổ.
+        """
+        return self.score_features_batch([self.process_raw_events(events) for events in events_list])
+
+    def score_features_batch(self, feature_dicts):
+        """Đã có features (process_raw_events hoặc session streaming) -> kết quả từng dòng"""
+        if not feature_dicts:
+            return []
+
+        self.maybe_reload()
         if self.model:
-            # Prepare DataFrame for scikit-learn
-            X_input = pd.DataFrame([features_dict], columns=FEATURES)
-            # Predict Probability
-            probs = self.model.predict_proba(X_input)[0] 
-            # Giả định classes_ là [0, 1] => idx 1 là xác suất gian lận
-            confidence = probs[1]
-            is_cheating = bool(confidence > 0.65) # threshold custom
-             
-            # Identify primary reason for cheating if true
-            reason = "Hành vi bất thường (Tổng hợp)"
-            if is_cheating or features_dict.get('screenshot_attempts', 0) > 0: # Force screenshot trigger
-                # Ngưỡng phát hiện
-                if features_dict.get('screenshot_attempts', 0) >= 1:
-                    reason = "Sử dụng phím chụp màn hình"
-                    is_cheating = True # Force cheating to true
-                    confidence = max(confidence, 0.85) # Boost confidence
-                elif features_dict.get('copy_attempts', 0) >= 2 or features_dict.get('paste_attempts', 0) >= 2:
-                    reason = "Lạm dụng sao chép/dán"
-                elif features_dict.get('max_blur_duration_ms', 0) >= 15000:
-                    reason = "Xem tài liệu (Rời cửa sổ quá lâu)"
-                elif features_dict.get('tab_switches', 0) >= 3 or features_dict.get('blur_events', 0) >= 3:
-                    reason = "Chuyển tab hoặc cửa sổ liên tục"
-                elif features_dict.get('mouse_outside_count', 0) >= 2:
-                    reason = "Sử dụng thiết bị khác ngoài màn hình"
-                elif features_dict.get('fullscreen_exits', 0) >= 2:
-                    reason = "Thoát toàn màn hình liên tục"
-
-            # Fallback if no specific reason is dominant but AI is highly confident
-            if is_cheating and reason == "Hành vi bất thường (Tổng hợp)":
-                reason = "Phối hợp nhiều hành vi bất thường"
-                    
-            return {
-                "is_cheating": is_cheating,
-                "confidence": float(confidence),
-                "features_extracted": features_dict,
-                "reason": reason
-            }
-        else:
-            # Fallback Rule-based if no model
-            logger.warning("No ML model loaded, using rule-based fallback.")
-            score = 0
-            score += features_dict['tab_switches'] * 0.3
-            score += features_dict['blur_events'] * 0.2
-            score += features_dict['blocked_keys'] * 0.2
-            score += features_dict['fullscreen_exits'] * 0.3
-            score += min(1.0, features_dict['max_blur_duration_ms'] / 10000.0) * 0.5
-            score += (features_dict['copy_attempts'] + features_dict['paste_attempts']) * 0.4
-            
-            is_cheat = score > 1.0
-            return {
-                "is_cheating": is_cheat,
-                "confidence": min(1.0, score / 2.0),
-                "features_extracted": features_dict,
-                "reason": "rule_based_fallback"
-            }
+            X = self.features_matrix(feature_dicts)
+            if isinstance(self.model, CompiledForest):
+                probs = self.model.predict_proba(X)
+            else:
+                # One DataFrame (feature names as in training) and one predict_proba for the batch
+                import pandas as pd
+                probs = self.model.predict_proba(pd.DataFrame(X, columns=FEATURES))
+            # Giả định classes_ là [0, 1] => cột 1 là xác suất gian lận
+            return [self._interpret(f, p[1]) for f, p in zip(feature_dicts, probs)]
+
+        # Fallback Rule-based if no model
+        logger.warning("No ML model loaded, using rule-based fallback.")
+        return [self._rule_based(f) for f in feature_dicts]
+
+    def _interpret(self, features_dict, confidence):
+        """Xác suất của model + features -> kết quả (ngưỡng, lý do, ép screenshot)"""
+        is_cheating = bool(confidence > 0.65) # threshold custom
+         
+        # Identify primary reason for cheating if true
+        reason = "Hành vi bất thường (Tổng hợp)"
+        if is_cheating or features_dict.get('screenshot_attempts', 0) > 0: # Force screenshot trigger
+            # Ngưỡng phát hiện
+            if features_dict.get('screenshot_attempts', 0) >= 1:
+                reason = "Sử dụng phím chụp màn hình"
+                is_cheating = True # Force cheating to true
+                confidence = max(confidence, 0.85) # Boost confidence
+            elif features_dict.get('copy_attempts', 0) >= 2 or features_dict.get('paste_attempts', 0) >= 2:
+                reason = "Lạm dụng sao chép/dán"
+            elif features_dict.get('max_blur_duration_ms', 0) >= 15000:
+                reason = "Xem tài liệu (Rời cửa sổ quá lâu)"
+            elif features_dict.get('tab_switches', 0) >= 3 or features_dict.get('blur_events', 0) >= 3:
+                reason = "Chuyển tab hoặc cửa sổ liên tục"
+            elif features_dict.get('mouse_outside_count', 0) >= 2:
+                reason = "Sử dụng thiết bị khác ngoài màn hình"
+            elif features_dict.get('fullscreen_exits', 0) >= 2:
+                reason = "Thoát toàn màn hình liên tục"
+
+        # Fallback if no specific reason is dominant but AI is highly confident
+        if is_cheating and reason == "Hành vi bất thường (Tổng hợp)":
+            reason = "Phối hợp nhiều hành vi bất thường"
+                
+        return {
+            "is_cheating": is_cheating,
+            "confidence": float(confidence),
+            "features_extracted": features_dict,
+            "reason": reason
+        }
+
+    def _rule_based(self, features_dict):
+        score = 0
+        score += features_dict['tab_switches'] * 0.3
+        score += features_dict['blur_events'] * 0.2
+        score += features_dict['blocked_keys'] * 0.2
+        score += features_dict['fullscreen_exits'] * 0.3
+        score += min(1.0, features_dict['max_blur_duration_ms'] / 10000.0) * 0.5
+        score += (features_dict['copy_attempts'] + features_dict['paste_attempts']) * 0.4
+        
+        is_cheat = score > 1.0
+        return {
+            "is_cheating": is_cheat,
+            "confidence": min(1.0, score / 2.0),
+            "features_extracted": features_dict,
+            "reason": "rule_based_fallback"
+        }
 
 behavior_model = BehaviorDetectionModel()
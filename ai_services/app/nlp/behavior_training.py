@@ -0,0 +1,304 @@
+"""
+behavior_training.py
+Cross-validated hyperparameter search for the behavior RandomForest, outside the service.
+
+    cd ai_services
+    python -m app.nlp.behavior_training train --grid n_estimators=50,100,200 --grid max_depth=6,10,none \\
+        --folds 5 --n-jobs 4 --activate
+    python -m app.nlp.behavior_training train --csv exports/behavior_sessions.csv --metric recall
+    python -m app.nlp.behavior_training list
+    python -m app.nlp.behavior_training activate 20261019-141500
+
+Every (candidate, fold) pair is fitted in a process pool (--n-jobs). Reported per candidate:
+accuracy, precision, recall and F1 of the cheating class (mean and std over folds), fit time
+and inference latency of the compiled forest (single row and per row in a batch; measured in the
+pool workers, so compare candidates with each other rather than with production numbers).
+The best candidate (--metric, ties -> smaller forest) is refitted on all rows and written as
+a versioned artifact: data/behavior_models/<version>/{model.pkl, model.npz, report.json}.
+--activate (or the activate command) points data/behavior_models/CURRENT at it; the service
+notices the change within AI_BEHAVIOR_MODEL_CHECK_SECONDS and swaps the model in.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.nlp.behavior_detection import CURRENT_PATH, DATASET_PATH, FEATURES, MODELS_DIR
+from app.nlp.compiled_forest import file_sha256
+
+DEFAULT_PARAMS = {"n_estimators": 100, "max_depth": 10, "class_weight": "balanced"}
+PARAM_TYPES = {
+    "n_estimators": int, "max_depth": int, "min_samples_split": int, "min_samples_leaf": int,
+    "max_features": "max_features", "class_weight": str,
+}
+METRICS = ("accuracy", "precision", "recall", "f1")
+ARTIFACT_FILES = ("model.pkl", "model.npz", "report.json")
+
+
+def load_dataset(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    import csv
+    X, y = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            X.append([float(row[name]) for name in FEATURES])
+            y.append(int(float(row["label"])))
+    return np.array(X, dtype=np.float64), np.array(y, dtype=np.int64)
+
+
+# ===== GRID =====
+
+def _parse_value(kind, raw: str):
+    raw = raw.strip()
+    if raw.lower() == "none":
+        return None
+    if kind == "max_features":
+        return raw if raw in ("sqrt", "log2") else float(raw)
+    return kind(raw)
+
+
+def build_grid(specs: Sequence[str]) -> List[Dict[str, Any]]:
+    """Cartesian product of --grid name=v1,v2 axes on top of DEFAULT_PARAMS (defaults first)."""
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if name not in PARAM_TYPES:
+            raise SystemExit(f"Unknown parameter: {name} (allowed: {', '.join(PARAM_TYPES)})")
+        axes.append([(name, _parse_value(PARAM_TYPES[name], v)) for v in values.split(",") if v.strip()])
+    candidates = [dict(DEFAULT_PARAMS)]
+    for combo in itertools.product(*axes) if axes else []:
+        params = {**DEFAULT_PARAMS, **dict(combo)}
+        if params not in candidates:
+            candidates.append(params)
+    return candidates
+
+
+def _name(params: Dict[str, Any]) -> str:
+    return ",".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+# ===== WORKER =====
+
+_data: Dict[str, np.ndarray] = {}
+
+
+def _init_worker(csv_path: str):
+    """Pool initializer: each worker reads the dataset once."""
+    import warnings
+    warnings.filterwarnings("ignore")
+    _data["X"], _data["y"] = load_dataset(csv_path)
+
+
+def _latency(model, X: np.ndarray) -> Dict[str, float]:
+    """Inference latency of the runtime path (compiled NumPy forest), best of 3 runs."""
+    from app.nlp.compiled_forest import CompiledForest, compile_forest
+    compiled = CompiledForest(compile_forest(model))
+    rows = X[:100]
+    single = batch = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for row in rows:
+            compiled.predict_proba(row)
+        single = min(single, (time.perf_counter() - start) / max(1, len(rows)))
+        start = time.perf_counter()
+        compiled.predict_proba(X)
+        batch = min(batch, (time.perf_counter() - start) / max(1, len(X)))
+    return {"single_us": single * 1e6, "batch_row_us": batch * 1e6, "nodes": len(compiled.feature)}
+
+
+def _fit(params: Dict[str, Any], seed: int):
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(random_state=seed, n_jobs=1, **params)
+
+
+def _run_fold(index: int, params: Dict[str, Any], train_idx: np.ndarray, test_idx: np.ndarray, seed: int) -> Dict[str, Any]:
+    from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+    X, y = _data["X"], _data["y"]
+    clf = _fit(params, seed)
+    start = time.perf_counter()
+    clf.fit(X[train_idx], y[train_idx])
+    fit_s = time.perf_counter() - start
+    y_pred = clf.predict(X[test_idx])
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        y[test_idx], y_pred, average="binary", pos_label=1, zero_division=0)
+    return {
+        "index": index,
+        "accuracy": float(accuracy_score(y[test_idx], y_pred)),
+        "precision": float(precision), "recall": float(recall), "f1": float(f1),
+        "fit_s": fit_s,
+        **_latency(clf, X[test_idx]),
+    }
+
+
+# ===== REPORT =====
+
+def summarize(params: Dict[str, Any], folds: List[Dict[str, Any]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"name": _name(params), "params": params, "folds": len(folds)}
+    for key in METRICS:
+        values = [f[key] for f in folds]
+        out[key] = round(statistics.fmean(values), 4)
+        out[f"{key}_std"] = round(statistics.stdev(values), 4) if len(values) > 1 else 0.0
+    for key in ("fit_s", "single_us", "batch_row_us", "nodes"):
+        out[key] = round(statistics.fmean(f[key] for f in folds), 3)
+    return out
+
+
+def select(results: List[Dict[str, Any]], metric: str) -> Dict[str, Any]:
+    """Best mean metric; ties go to the smaller forest (fewer nodes: deterministic, unlike timings)."""
+    return max(results, key=lambda r: (r[metric], -r["nodes"]))
+
+
+def write_artifact(best: Dict[str, Any], report: Dict[str, Any], csv_path: str, seed: int) -> str:
+    """Refit the best candidate on all rows; data/behavior_models/<version>/ (model.pkl/.npz, report.json)."""
+    import joblib
+    import pandas as pd
+    import sklearn
+    from app.nlp.compiled_forest import export
+
+    X, y = load_dataset(csv_path)
+    clf = _fit(best["params"], seed)
+    clf.fit(pd.DataFrame(X, columns=FEATURES), y)  # feature names, like train_model()
+
+    version = time.strftime("%Y%m%d-%H%M%S")
+    directory = os.path.join(MODELS_DIR, version)
+    if os.path.exists(directory):
+        raise SystemExit(f"Version {version} already exists in {MODELS_DIR}")
+    # Built in a hidden temp dir, renamed into place only once export + report succeeded:
+    # a failed bit-for-bit check leaves no half-built version behind
+    tmp_dir = os.path.join(MODELS_DIR, f".{version}.{os.getpid()}.tmp")
+    os.makedirs(tmp_dir)
+    try:
+        model_path = os.path.join(tmp_dir, "model.pkl")
+        joblib.dump(clf, model_path)
+        compiled = export(model_path, os.path.join(tmp_dir, "model.npz"), csv_path)
+        compiled["out"] = os.path.join(directory, "model.npz")
+        with open(os.path.join(tmp_dir, "report.json"), "w", encoding="utf-8") as f:
+            json.dump({**report, "version": version, "selected": best["name"], "compiled": compiled,
+                       "sklearn": sklearn.__version__}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return version
+
+
+def activate(version: str):
+    directory = os.path.join(MODELS_DIR, version)
+    missing = [name for name in ARTIFACT_FILES if not os.path.exists(os.path.join(directory, name))]
+    if version.startswith(".") or missing:
+        raise SystemExit(f"Version {version} in {MODELS_DIR} is incomplete (missing {', '.join(missing) or 'version'})")
+    tmp_path = f"{CURRENT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, CURRENT_PATH)
+
+
+def list_versions() -> List[Dict[str, Any]]:
+    current = None
+    if os.path.exists(CURRENT_PATH):
+        with open(CURRENT_PATH, "r", encoding="utf-8") as f:
+            current = f.read().strip()
+    rows = []
+    for version in sorted(os.listdir(MODELS_DIR)) if os.path.isdir(MODELS_DIR) else []:
+        if version.startswith("."):
+            continue  # build in progress / failed
+        report_path = os.path.join(MODELS_DIR, version, "report.json")
+        if not os.path.exists(report_path):
+            continue
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        best = next((r for r in report["results"] if r["name"] == report["selected"]), {})
+        rows.append({"version": version, "active": version == current, "selected": report["selected"],
+                     **{k: best.get(k) for k in (*METRICS, "single_us")}})
+    return rows
+
+
+def train(args) -> int:
+    from sklearn.model_selection import StratifiedKFold
+
+    candidates = build_grid(args.grid)
+    X, y = load_dataset(args.csv)
+    folds = list(StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed).split(X, y))
+    print(f"{len(candidates)} candidates x {len(folds)} folds on {len(X)} rows ({int(y.sum())} cheating), {args.n_jobs} workers")
+
+    start = time.perf_counter()
+    collected: Dict[int, List[Dict[str, Any]]] = {i: [] for i in range(len(candidates))}
+    with ProcessPoolExecutor(max_workers=args.n_jobs, initializer=_init_worker, initargs=(args.csv,)) as pool:
+        futures = [pool.submit(_run_fold, i, params, train_idx, test_idx, args.seed)
+                   for i, params in enumerate(candidates) for train_idx, test_idx in folds]
+        for future in as_completed(futures):
+            out = future.result()
+            collected[out["index"]].append(out)
+    wall = time.perf_counter() - start
+
+    results = [summarize(params, collected[i]) for i, params in enumerate(candidates)]
+    best = select(results, args.metric)
+    print(f"\n{'candidate':<64} {'acc':>6} {'prec':>6} {'rec':>6} {'f1':>6} {'fit s':>7} {'nodes':>7} {'1 row us':>9} {'batch us':>9}")
+    for r in sorted(results, key=lambda r: -r[args.metric]):
+        mark = " *" if r is best else ""
+        print(f"{r['name'][:64]:<64} {r['accuracy']:>6.3f} {r['precision']:>6.3f} {r['recall']:>6.3f} {r['f1']:>6.3f} "
+              f"{r['fit_s']:>7.2f} {r['nodes']:>7.0f} {r['single_us']:>9.1f} {r['batch_row_us']:>9.2f}{mark}")
+    print(f"\n* best by {args.metric}: {best['name']}  (wall {wall:.1f}s)")
+
+    report = {
+        "dataset": os.path.abspath(args.csv),
+        "dataset_sha256": file_sha256(args.csv),
+        "rows": len(X),
+        "folds": args.folds,
+        "seed": args.seed,
+        "metric": args.metric,
+        "wall_s": round(wall, 3),
+        "results": results,
+    }
+    if args.dry_run:
+        return 0
+    version = write_artifact(best, report, args.csv, args.seed)
+    print(f"Saved {os.path.join(MODELS_DIR, version)}")
+    if args.activate:
+        activate(version)
+        print(f"Activated {version}")
+    else:
+        print(f"Activate with: python -m app.nlp.behavior_training activate {version}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.nlp.behavior_training", description="Behavior model CV training.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("train")
+    p.add_argument("--csv", default=DATASET_PATH, help="feature rows + label (comprehensive_cheating_dataset.csv layout)")
+    p.add_argument("--grid", action="append", default=[], help="param=v1,v2 (repeatable, cartesian product; 'none' allowed)")
+    p.add_argument("--folds", type=int, default=5)
+    p.add_argument("--n-jobs", type=int, default=max(1, os.cpu_count() or 1))
+    p.add_argument("--metric", choices=METRICS, default="f1")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--activate", action="store_true", help="make the new version the one the service loads")
+    p.add_argument("--dry-run", action="store_true", help="report only, write no artifact")
+    p = sub.add_parser("activate")
+    p.add_argument("version")
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        return train(args)
+    if args.command == "activate":
+        activate(args.version)
+        print(f"Activated {args.version}")
+        return 0
+    for row in list_versions():
+        mark = "*" if row["active"] else " "
+        print(f"{mark} {row['version']}  f1 {row['f1']}  recall {row['recall']}  {row['single_us']} us  {row['selected']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+cache.py
+Thread-safe LRU cache with pinning and hit/miss/byte accounting.
+
+Used for encoder embeddings (one cache per model tier) so repeated chunks
+(model-answer ideas, identical student sentences) are encoded once.
+Pinned keys are never evicted (warm-up artifacts of published exams).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 4096, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max(1, max_entries)
+        self._sizeof = sizeof or (lambda value: 0)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._pinned = set()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, pin: bool = False) -> None:
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizeof(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._bytes += self._sizeof(value)
+            if pin:
+                self._pinned.add(key)
+            self._evict()
+
+    def pin(self, key: Hashable) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._pinned.add(key)
+            return True
+
+    def unpin(self, key: Hashable) -> None:
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        # Caller holds the lock. Oldest unpinned entries go first.
+        if len(self._data) <= self.max_entries:
+            return
+        for key in list(self._data.keys()):
+            if len(self._data) <= self.max_entries:
+                break
+            if key in self._pinned:
+                continue
+            self._bytes -= self._sizeof(self._data.pop(key))
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._pinned.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "pinned": len(self._pinned),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,136 @@
+"""
+clustering.py
+Exam-wide answer clustering: near-identical answers to one question are graded once.
+
+1. Exact bucket: answers with the same normalized hash (case/whitespace) share a result
+2. Embedding bucket: bucket representatives whose whole-answer embeddings are closer
+   than a strict threshold are merged into one cluster
+3. One representative per cluster goes through the full UniversityGrader pipeline
+4. Exact members copy the result; embedding members get a cheap re-check: the
+   lexical grader layers (exact, math, dataset memory, short answer) run on the member
+   itself, then numbers/negation/antonyms/surface ratio must agree with the leader.
+   A member that fails the re-check is graded alone.
+"""
+
+import hashlib
+import logging
+import re
+import time
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Sequence
+
+from sentence_transformers import util
+
+from .short_answer import NEGATION_TOKENS
+from .tokenizer import NUMBER_PATTERN
+
+logger = logging.getLogger(__name__)
+
+
+def answer_key(text: str, grading_mode: str = "general") -> str:
+    """Normalized hash of an answer. Technical answers keep case and indentation (code)."""
+    if grading_mode == "technical":
+        normalized = text.strip()
+    else:
+        normalized = " ".join(text.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class AnswerClusterer:
+    def __init__(self, grader):
+        self.grader = grader
+        self.config = grader.config
+        self.ai = grader.ai
+
+    def _numbers(self, text: str) -> set:
+        return set(NUMBER_PATTERN.findall(text))
+
+    def _negations(self, text: str) -> set:
+        return set(re.findall(r'\w+', text.lower())) & NEGATION_TOKENS
+
+    def _passes_recheck(self, member: str, leader: str, model_text: str) -> bool:
+        """Kiểm tra nhẹ trước khi copy điểm: số liệu, phủ định, từ trái nghĩa, độ giống bề mặt."""
+        if self._numbers(member) != self._numbers(leader): return False
+        if self._negations(member) != self._negations(leader): return False
+        if self.grader._check_antonym_contradiction(member, model_text) != self.grader._check_antonym_contradiction(leader, model_text):
+            return False
+        ratio = SequenceMatcher(None, member.lower(), leader.lower()).ratio()
+        return ratio >= self.config.cluster_recheck_ratio
+
+    def _embedding_clusters(self, texts: List[str]) -> List[int]:
+        """Greedy leader clustering over bucket representatives. Returns the leader index per text."""
+        leaders = list(range(len(texts)))
+        if len(texts) < 2:
+            return leaders
+        embs = self.ai.encode(texts)
+        sims = util.cos_sim(embs, embs)
+        leader_ids: List[int] = []
+        for i in range(len(texts)):
+            for j in leader_ids:
+                if sims[i, j].item() >= self.config.cluster_similarity_threshold:
+                    leaders[i] = j
+                    break
+            else:
+                leader_ids.append(i)
+        return leaders
+
+    def grade_batch(self, answers: Sequence[str], model_text: str, max_points: float,
+                    grading_mode: str = "general") -> Dict[str, Any]:
+        """
+        Grade all answers of one question.
+        Returns {"results": [...] (input order), "stats": {...}}.
+        """
+        start = time.perf_counter()
+        mode = grading_mode or "general"
+
+        # 1. Exact buckets (first occurrence is the bucket representative)
+        buckets: Dict[str, List[int]] = {}
+        for i, text in enumerate(answers):
+            buckets.setdefault(answer_key(text or "", mode), []).append(i)
+        # Larger buckets lead the embedding clusters
+        groups = sorted(buckets.values(), key=len, reverse=True)
+
+        # 2. Embedding buckets over representatives
+        rep_texts = [answers[members[0]] or "" for members in groups]
+        use_embeddings = self.config.cluster_embedding_enabled and len(groups) > 1
+        leader_of = self._embedding_clusters(rep_texts) if use_embeddings else list(range(len(groups)))
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(answers)
+        stats = {"answers": len(answers), "exact_buckets": len(groups), "clusters": 0, "graded": 0,
+                 "propagated_exact": 0, "propagated_similar": 0, "rechecked_lexical": 0, "recheck_failed": 0}
+        group_results: List[Optional[Dict[str, Any]]] = [None] * len(groups)
+        group_cluster: List[int] = [0] * len(groups)
+        n_clusters = 0
+
+        # 3. Grade representatives, 4. propagate
+        for g, members in enumerate(groups):
+            leader = leader_of[g]
+            propagation = "graded"
+            lexical = self.grader.grade_lexical(rep_texts[g], model_text, max_points, mode) if leader != g else None
+            if lexical:
+                # Tầng từ vựng/dataset có kết quả riêng cho bài này -> dùng luôn (không tốn model)
+                group_results[g], group_cluster[g] = lexical, n_clusters
+                n_clusters += 1
+                propagation = "lexical"
+                stats["rechecked_lexical"] += 1
+            elif leader != g and self._passes_recheck(rep_texts[g], rep_texts[leader], model_text):
+                group_results[g], group_cluster[g] = group_results[leader], group_cluster[leader]
+                propagation = "similar"
+                stats["propagated_similar"] += 1
+            else:
+                if leader != g: stats["recheck_failed"] += 1
+                group_results[g] = self.grader.grade(rep_texts[g], model_text, max_points, mode)
+                group_cluster[g] = n_clusters
+                n_clusters += 1
+                stats["graded"] += 1
+
+            for k, idx in enumerate(members):
+                if k > 0: stats["propagated_exact"] += 1
+                results[idx] = {**group_results[g], "cluster_id": group_cluster[g], "propagation": propagation if k == 0 else "exact"}
+
+        stats["clusters"] = n_clusters
+        stats["grader_calls_saved"] = len(answers) - stats["graded"] - stats["rechecked_lexical"]
+        stats["reduction_ratio"] = round(stats["grader_calls_saved"] / len(answers), 4) if answers else 0.0
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        logger.info(f"[Cluster] {stats['answers']} answers -> {stats['clusters']} clusters, {stats['graded']} graded")
+        return {"results": results, "stats": stats}
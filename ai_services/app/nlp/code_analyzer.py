@@ -18,11 +18,16 @@ import difflib
 import logging
 from typing import Tuple, Dict, Any, Optional, List, Set
 
+from .cache import LRUCache
+
 logger = logging.getLogger(__name__)
 
 
 class CodeAnalyzer:
     def __init__(self):
+        # Model-answer analysis (type, algorithm, structure) is reused across submissions
+        self._model_profiles = LRUCache(1024)
+
         # CODE PATTERNS (Python, JavaScript, Java, C++, OOP)
         self.code_indicators = [
             # Python
@@ -222,6 +227,27 @@ class CodeAnalyzer:
     def is_technical_answer(self, text: str) -> bool:
         """Check if answer is technical (code/sql/math)."""
         return self.detect_answer_type(text) != "text"
+
+    def model_profile(self, model_text: str, pin: bool = False) -> Dict[str, Any]:
+        """
+        Cached analysis of a model answer: answer type, function type, code structure.
+        pin=True keeps it cached for a prepared exam question.
+        """
+        profile = self._model_profiles.get(model_text)
+        if profile is None:
+            answer_type = self.detect_answer_type(model_text)
+            profile = {
+                "type": answer_type,
+                "function_type": self.detect_function_type(model_text) if answer_type == "code" else "unknown",
+                "structure": self.extract_code_structure(model_text) if answer_type == "code" else None,
+            }
+            self._model_profiles.put(model_text, profile, pin=pin)
+        elif pin:
+            self._model_profiles.pin(model_text)
+        return profile
+
+    def release_model(self, model_text: str):
+        self._model_profiles.unpin(model_text)
     
     # CODE ANALYSIS METHODS
     
@@ -258,7 +284,7 @@ class CodeAnalyzer:
     def check_logic_errors(self, model_code: str, student_code: str) -> Tuple[bool, str]:
 
         # Check for critical logic errors in student code.
-        model_type = self.detect_function_type(model_code)
+        model_type = self._function_type_of_model(model_code)
         student_type = self.detect_function_type(student_code)
         
         # Type mismatch check
@@ -280,6 +306,10 @@ class CodeAnalyzer:
         
         return False, ""
     
+    def _function_type_of_model(self, model_code: str) -> str:
+        profile = self.model_profile(model_code)
+        return profile["function_type"] if profile["type"] == "code" else self.detect_function_type(model_code)
+
     def extract_code_structure(self, code: str) -> Dict[str, List[str]]:
         """Extract structural elements from code (Multi-language)."""
         code_no_comments = re.sub(r'//.*', '', code)
@@ -501,7 +531,8 @@ class CodeAnalyzer:
 
     def compare_code_structure(self, model: str, student: str) -> Tuple[float, List[str]]:
         # Compare structural similarity of two code snippets using the 6-Tier Code Rubric.
-        m_struct = self.extract_code_structure(model)
+        profile = self.model_profile(model)
+        m_struct = profile["structure"] if profile["structure"] is not None else self.extract_code_structure(model)
         s_struct = self.extract_code_structure(student)
         penalties = []
         
@@ -724,7 +755,7 @@ class CodeAnalyzer:
     
     # MAIN GRADING METHOD
     def grade(self, model_text: str, student_text: str, max_points: float) -> Optional[Dict[str, Any]]:
-        model_type = self.detect_answer_type(model_text)
+        model_type = self.model_profile(model_text)["type"]
         student_type = self.detect_answer_type(student_text)
         
         logger.info(f"CodeAnalyzer: model_type={model_type}, student_type={student_type}")
@@ -749,7 +780,7 @@ class CodeAnalyzer:
                     "explanation": error_msg
                 }
             
-            model_func = self.detect_function_type(model_text)
+            model_func = self._function_type_of_model(model_text)
             student_func = self.detect_function_type(student_text)
             
             if model_func != "unknown" and student_func != "unknown":
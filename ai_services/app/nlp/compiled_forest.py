@@ -0,0 +1,220 @@
+"""
+compiled_forest.py
+RandomForestClassifier -> flat NumPy arrays, evaluated without pandas/scikit-learn.
+
+    cd ai_services
+    python -m app.nlp.compiled_forest export     # data/behavior_model.pkl -> data/behavior_model.npz
+    python -m app.nlp.compiled_forest verify     # bit-for-bit vs sklearn on the bundled CSV
+
+Layout: all trees concatenated; node i has feature[i], threshold[i], left[i], right[i] (global
+indices, -1 at leaves) and value[i] (class probabilities of the leaf); roots[t] is the first node
+of tree t. Inference follows sklearn exactly so results are bit-identical:
+  - X is cast to float32 and compared as float64 against the float64 thresholds (X <= t: left)
+  - leaf values: sklearn >= 1.4 stores class fractions and returns them as is; older versions
+    divide by the row sum. export picks whichever reproduces the installed sklearn
+  - tree probabilities are summed sequentially in estimator order, then divided by n_estimators
+The artifact records the sha256 of the pickle it came from; a stale .npz is ignored.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATASET_PATH = os.path.join(BASE_DIR, "data", "comprehensive_cheating_dataset.csv")
+MODEL_PATH = os.path.join(BASE_DIR, "data", "behavior_model.pkl")
+COMPILED_PATH = os.path.join(BASE_DIR, "data", "behavior_model.npz")
+FORMAT = 1
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompiledForest:
+    """Vectorized predict_proba over the flat arrays (single rows and batches)."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.classes_ = arrays["classes"]
+        self.feature_names = [str(f) for f in arrays["feature_names"]]
+        self.max_depth = int(arrays["max_depth"])
+        self.source_sha256 = str(arrays["source_sha256"])
+        self.n_estimators = len(self.roots)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.n_estimators)).copy()
+        for _ in range(self.max_depth):
+            left = self.left[node]
+            inner = left >= 0
+            if not inner.any():
+                break
+            go_left = X[rows, self.feature[node]].astype(np.float64) <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, left, self.right[node]), node)
+        # (rows, trees, classes); cumsum adds the trees one by one, like sklearn's accumulation
+        total = np.cumsum(self.value[node], axis=1)[:, -1, :]
+        return total / self.n_estimators
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def load_compiled(path: str = COMPILED_PATH, model_path: Optional[str] = MODEL_PATH) -> Optional[CompiledForest]:
+    """The compiled forest, or None if missing, of another format or built from another pickle."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {k: data[k] for k in data.files}
+    if int(arrays.get("format", -1)) != FORMAT:
+        return None
+    if model_path and os.path.exists(model_path) and str(arrays["source_sha256"]) != file_sha256(model_path):
+        return None
+    return CompiledForest(arrays)
+
+
+# ===== EXPORT (needs scikit-learn) =====
+
+def compile_forest(model, source_sha256: str = "", normalize: bool = False) -> Dict[str, np.ndarray]:
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left < 0
+        value = tree.value[:, 0, :].astype(np.float64)
+        if normalize:
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset).astype(np.int32))
+        values.append(value)
+        offset += tree.node_count
+    names = getattr(model, "feature_names_in_", None)
+    return {
+        "format": np.array(FORMAT),
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.array(roots, dtype=np.int32),
+        "classes": np.asarray(model.classes_),
+        "feature_names": np.array([str(n) for n in names] if names is not None else [], dtype=np.str_),
+        "max_depth": np.array(max(e.tree_.max_depth for e in model.estimators_) + 1),
+        "leaf_normalized": np.array(normalize),
+        "source_sha256": np.array(source_sha256),
+    }
+
+
+def dataset_matrix(feature_names, path: str = DATASET_PATH) -> np.ndarray:
+    import csv
+    with open(path, "r", encoding="utf-8") as f:
+        return np.array([[float(row[name]) for name in feature_names] for row in csv.DictReader(f)], dtype=np.float64)
+
+
+def mismatches(model, compiled: CompiledForest, X: np.ndarray) -> int:
+    """Rows whose probabilities differ in any bit from sklearn's predict_proba."""
+    import pandas as pd
+    names = list(getattr(model, "feature_names_in_", []))
+    expected = model.predict_proba(pd.DataFrame(X, columns=names) if names else X)
+    got = compiled.predict_proba(X)
+    return int((expected.view(np.uint64) != got.view(np.uint64)).any(axis=1).sum())
+
+
+def export(model_path: str = MODEL_PATH, out_path: str = COMPILED_PATH, verify_path: Optional[str] = DATASET_PATH) -> Dict:
+    import joblib
+    model = joblib.load(model_path)
+    sha = file_sha256(model_path)
+    names = list(getattr(model, "feature_names_in_", []))
+    X = dataset_matrix(names, verify_path) if verify_path and names and os.path.exists(verify_path) else None
+
+    chosen = None
+    for normalize in (False, True):
+        arrays = compile_forest(model, sha, normalize)
+        if X is None:
+            chosen = (arrays, None)
+            break
+        bad = mismatches(model, CompiledForest(arrays), X)
+        if bad == 0:
+            chosen = (arrays, 0)
+            break
+    if chosen is None:
+        raise SystemExit(f"Compiled forest does not reproduce sklearn on {verify_path}; nothing written")
+
+    arrays, bad = chosen
+    tmp_path = f"{out_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, out_path)
+    return {
+        "out": out_path,
+        "trees": len(arrays["roots"]),
+        "nodes": len(arrays["feature"]),
+        "bytes": os.path.getsize(out_path),
+        "leaf_normalized": bool(arrays["leaf_normalized"]),
+        "verified_rows": None if X is None else len(X),
+        "mismatched_rows": bad,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.nlp.compiled_forest", description="Compile the behavior RandomForest to NumPy arrays.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export")
+    p.add_argument("--model", default=MODEL_PATH)
+    p.add_argument("--out", default=COMPILED_PATH)
+    p.add_argument("--csv", default=DATASET_PATH, help="rows used for the bit-for-bit check ('' to skip)")
+    p = sub.add_parser("verify")
+    p.add_argument("--model", default=MODEL_PATH)
+    p.add_argument("--compiled", default=COMPILED_PATH)
+    p.add_argument("--csv", default=DATASET_PATH)
+    args = parser.parse_args(argv)
+
+    import warnings
+    warnings.filterwarnings("ignore", message=".*Trying to unpickle.*")
+    if args.command == "export":
+        for k, v in export(args.model, args.out, args.csv or None).items():
+            print(f"{k:<16} {v}")
+        return 0
+
+    import joblib
+    model = joblib.load(args.model)
+    compiled = load_compiled(args.compiled, args.model)
+    if compiled is None:
+        print(f"{args.compiled}: missing or stale (run export)")
+        return 1
+    X = dataset_matrix(compiled.feature_names, args.csv)
+    bad = mismatches(model, compiled, X)
+    start = time.perf_counter()
+    compiled.predict_proba(X)
+    batch_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for row in X[:200]:
+        compiled.predict_proba(row)
+    single_us = (time.perf_counter() - start) / min(200, len(X)) * 1e6
+    print(f"rows {len(X)}  mismatched {bad}  batch {batch_ms:.1f} ms  single {single_us:.0f} us/row")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
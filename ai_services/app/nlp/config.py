@@ -28,3 +28,37 @@ class GradingConfig:
     # 30% Global Semantic (overall meaning) + 70% Proposition Match (specific facts)
     weight_semantic: float = 0.30
     weight_propositions: float = 0.70
+
+    # Short-Answer Fast Path
+    # Model answers with at most this many tokens are graded lexically first.
+    short_answer_max_tokens: int = 6
+
+    # Student answers longer than the model answer by more than this go to the full pipeline.
+    short_answer_max_extra_tokens: int = 6
+
+    # Diacritic-insensitive ratio accepted as a misspelled correct answer (75% credit).
+    short_answer_fuzzy_threshold: float = 0.85
+
+    # Bi-Encoder Cascade
+    # Small multilingual model scores chunks first; mpnet only re-scores borderline ideas.
+    # Only takes effect when AI_FAST_ENCODER names a model (off by default, see model.py).
+    cascade_enabled: bool = True
+
+    # Fast-tier best similarity below this is accepted as a missing idea.
+    cascade_low: float = 0.30
+
+    # Fast-tier best similarity above this is accepted as a covered idea.
+    cascade_high: float = 0.90
+
+    # Dataset Memory
+    # Reuse instructor-graded samples from the bundled datasets before any model runs.
+    # Offline evaluation turns it off so samples are not graded by looking themselves up.
+    dataset_memory_enabled: bool = True
+
+    # Exam-wide Answer Clustering (batch grading)
+    # Merge distinct answers whose whole-answer embeddings are at least this similar.
+    cluster_embedding_enabled: bool = True
+    cluster_similarity_threshold: float = 0.97
+
+    # Surface ratio an embedding-merged answer must keep with its leader to copy the score.
+    cluster_recheck_ratio: float = 0.85
@@ -1,8 +1,9 @@
 import re
 import logging
 import numpy as np
-from typing import Tuple
+from typing import List, Tuple
 from .model import get_ai_model
+from app.deadline import DeadlineExceeded
 
 from .tokenizer import expand_abbreviations
 
@@ -110,31 +111,43 @@ class LogicAnalyzer:
         Determine if student_text contradicts, entails, or is neutral to model_text.
         Returns: (label, confidence_score)
         """
-        # 1. Preprocess
-        s_clean = self.preprocess(student_text)
-        m_clean = self.preprocess(model_text) # Typically model text is clean, but safe to run
-        
-        if not s_clean or not m_clean:
-            return 'neutral', 0.0
+        return self.analyze_batch([(student_text, model_text)])[0]
 
-        # 2. Prepare for Cross-Encoder
-        # Input format: [(sentence_A, sentence_B)]
-        pair = (s_clean, m_clean)
-        
-        # 3. Predict
+    def analyze_batch(self, pairs: List[Tuple[str, str]]) -> List[Tuple[str, float]]:
+        """
+        Batched version of analyze(): all (student, model) pairs go through the
+        Cross-Encoder in length-bucketed batches. Returns one (label, confidence) per pair.
+        """
+        results: List[Tuple[str, float]] = [('neutral', 0.0)] * len(pairs)
+
+        # 1. Preprocess (model text is typically clean, but safe to run)
+        cleaned, positions = [], []
+        for i, (student_text, model_text) in enumerate(pairs):
+            s_clean = self.preprocess(student_text)
+            m_clean = self.preprocess(model_text)
+            if s_clean and m_clean:
+                cleaned.append((s_clean, m_clean))
+                positions.append(i)
+
+        if not cleaned:
+            return results
+
+        # 2. Predict logits for all pairs at once
         try:
-            # Returns logits
-            scores = self.ai.cross_encoder.predict([pair])[0]
-            
+            all_scores = self.ai.predict_nli(cleaned)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Logic Analysis failed: {e}")
+            return results
+
+        for i, scores in zip(positions, all_scores):
             # Convert to probabilities (Softmax)
             probs = np.exp(scores) / np.sum(np.exp(scores))
-            
+
             # Get argmax label
-            label_idx = np.argmax(probs)
+            label_idx = int(np.argmax(probs))
             confidence = probs[label_idx]
-            
-            return self.label_map.get(label_idx, 'neutral'), float(confidence)
-            
-        except Exception as e:
-            logger.error(f"Logic Analysis failed: {e}")
-            return 'neutral', 0.0
+
+            results[i] = (self.label_map.get(label_idx, 'neutral'), float(confidence))
+        return results
@@ -5,7 +5,7 @@ Pipeline Order:
 1. STRICT EXACT MATCH (Raw & Simple Math)
 2. DATASET MEMORY (ML Feedback Loop)
 3. TECHNICAL ANSWER CHECK (Code/SQL)
-4. AI PRE-CHECK & EARLY DIACRITIC (Smart Bypass)
+4. AI PRE-CHECK & EARLY DIACRITIC (Smart Bypass / Short-Answer Lexical Engine)
 5. LOGIC GUARDRAILS (Facts, Directional, Antonyms, Word Salad)
 6. LENGTH RATIO CHECK (Early Partial Detection)
 7. FUZZY TYPO MATCH (Basic string similarity)
@@ -19,6 +19,7 @@ import logging
 import numpy as np
 import re
 import ast
+import time
 from difflib import SequenceMatcher
 from typing import Dict, Any, List, Set, Tuple, Optional
 from sentence_transformers import util
@@ -27,18 +28,23 @@ from .config import GradingConfig
 from .model import get_ai_model
 from .contradiction import LogicAnalyzer
 from .code_analyzer import CodeAnalyzer
+from .short_answer import ShortAnswerEngine
+from .cache import LRUCache
+from app.metrics import GRADE_SECONDS, METRICS_ENABLED, NULL_CLOCK, REGISTRY, cache_samples, stage_clock
+from app.profiling import profile_section
+from app.slowlog import observe_grading
 from .similarity import string_similarity, calculate_keyword_match, fuzzy_contains
 from .tokenizer import (
     ANTONYM_PAIRS, PASSIVE_MARKERS, HARD_LOCATIONS,
     expand_abbreviations, check_passive_voice, remove_vietnamese_diacritics,
-    normalize_synonyms, normalize_code_snippets
+    normalize_synonyms, normalize_code_snippets, extract_numbers
 )
 
 logger = logging.getLogger(__name__)
 
 class UniversityGrader:
-    def __init__(self):
-        self.config = GradingConfig()
+    def __init__(self, config: Optional[GradingConfig] = None):
+        self.config = config or GradingConfig()
         self.ai = get_ai_model()
         self.logic_analyzer = LogicAnalyzer()
         self.code_analyzer = CodeAnalyzer()
@@ -82,6 +88,16 @@ class UniversityGrader:
             "phản ánh": "thể hiện"
         }
 
+        self.short_answer = ShortAnswerEngine(
+            self.config,
+            contradicts=self._check_antonym_contradiction,
+            build_result=self._build_result,
+            preprocess=self.logic_analyzer.preprocess
+        )
+
+        # Đáp án mẫu: chuẩn hoá + tách ý, tính 1 lần cho mọi bài nộp (key: (mode, model_text))
+        self._model_artifacts = LRUCache(1024)
+
     # =========================================================================
     # HỆ THỐNG CÔNG CỤ NỀN TẢNG
     # =========================================================================
@@ -115,17 +131,10 @@ class UniversityGrader:
 
     def _is_number_mismatch(self, student_text: str, model_text: str) -> bool:
         """Kiểm tra xem sinh viên có đưa ra số liệu sai hoàn toàn so với đáp án không"""
-        m_nums = set()
-        for x in re.findall(r'-?\d+(?:[\.,]\d+)?', model_text):
-            try: m_nums.add(float(x.replace(',', '.')))
-            except: pass
-            
+        m_nums = extract_numbers(model_text)
         if not m_nums: return False
         
-        s_nums = set()
-        for x in re.findall(r'-?\d+(?:[\.,]\d+)?', student_text):
-            try: s_nums.add(float(x.replace(',', '.')))
-            except: pass
+        s_nums = extract_numbers(student_text)
         if s_nums and not m_nums.intersection(s_nums):
             return True
         return False
@@ -199,23 +208,110 @@ class UniversityGrader:
             if word in m_lower and any(ant in s_lower for ant in antonyms): return True
         return False
 
+    def _match_ideas(self, model_ideas: List[Dict[str, Any]], student_chunks: List[str]) -> List[Tuple[float, str]]:
+        """(best_sim, best_student_chunk) cho từng ý; encode tất cả ý + chunk SV trong 1 batch mỗi tier."""
+        matches: List[Optional[Tuple[float, str]]] = [None] * len(model_ideas)
+        pending = list(range(len(model_ideas)))
+        # Cascade: model nhỏ chấm trước, chỉ gọi mpnet cho các ý có điểm nằm trong vùng biên
+        for tier in self._embedding_tiers():
+            idea_texts = [model_ideas[i]["text"] for i in pending]
+            embs = self.ai.encode(idea_texts + student_chunks, tier=tier)
+            sims = util.cos_sim(embs[:len(idea_texts)], embs[len(idea_texts):])
+            best_idxs = sims.argmax(dim=1)
+            escalate = []
+            for row, i in enumerate(pending):
+                best_idx = int(best_idxs[row].item())
+                best_sim = sims[row, best_idx].item()
+                matches[i] = (best_sim, student_chunks[best_idx])
+                if tier == "fast":
+                    borderline = self.config.cascade_low <= best_sim <= self.config.cascade_high
+                    self.ai.record_cascade(escalated=borderline)
+                    if borderline: escalate.append(i)
+            pending = escalate
+            if not pending: break
+        return matches
+
+    def _is_technical_model(self, model_text: str) -> bool:
+        return self.code_analyzer.model_profile(model_text)["type"] != "text"
+
+    def _get_model_artifacts(self, model_text: str, mode: str, pin: bool = False) -> Dict[str, Any]:
+        key = (mode, model_text)
+        artifacts = self._model_artifacts.get(key)
+        if artifacts is None:
+            m_norm = self._standardize_text(model_text, mode)
+            artifacts = {
+                "m_norm": m_norm,
+                "m_syn": normalize_synonyms(normalize_code_snippets(model_text)),
+                "ideas": self._analyze_core_ideas(m_norm),
+            }
+            self._model_artifacts.put(key, artifacts, pin=pin)
+        elif pin:
+            self._model_artifacts.pin(key)
+        return artifacts
+
+    def _embedding_tiers(self) -> Tuple[str, ...]:
+        return ("fast", "full") if self.config.cascade_enabled and self.ai.has_fast_tier else ("full",)
+
+    def prepare_model_answer(self, model_text: str, grading_mode: str = "general") -> Dict[str, Any]:
+        """
+        Warm-up khi công bố/sửa đề: tính sẵn và ghim (pin) các artifact của đáp án mẫu
+        (chuẩn hoá, tách ý, embedding từng ý, cấu trúc code, ứng viên dataset).
+        """
+        from app.dataset_learning import prepare_model_answer as prepare_dataset
+        profile = self.code_analyzer.model_profile(model_text, pin=True)
+        mode = "technical" if grading_mode == "technical" or profile["type"] != "text" else "general"
+        artifacts = self._get_model_artifacts(model_text, mode, pin=True)
+        idea_texts = [idea["text"] for idea in artifacts["ideas"]]
+        tiers = self._embedding_tiers()
+        for tier in tiers:
+            self.ai.encode(idea_texts, tier=tier, pin=True)
+        return {
+            "grading_mode": mode,
+            "answer_type": profile["type"],
+            "ideas": len(idea_texts),
+            "core_ideas": sum(1 for idea in artifacts["ideas"] if idea["is_core"]),
+            "embedding_tiers": list(tiers),
+            "short_answer": self.short_answer.is_applicable(model_text),
+            **prepare_dataset(model_text),
+        }
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Hit/miss của mọi cache trong pipeline (cho /metrics)."""
+        ai_stats = self.ai.get_stats()
+        caches = {f"embedding_{tier}": info["cache"] for tier, info in ai_stats["tiers"].items()}
+        caches["nli"] = ai_stats["cross_encoder"]["cache"]
+        caches["model_artifacts"] = self._model_artifacts.stats()
+        caches["code_profiles"] = self.code_analyzer._model_profiles.stats()
+        return caches
+
+    def release_model_answer(self, model_text: str, grading_mode: str = "general"):
+        """Bỏ ghim artifact của đáp án mẫu (đề đã sửa/đóng); LRU được phép xoá lại."""
+        for mode in ("general", "technical"):
+            artifacts = self._model_artifacts.get((mode, model_text))
+            if artifacts is not None:
+                self.ai.unpin_texts([idea["text"] for idea in artifacts["ideas"]])
+            self._model_artifacts.unpin((mode, model_text))
+        self.code_analyzer.release_model(model_text)
+
     # =========================================================================
     # MODEL 1: ĐẠI CƯƠNG (GENERAL PIPELINE)
     # =========================================================================
-    def _grade_general_model(self, student_text: str, model_text: str, s_clean: str, m_syn: str, s_norm: str, m_norm: str, max_points: float, is_long_answer: bool) -> Dict[str, Any]:
+    def _grade_general_model(self, student_text: str, model_text: str, s_clean: str, m_syn: str, s_norm: str, m_norm: str, max_points: float, is_long_answer: bool, clock=NULL_CLOCK) -> Dict[str, Any]:
         is_rev, verb = self._check_directional_logic(student_text, model_text)
-        if is_rev: return self._build_result(max_points * 0.20, f"Đảo ngược logic ('{verb}').", "Logic Reversal")
-        if self._is_word_salad(student_text, model_text): return self._build_result(0.0, "Phát hiện nhồi từ vô nghĩa (Word Salad).", "Syntax Error")
-        if self._check_antonym_contradiction(s_clean, model_text): return self._build_result(max_points * 0.05, "Sai lệch bản chất cốt lõi.", "Contradiction")
+        if is_rev: return clock.exit("guardrails", self._build_result(max_points * 0.20, f"Đảo ngược logic ('{verb}').", "Logic Reversal"))
+        if self._is_word_salad(student_text, model_text): return clock.exit("guardrails", self._build_result(0.0, "Phát hiện nhồi từ vô nghĩa (Word Salad).", "Syntax Error"))
+        if self._check_antonym_contradiction(s_clean, model_text): return clock.exit("guardrails", self._build_result(max_points * 0.05, "Sai lệch bản chất cốt lõi.", "Contradiction"))
 
         length_ratio = len(s_clean) / len(model_text) if len(model_text) > 0 else 0
         if is_long_answer and length_ratio < 0.4:
-            return self._build_result(max_points * 0.30, "Câu trả lời quá ngắn.", "Partial")
+            return clock.exit("guardrails", self._build_result(max_points * 0.30, "Câu trả lời quá ngắn.", "Partial"))
+        clock.mark("guardrails")
 
         lev_ratio = SequenceMatcher(None, s_norm, m_norm).ratio()
-        if lev_ratio >= 0.95: return self._build_result(max_points, "Khớp hoàn toàn.", "Typo")
+        if lev_ratio >= 0.95: return clock.exit("fuzzy", self._build_result(max_points, "Khớp hoàn toàn.", "Typo"))
+        clock.mark("fuzzy")
 
-        model_ideas = self._analyze_core_ideas(m_norm)
+        model_ideas = self._get_model_artifacts(model_text, "general")["ideas"]
         student_chunks = self._chunk_into_sentences(s_norm) or [s_norm]
         student_kws = self._extract_keywords(s_norm, min_len=1)
         
@@ -223,17 +319,18 @@ class UniversityGrader:
         feedback_details = []
         is_fully_entailed = False
         
+        matches = self._match_ideas(model_ideas, student_chunks)
+        clock.mark("semantic_chunking")
+        # NLI theo batch; ý có sim < 0.35 bị chấm "Thiếu" nên không cần NLI
+        nli_idx = [i for i, (sim, _) in enumerate(matches) if sim >= 0.35]
+        nli_results = dict(zip(nli_idx, self.logic_analyzer.analyze_batch([(matches[i][1], model_ideas[i]["text"]) for i in nli_idx])))
+        clock.mark("nli")
+
         for i, idea in enumerate(model_ideas):
             chunk_max_points = max_points * idea["point_ratio"]
-            m_chunk = idea["text"]
-            emb_m = self.ai.bi_encoder.encode(m_chunk, convert_to_tensor=True)
+            best_sim, best_s_chunk = matches[i]
             
-            best_sim, best_s_chunk = -1, ""
-            for s_chunk in student_chunks:
-                sim = util.cos_sim(self.ai.bi_encoder.encode(s_chunk, convert_to_tensor=True), emb_m).item()
-                if sim > best_sim: best_sim, best_s_chunk = sim, s_chunk
-            
-            logic_label, logic_conf = self.logic_analyzer.analyze(best_s_chunk, m_chunk)
+            logic_label, logic_conf = nli_results.get(i, ('neutral', 0.0))
             chunk_kws_cov = len(idea["keywords"].intersection(student_kws)) / len(idea["keywords"]) if idea["keywords"] else 1.0
             
             if logic_label == 'entailment' and chunk_kws_cov < 0.60: logic_label = 'neutral' 
@@ -287,16 +384,16 @@ class UniversityGrader:
         diac_ratio = self._get_diacritic_ratio(s_clean, model_text)
         if diac_ratio >= 0.85 and (final_score / max_points) < 0.85:
             final_score = max(final_score, max_points * 0.75)
-            return self._build_result(final_score, "Đúng ý nhưng sai lỗi chính tả.", "Typo")
+            return clock.exit("coverage", self._build_result(final_score, "Đúng ý nhưng sai lỗi chính tả.", "Typo"))
 
         feedback = " | ".join(feedback_details)
         if coverage_multiplier < 1.0 and "Diễn đạt" not in feedback: feedback += f" (Coverage: {int(coverage_ratio*100)}%)"
-        return self._build_result(final_score, feedback, "Paraphrase" if final_score >= max_points * 0.7 else "Partial")
+        return clock.exit("coverage", self._build_result(final_score, feedback, "Paraphrase" if final_score >= max_points * 0.7 else "Partial"))
 
     # =========================================================================
     # MODEL 2: KỸ THUẬT (TECHNICAL PIPELINE)
     # =========================================================================
-    def _grade_technical_model(self, student_text: str, model_text: str, s_clean: str, m_syn: str, s_norm: str, m_norm: str, max_points: float, is_long_answer: bool) -> Dict[str, Any]:
+    def _grade_technical_model(self, student_text: str, model_text: str, s_clean: str, m_syn: str, s_norm: str, m_norm: str, max_points: float, is_long_answer: bool, clock=NULL_CLOCK) -> Dict[str, Any]:
         strong_code = r"(def\s+__init__|\bclass\s+\w+|public\s+class|\bvoid\s+\w+|#include|<iostream>|std::)"
         generic_code = r"([{}();]|\breturn\b|=>|->|//|/\*.*\*/)"
         
@@ -307,30 +404,33 @@ class UniversityGrader:
             tech_result = self.code_analyzer.grade(model_text, student_text, max_points)
             if tech_result:
                 # Nếu code_analyzer trả về điểm (kể cả 0), return
-                return self._build_result(tech_result["score"], tech_result["explanation"], tech_result["type"])
+                return clock.exit("technical", self._build_result(tech_result["score"], tech_result["explanation"], tech_result["type"]))
             
         s_code, m_code = student_text.strip().rstrip(":"), model_text.strip().rstrip(":")
         try:
             if ast.dump(ast.parse(s_code)) == ast.dump(ast.parse(m_code)):
-                return self._build_result(max_points, "Biểu thức code tương đương logic (AST).", "AST Match")
+                return clock.exit("technical", self._build_result(max_points, "Biểu thức code tương đương logic (AST).", "AST Match"))
         except Exception: pass 
+        clock.mark("technical")
 
         is_rev, verb = self._check_directional_logic(student_text, model_text)
-        if is_rev: return self._build_result(max_points * 0.20, f"Đảo ngược logic OOP/Code ('{verb}').", "Logic Reversal")
+        if is_rev: return clock.exit("guardrails", self._build_result(max_points * 0.20, f"Đảo ngược logic OOP/Code ('{verb}').", "Logic Reversal"))
         
         if not (is_model_code or is_student_code):
             if self._is_word_salad(student_text, model_text): 
-                return self._build_result(0.0, "Nhồi từ vô nghĩa.", "Syntax Error")
+                return clock.exit("guardrails", self._build_result(0.0, "Nhồi từ vô nghĩa.", "Syntax Error"))
                 
-        if self._check_antonym_contradiction(s_clean, model_text): return self._build_result(max_points * 0.05, "Sai bản chất thuật ngữ.", "Contradiction")
+        if self._check_antonym_contradiction(s_clean, model_text): return clock.exit("guardrails", self._build_result(max_points * 0.05, "Sai bản chất thuật ngữ.", "Contradiction"))
 
         length_ratio = len(s_clean) / len(model_text) if len(model_text) > 0 else 0
-        if is_long_answer and length_ratio < 0.4: return self._build_result(max_points * 0.3, "Câu trả lời lý thuyết quá ngắn.", "Partial")
+        if is_long_answer and length_ratio < 0.4: return clock.exit("guardrails", self._build_result(max_points * 0.3, "Câu trả lời lý thuyết quá ngắn.", "Partial"))
+        clock.mark("guardrails")
         
         lev_ratio = SequenceMatcher(None, s_norm, m_norm).ratio()
-        if lev_ratio >= 0.95: return self._build_result(max_points, "Khớp hoàn toàn.", "Typo")
+        if lev_ratio >= 0.95: return clock.exit("fuzzy", self._build_result(max_points, "Khớp hoàn toàn.", "Typo"))
+        clock.mark("fuzzy")
 
-        model_ideas = self._analyze_core_ideas(m_norm)
+        model_ideas = self._get_model_artifacts(model_text, "technical")["ideas"]
         student_chunks = self._chunk_into_sentences(s_norm) or [s_norm]
         student_kws = self._extract_keywords(s_norm, min_len=1)
         
@@ -338,18 +438,16 @@ class UniversityGrader:
         feedback_details = []
         is_fully_entailed = False
         
+        matches = self._match_ideas(model_ideas, student_chunks)
+        clock.mark("semantic_chunking")
+        # Bật NLI để nhận diện sinh viên giải thích đúng bản chất dù khác từ (1 batch cho mọi ý)
+        nli_results = self.logic_analyzer.analyze_batch([(best_s_chunk, idea["text"]) for idea, (_, best_s_chunk) in zip(model_ideas, matches)])
+        clock.mark("nli")
+
         for i, idea in enumerate(model_ideas):
             chunk_max_points = max_points * idea["point_ratio"]
-            m_chunk = idea["text"]
-            emb_m = self.ai.bi_encoder.encode(m_chunk, convert_to_tensor=True)
-            
-            best_sim, best_s_chunk = -1, ""
-            for s_chunk in student_chunks:
-                sim = util.cos_sim(self.ai.bi_encoder.encode(s_chunk, convert_to_tensor=True), emb_m).item()
-                if sim > best_sim: best_sim, best_s_chunk = sim, s_chunk
-
-            # Bật NLI để nhận diện sinh viên giải thích đúng bản chất dù khác từ
-            logic_label, logic_conf = self.logic_analyzer.analyze(best_s_chunk, m_chunk)
+            best_sim, best_s_chunk = matches[i]
+            logic_label, logic_conf = nli_results[i]
             
             if (is_model_code or is_student_code):
                 best_sim = min(1.0, best_sim * 1.5) # Thưởng nóng Code Snippet
@@ -408,71 +506,148 @@ class UniversityGrader:
         diac_ratio = self._get_diacritic_ratio(s_clean, model_text)
         if diac_ratio >= 0.85 and (final_score / max_points) < 0.85:
             final_score = max(final_score, max_points * 0.75)
-            return self._build_result(final_score, "Đúng ý nhưng sai lỗi chính tả.", "Typo")
+            return clock.exit("coverage", self._build_result(final_score, "Đúng ý nhưng sai lỗi chính tả.", "Typo"))
 
         feedback = " | ".join(feedback_details)
         if coverage_multiplier < 1.0 and not is_model_code: feedback += f" (Coverage thấp: {int(coverage_ratio*100)}%)"
-        return self._build_result(final_score, feedback, "Technical Model")
+        return clock.exit("coverage", self._build_result(final_score, feedback, "Technical Model"))
 
     # =========================================================================
     # ROUTER ĐIỀU HƯỚNG TỪ API 
     # =========================================================================
     def grade(self, student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Dict[str, Any]:
-        if not student_text or not model_text: return self._build_result(0.0, "Missing input text.", "None")
+        clock = stage_clock()
+        start = time.perf_counter()
+        with profile_section():
+            result = self._grade(student_text, model_text, max_points, grading_mode, clock)
+        elapsed = time.perf_counter() - start
+        if METRICS_ENABLED: GRADE_SECONDS.observe(elapsed, mode=grading_mode or "general")
+        observe_grading(elapsed * 1000, student_text, model_text, max_points, grading_mode, clock.stages, result)
+        return result
+
+    def _grade(self, student_text: str, model_text: str, max_points: float, grading_mode: str, clock) -> Dict[str, Any]:
+        if not student_text or not model_text: return clock.exit("preprocess", self._build_result(0.0, "Missing input text.", "None"))
         
         if grading_mode != "technical":
-            if self.code_analyzer.is_technical_answer(model_text) or self.code_analyzer.is_technical_answer(student_text):
+            if self._is_technical_model(model_text) or self.code_analyzer.is_technical_answer(student_text):
                 grading_mode = "technical"
                 logger.info("[Auto-Route] 🔀 Upgraded to technical mode based on content")
 
+        artifacts = self._get_model_artifacts(model_text, grading_mode)
         s_norm = self._standardize_text(student_text, grading_mode)
-        m_norm = self._standardize_text(model_text, grading_mode)
+        m_norm = artifacts["m_norm"]
         
-        s_code_norm, m_code_norm = normalize_code_snippets(student_text), normalize_code_snippets(model_text)
-        s_clean = self.logic_analyzer.preprocess(s_code_norm)
-        m_syn = normalize_synonyms(m_code_norm)
+        s_clean = self.logic_analyzer.preprocess(normalize_code_snippets(student_text))
+        m_syn = artifacts["m_syn"]
         
         is_long_answer = len(model_text) > 300
+        clock.mark("preprocess")
+
+        fast_result = self._grade_lexical_layers(student_text, model_text, s_norm, m_norm, max_points, grading_mode, clock)
+        if fast_result: return fast_result
+
+        if grading_mode == "technical":
+            return self._grade_technical_model(student_text, model_text, s_clean, m_syn, s_norm, m_norm, max_points, is_long_answer, clock)
+        else:
+            return self._grade_general_model(student_text, model_text, s_clean, m_syn, s_norm, m_norm, max_points, is_long_answer, clock)
 
-        if s_norm == m_norm: return self._build_result(max_points, "Khớp chính xác tuyệt đối.", "Exact")
+    def grade_lexical(self, student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Optional[Dict[str, Any]]:
+        """Chỉ chạy các tầng không dùng model (exact, toán, dataset, đáp án ngắn). None = cần pipeline AI."""
+        if not student_text or not model_text: return self._build_result(0.0, "Missing input text.", "None")
+        if grading_mode != "technical":
+            if self._is_technical_model(model_text) or self.code_analyzer.is_technical_answer(student_text):
+                grading_mode = "technical"
+        s_norm = self._standardize_text(student_text, grading_mode)
+        m_norm = self._get_model_artifacts(model_text, grading_mode)["m_norm"]
+        return self._grade_lexical_layers(student_text, model_text, s_norm, m_norm, max_points, grading_mode)
+
+    def grade_degraded(self, student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Dict[str, Any]:
+        """
+        Chế độ quá tải: các tầng lexical + dataset memory, chưa kết luận được thì chấm theo
+        độ phủ từ khoá của từng ý. Không gọi model; điểm tạm, sẽ được chấm lại đầy đủ.
+        """
+        if not student_text or not model_text: return self._build_result(0.0, "Missing input text.", "None")
+        if grading_mode != "technical":
+            if self._is_technical_model(model_text) or self.code_analyzer.is_technical_answer(student_text):
+                grading_mode = "technical"
+        s_norm = self._standardize_text(student_text, grading_mode)
+        artifacts = self._get_model_artifacts(model_text, grading_mode)
+        m_norm = artifacts["m_norm"]
+        lexical = self._grade_lexical_layers(student_text, model_text, s_norm, m_norm, max_points, grading_mode)
+        if lexical: return lexical
+
+        if self._is_word_salad(student_text, model_text): return self._build_result(0.0, "Phát hiện nhồi từ vô nghĩa (Word Salad).", "Syntax Error")
+        if SequenceMatcher(None, s_norm, m_norm).ratio() >= 0.95: return self._build_result(max_points, "Khớp hoàn toàn.", "Typo")
+
+        student_kws = self._extract_keywords(s_norm, min_len=1)
+        total_score = 0.0
+        for idea in artifacts["ideas"]:
+            kws_cov = len(idea["keywords"].intersection(student_kws)) / len(idea["keywords"]) if idea["keywords"] else 1.0
+            total_score += max_points * idea["point_ratio"] * kws_cov
+        result = self._build_result(min(total_score, max_points), "Chấm tạm theo độ phủ từ khoá (hệ thống quá tải), sẽ chấm lại đầy đủ.", "Degraded Lexical")
+        result["confidence"] = 0.5
+        return result
+
+    def _grade_lexical_layers(self, student_text: str, model_text: str, s_norm: str, m_norm: str, max_points: float, grading_mode: str, clock=NULL_CLOCK) -> Optional[Dict[str, Any]]:
+        if s_norm == m_norm: return clock.exit("exact_match", self._build_result(max_points, "Khớp chính xác tuyệt đối.", "Exact"))
         
         if re.match(r'^[\d\s.+\-×÷*/=]+[.!?]?$', model_text.strip()):
-            m_nums = set()
-            for x in re.findall(r'-?\d+(?:[\.,]\d+)?', model_text):
-                try: m_nums.add(float(x.replace(',', '.')))
-                except: pass
-            s_nums = set()
-            for x in re.findall(r'-?\d+(?:[\.,]\d+)?', student_text):
-                try: s_nums.add(float(x.replace(',', '.')))
-                except: pass
+            m_nums = extract_numbers(model_text)
+            s_nums = extract_numbers(student_text)
                 
             if m_nums:
                 if m_nums == s_nums: # Tuyệt đối khớp số lượng
-                    return self._build_result(max_points, "Đáp án toán chính xác.", "Exact")
+                    return clock.exit("exact_match", self._build_result(max_points, "Đáp án toán chính xác.", "Exact"))
                 elif m_nums.issubset(s_nums):
                     # Nếu chứa đáp án đúng nhưng kèm số liệu khác -> Phạt nhẹ vì trả lời nước đôi
                     if len(s_nums) > len(m_nums) + 1: 
-                        return self._build_result(max_points * 0.5, "Chứa đáp án đúng nhưng dư thừa số liệu/trả lời nước đôi.", "Partial Math")
-                    return self._build_result(max_points * 0.9, "Đáp án toán chính xác (kèm dư liệu).", "Exact")
+                        return clock.exit("exact_match", self._build_result(max_points * 0.5, "Chứa đáp án đúng nhưng dư thừa số liệu/trả lời nước đôi.", "Partial Math"))
+                    return clock.exit("exact_match", self._build_result(max_points * 0.9, "Đáp án toán chính xác (kèm dư liệu).", "Exact"))
                 else:
-                    return self._build_result(0.0, "Kết quả toán học sai.", "Wrong")
+                    return clock.exit("exact_match", self._build_result(0.0, "Kết quả toán học sai.", "Wrong"))
+        clock.mark("exact_match")
 
         try:
             from app.dataset_learning import find_similar_to_grading
-            dataset_result = find_similar_to_grading(student_text, model_text, max_points)
+            dataset_result = find_similar_to_grading(student_text, model_text, max_points) if self.config.dataset_memory_enabled else None
             if dataset_result and dataset_result.get("score") is not None:
                 if not student_text.startswith("Tính Polymorphism") and not student_text.startswith("def __init__"):
-                    return self._build_result(dataset_result['score'], f"{dataset_result['feedback']} (AI learned from Dataset)", dataset_result.get('type', 'Learned Pattern'))
+                    return clock.exit("dataset_memory", self._build_result(dataset_result['score'], f"{dataset_result['feedback']} (AI learned from Dataset)", dataset_result.get('type', 'Learned Pattern')))
         except ImportError: pass
+        clock.mark("dataset_memory")
 
-        if grading_mode == "technical":
-            return self._grade_technical_model(student_text, model_text, s_clean, m_syn, s_norm, m_norm, max_points, is_long_answer)
-        else:
-            return self._grade_general_model(student_text, model_text, s_clean, m_syn, s_norm, m_norm, max_points, is_long_answer)
+        # Đáp án ngắn (tên, năm, thuật ngữ): chấm bằng từ vựng, chỉ escalate khi chưa kết luận được
+        if self.short_answer.is_applicable(model_text) and not (
+            self._is_technical_model(model_text) or self.code_analyzer.is_technical_answer(student_text)
+        ):
+            short_result = self.short_answer.grade(student_text, model_text, max_points, grading_mode)
+            if short_result: return clock.exit("short_answer", short_result)
+            clock.mark("short_answer")
+
+        return None
 
 _GLOBAL_GRADER = None
 
-def calculate_score(student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Dict[str, Any]:
+def _cache_metrics():
+    if _GLOBAL_GRADER is not None:
+        yield from cache_samples(_GLOBAL_GRADER.cache_stats())
+
+REGISTRY.register_collector(_cache_metrics)
+
+def get_grader() -> UniversityGrader:
     global _GLOBAL_GRADER
     if _GLOBAL_GRADER is None: _GLOBAL_GRADER = UniversityGrader()
-    return _GLOBAL_GRADER.grade(student_text, model_text, max_points, grading_mode)
\ No newline at end of file
+    return _GLOBAL_GRADER
+
+def calculate_score(student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Dict[str, Any]:
+    return get_grader().grade(student_text, model_text, max_points, grading_mode)
+
+def regrade_question(answers: List[Dict[str, Any]], old_model_text: str, new_model_text: str, max_points: float, grading_mode: str = "general"):
+    """Chấm lại 1 câu hỏi sau khi sửa đáp án mẫu: chỉ ý thay đổi mới chạy lại model. Trả về iterator."""
+    from .regrade import IncrementalRegrader
+    return IncrementalRegrader(get_grader()).regrade(answers, old_model_text, new_model_text, max_points, grading_mode)
+
+def calculate_scores_clustered(student_texts: List[str], model_text: str, max_points: float, grading_mode: str = "general") -> Dict[str, Any]:
+    """Chấm cả lớp cho 1 câu hỏi: gom nhóm bài gần giống nhau, mỗi nhóm chỉ chấm 1 lần."""
+    from .clustering import AnswerClusterer
+    return AnswerClusterer(get_grader()).grade_batch(student_texts, model_text, max_points, grading_mode)
\ No newline at end of file
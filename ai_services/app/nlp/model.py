@@ -1,25 +1,120 @@
 import logging
+import os
+import threading
+import time
+import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer, CrossEncoder
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .cache import LRUCache
+from app.deadline import check_deadline
+from app.metrics import observe_batch
+from app.tracing import span
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+FULL_ENCODER_NAME = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+CROSS_ENCODER_NAME = 'symanto/xlm-roberta-base-snli-mnli-anli-xnli'
+# Tier 1 (first-pass similarity), opt-in: off until an eval_configs run with the real models shows the
+# cascade keeps nMAE within budget (its similarities feed thresholds tuned on mpnet scores).
+# Enable with AI_FAST_ENCODER=sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+FAST_ENCODER_NAME = os.getenv("AI_FAST_ENCODER", "")
+EMBEDDING_CACHE_SIZE = int(os.getenv("AI_EMBEDDING_CACHE_SIZE", "4096"))
+# (student chunk, model idea) -> NLI logits; unchanged ideas skip the cross-encoder on regrade
+NLI_CACHE_SIZE = int(os.getenv("AI_NLI_CACHE_SIZE", "8192"))
+# Padded tokens (batch size x longest item) allowed per forward pass
+MAX_TOKENS_PER_BATCH = int(os.getenv("AI_MAX_TOKENS_PER_BATCH", "8192"))
+
+TIER_FAST = "fast"
+TIER_FULL = "full"
+
+
+def _tensor_bytes(tensor: torch.Tensor) -> int:
+    return tensor.element_size() * tensor.nelement()
+
+
+def _parameter_bytes(model: Any) -> Dict[str, int]:
+    count, size = 0, 0
+    try:
+        for p in model.parameters():
+            count += p.nelement()
+            size += p.nelement() * p.element_size()
+    except Exception:
+        pass
+    return {"parameters": count, "parameter_bytes": size}
+
+
+def length_bucketed_batches(lengths: Sequence[int], max_tokens_per_batch: int = MAX_TOKENS_PER_BATCH) -> List[List[int]]:
+    """
+    Group item indices into batches of similar token length.
+    Items are sorted by length; a batch is closed as soon as adding the next item
+    would make (batch size x longest item) exceed max_tokens_per_batch, so short
+    chunks are never padded to the length of a long one.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = []
+    current: List[int] = []
+    longest = 0
+    for i in order:
+        length = max(1, lengths[i])
+        if current and max(longest, length) * (len(current) + 1) > max_tokens_per_batch:
+            batches.append(current)
+            current, longest = [], 0
+        current.append(i)
+        longest = max(longest, length)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _token_lengths(model: Any, items: Sequence[Union[str, Tuple[str, str]]]) -> List[int]:
+    """Token count per item (pairs for the cross-encoder), word count if no tokenizer."""
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None and items:
+        try:
+            if isinstance(items[0], tuple):
+                encoded = tokenizer([a for a, _ in items], [b for _, b in items], truncation=True)
+            else:
+                encoded = tokenizer(list(items), truncation=True)
+            cap = getattr(model, "max_seq_length", None) or float("inf")
+            return [min(len(ids), cap) for ids in encoded["input_ids"]]
+        except Exception:
+            pass
+    return [len(" ".join(item).split()) if isinstance(item, tuple) else len(item.split()) for item in items]
+
+
 class AIModel:
     _instance = None
     _bi_encoder: Optional[SentenceTransformer] = None
     _cross_encoder: Optional[CrossEncoder] = None
+    _fast_encoder: Optional[SentenceTransformer] = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(AIModel, cls).__new__(cls)
+            cls._instance._init_caches()
             cls._instance._initialize_models()
         return cls._instance
 
+    def _init_caches(self):
+        # One embedding cache + counters per encoder tier
+        self._embedding_caches = {
+            TIER_FAST: LRUCache(EMBEDDING_CACHE_SIZE, sizeof=_tensor_bytes),
+            TIER_FULL: LRUCache(EMBEDDING_CACHE_SIZE, sizeof=_tensor_bytes),
+        }
+        self._nli_cache = LRUCache(NLI_CACHE_SIZE)
+        self._stats_lock = threading.Lock()
+        self._encode_stats = {
+            tier: {"encode_calls": 0, "texts_encoded": 0, "encode_seconds": 0.0}
+            for tier in (TIER_FAST, TIER_FULL)
+        }
+        self._cascade_stats = {"fast_accepted": 0, "escalated": 0}
+        self.max_tokens_per_batch = MAX_TOKENS_PER_BATCH
+
     def _initialize_models(self):
         try:
-            import os
             if torch.cuda.is_available():
                 device = 'cuda'
                 gpu_name = torch.cuda.get_device_name(0)
@@ -30,23 +125,32 @@ class AIModel:
                 num_threads = os.cpu_count() or 4
                 torch.set_num_threads(num_threads)
                 logger.info(f"⚙️ No GPU detected, using CPU with {num_threads} threads")
-            
+
             logger.info(f"Loading models on {device}...")
 
             # 1. Bi-Encoder: For Semantic Similarity (Fast)
             self._bi_encoder = SentenceTransformer(
-                'sentence-transformers/paraphrase-multilingual-mpnet-base-v2', 
+                FULL_ENCODER_NAME,
                 device=device
             )
             logger.info("✅ Bi-Encoder loaded successfully.")
 
             # 2. Cross-Encoder: For NLI/Logic Analysis (Accurate)
             self._cross_encoder = CrossEncoder(
-                'symanto/xlm-roberta-base-snli-mnli-anli-xnli', 
+                CROSS_ENCODER_NAME,
                 device=device
             )
             logger.info("✅ Cross-Encoder loaded successfully.")
 
+            # 3. Optional small Bi-Encoder: first tier of the similarity cascade
+            if FAST_ENCODER_NAME and FAST_ENCODER_NAME.lower() != "none":
+                try:
+                    self._fast_encoder = SentenceTransformer(FAST_ENCODER_NAME, device=device)
+                    logger.info(f"✅ Fast Bi-Encoder loaded successfully ({FAST_ENCODER_NAME}).")
+                except Exception as e:
+                    self._fast_encoder = None
+                    logger.warning(f"⚠️ Fast Bi-Encoder unavailable, cascade disabled: {e}")
+
             if device == 'cuda':
                 torch.cuda.empty_cache()
                 logger.info(f"📊 GPU Memory used: {torch.cuda.memory_allocated(0) / 1024**2:.1f} MB")
@@ -67,6 +171,148 @@ class AIModel:
             self._initialize_models()
         return self._cross_encoder
 
+    @property
+    def fast_encoder(self) -> Optional[SentenceTransformer]:
+        return self._fast_encoder
+
+    @property
+    def has_fast_tier(self) -> bool:
+        return self._fast_encoder is not None
+
+    def _encoder_for(self, tier: str) -> SentenceTransformer:
+        if tier == TIER_FAST and self._fast_encoder is not None:
+            return self._fast_encoder
+        return self.bi_encoder
+
+    def encode(self, texts: Union[str, List[str]], tier: str = TIER_FULL, pin: bool = False) -> torch.Tensor:
+        """
+        Encode text(s) with the given tier, reusing cached embeddings.
+        pin=True keeps the embeddings cached until unpin_texts() (prepared exam questions).
+        Returns a 1-D tensor for a single string, a 2-D tensor for a list.
+        """
+        if tier == TIER_FAST and self._fast_encoder is None:
+            tier = TIER_FULL
+        single = isinstance(texts, str)
+        items = [texts] if single else list(texts)
+        cache = self._embedding_caches[tier]
+
+        results: List[Optional[torch.Tensor]] = [None] * len(items)
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(items):
+            emb = cache.get(text)
+            if emb is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                results[i] = emb
+                if pin: cache.pin(text)
+
+        if missing:
+            unique_texts = list(missing.keys())
+            encoder = self._encoder_for(tier)
+            start = time.perf_counter()
+            embeddings = self.run_bucketed(
+                encoder, unique_texts,
+                lambda batch: encoder.encode(batch, batch_size=len(batch), convert_to_tensor=True, show_progress_bar=False),
+                name=f"bi_encoder_{tier}"
+            )
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                stats = self._encode_stats[tier]
+                stats["encode_calls"] += 1
+                stats["texts_encoded"] += len(unique_texts)
+                stats["encode_seconds"] += elapsed
+            for text, emb in zip(unique_texts, embeddings):
+                cache.put(text, emb, pin=pin)
+                for i in missing[text]:
+                    results[i] = emb
+
+        if single:
+            return results[0]
+        return torch.stack(results) if results else torch.empty(0)
+
+    def unpin_texts(self, texts: List[str]):
+        """Release pinned embeddings (all tiers) so the LRU can evict them again."""
+        for cache in self._embedding_caches.values():
+            for text in texts:
+                cache.unpin(text)
+
+    def run_bucketed(self, model: Any, items: Sequence[Any], fn: Callable[[List[Any]], Any], name: str = "model") -> List[Any]:
+        """
+        Run fn over length-bucketed batches of items under torch.inference_mode
+        and return per-item outputs in the original order.
+        """
+        outputs: List[Any] = [None] * len(items)
+        if not items:
+            return outputs
+        lengths = _token_lengths(model, items)
+        for batch in length_bucketed_batches(lengths, self.max_tokens_per_batch):
+            # Abandoned request (deadline passed / client gone): don't start another forward pass
+            check_deadline(f"model.{name}")
+            start = time.perf_counter()
+            with span(f"model.{name}", batch_size=len(batch), max_tokens=max(lengths[i] for i in batch)), torch.inference_mode():
+                batch_out = fn([items[i] for i in batch])
+            observe_batch(name, len(batch), time.perf_counter() - start)
+            for i, out in zip(batch, batch_out):
+                outputs[i] = out
+        return outputs
+
+    def predict_nli(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """Cross-encoder logits for (premise, hypothesis) pairs, bucketed by length and cached per pair."""
+        if not pairs:
+            return np.zeros((0, 3))
+        logits: List[Optional[np.ndarray]] = [self._nli_cache.get(tuple(pair)) for pair in pairs]
+        missing = list(dict.fromkeys(tuple(pairs[i]) for i, row in enumerate(logits) if row is None))
+        if missing:
+            model = self.cross_encoder
+            predicted = self.run_bucketed(
+                model, missing,
+                lambda batch: model.predict(batch, batch_size=len(batch), show_progress_bar=False),
+                name="cross_encoder"
+            )
+            computed = {}
+            for pair, row in zip(missing, predicted):
+                computed[pair] = np.asarray(row)
+                self._nli_cache.put(pair, computed[pair])
+            logits = [row if row is not None else computed[tuple(pair)] for pair, row in zip(pairs, logits)]
+        return np.stack(logits)
+
+    def record_cascade(self, escalated: bool):
+        with self._stats_lock:
+            self._cascade_stats["escalated" if escalated else "fast_accepted"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-tier cache/memory accounting + cascade counters (for /model/stats)."""
+        tiers = {}
+        for tier, model, name in (
+            (TIER_FAST, self._fast_encoder, FAST_ENCODER_NAME),
+            (TIER_FULL, self._bi_encoder, FULL_ENCODER_NAME),
+        ):
+            cache_stats = self._embedding_caches[tier].stats()
+            memory = _parameter_bytes(model) if model is not None else {"parameters": 0, "parameter_bytes": 0}
+            with self._stats_lock:
+                encode_stats = dict(self._encode_stats[tier])
+            tiers[tier] = {
+                "model": name if model is not None else None,
+                "loaded": model is not None,
+                **memory,
+                **encode_stats,
+                "cache": cache_stats,
+                "total_bytes": memory["parameter_bytes"] + cache_stats["bytes"],
+            }
+        with self._stats_lock:
+            cascade = dict(self._cascade_stats)
+        decided = cascade["fast_accepted"] + cascade["escalated"]
+        cascade["fast_accept_rate"] = round(cascade["fast_accepted"] / decided, 4) if decided else 0.0
+        return {
+            "tiers": tiers,
+            "cross_encoder": {
+                "model": CROSS_ENCODER_NAME,
+                **(_parameter_bytes(self._cross_encoder) if self._cross_encoder is not None else {}),
+                "cache": self._nli_cache.stats(),
+            },
+            "cascade": cascade,
+        }
+
 # Global helper to get the singleton instance
 def get_ai_model():
     return AIModel()
@@ -0,0 +1,88 @@
+"""
+regrade.py
+Incremental regrade of one question after the instructor edits the model answer.
+
+1. Diff the old and new model-answer ideas (UniversityGrader._analyze_core_ideas)
+2. Unpin the old answer's artifacts, prepare + pin the new one (only changed ideas are encoded)
+3. Regrade every submission: student chunk embeddings and NLI results of unchanged
+   (chunk, idea) pairs come from the model caches, so only changed ideas hit the models
+4. Results are yielded one by one so the API can stream them back
+"""
+
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .clustering import answer_key
+
+logger = logging.getLogger(__name__)
+
+
+def diff_ideas(old_ideas: List[Dict[str, Any]], new_ideas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compare idea texts of two model answers (order-insensitive)."""
+    old_texts = [idea["text"] for idea in old_ideas]
+    new_texts = [idea["text"] for idea in new_ideas]
+    old_set = set(old_texts)
+    return {
+        "old_ideas": len(old_texts),
+        "new_ideas": len(new_texts),
+        "unchanged": [t for t in new_texts if t in old_set],
+        "changed": [t for t in new_texts if t not in old_set],
+        "removed": [t for t in old_texts if t not in set(new_texts)],
+    }
+
+
+class IncrementalRegrader:
+    def __init__(self, grader):
+        self.grader = grader
+        self.ai = grader.ai
+
+    def plan(self, old_model_text: str, new_model_text: str, grading_mode: str = "general") -> Dict[str, Any]:
+        """Diff ideas, release the old model answer and warm up the new one."""
+        prepared = self.grader.prepare_model_answer(new_model_text, grading_mode)
+        mode = prepared["grading_mode"]
+        old_ideas = self.grader._get_model_artifacts(old_model_text, mode)["ideas"] if old_model_text else []
+        new_ideas = self.grader._get_model_artifacts(new_model_text, mode)["ideas"]
+        diff = diff_ideas(old_ideas, new_ideas)
+        if old_model_text and old_model_text != new_model_text:
+            self.grader.release_model_answer(old_model_text, grading_mode)
+        return {"grading_mode": mode, **diff, "ideas_to_recompute": len(diff["changed"])}
+
+    def regrade(self, answers: Sequence[Dict[str, Any]], old_model_text: str, new_model_text: str,
+                max_points: float, grading_mode: str = "general") -> Iterator[Dict[str, Any]]:
+        """
+        answers: [{"answer_id", "student_answer", "previous_score"}].
+        Yields {"event": "plan"}, then one {"event": "result"} per answer, then {"event": "summary"}.
+        """
+        start = time.perf_counter()
+        plan = self.plan(old_model_text, new_model_text, grading_mode)
+        nli_before = self.ai.get_stats()["cross_encoder"]["cache"]
+        yield {"event": "plan", **plan}
+
+        graded: Dict[str, Dict[str, Any]] = {}
+        changed = 0
+        for answer in answers:
+            text = answer.get("student_answer") or ""
+            key = answer_key(text, plan["grading_mode"])
+            result = graded.get(key)
+            if result is None:
+                result = self.grader.grade(text, new_model_text, max_points, grading_mode)
+                graded[key] = result
+            previous: Optional[float] = answer.get("previous_score")
+            score_changed = previous is None or abs(float(previous) - result["score"]) > 1e-6
+            changed += score_changed
+            yield {"event": "result", "answer_id": answer.get("answer_id"), **result,
+                   "previous_score": previous, "score_changed": score_changed}
+
+        nli_after = self.ai.get_stats()["cross_encoder"]["cache"]
+        summary = {
+            "event": "summary",
+            "answers": len(answers),
+            "graded": len(graded),
+            "score_changed": changed,
+            "nli_pairs_computed": nli_after["misses"] - nli_before["misses"],
+            "nli_pairs_reused": nli_after["hits"] - nli_before["hits"],
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        logger.info(f"[Regrade] {summary}")
+        yield summary
@@ -0,0 +1,105 @@
+"""
+short_answer.py
+Lexical fast path for one-line model answers (names, dates, terms, short definitions).
+
+For short answers the transformer models add latency but little signal, so the
+grader asks this engine first:
+1. Exact / normalized match (fillers, abbreviations, punctuation removed)
+2. Number / year check (wrong year -> wrong answer)
+3. Antonym guardrail (same pairs as the main pipeline)
+4. Diacritic-insensitive exact and fuzzy match (typing without accents, typos)
+5. Containment of the whole model answer inside a slightly longer student answer
+
+Returns a grading result when the lexical evidence is conclusive, or None so the
+grader escalates to the neural (chunking + NLI) path.
+"""
+
+import logging
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, Optional, Set
+
+from .config import GradingConfig
+from .tokenizer import normalize_text, remove_vietnamese_diacritics, expand_abbreviations, extract_numbers
+
+logger = logging.getLogger(__name__)
+
+# Từ phủ định / nước đôi: nếu SV thêm vào mà đáp án không có -> không kết luận bằng từ vựng
+NEGATION_TOKENS: Set[str] = {"không", "chẳng", "chưa", "chả", "đâu", "sai", "not", "no"}
+HEDGE_TOKENS: Set[str] = {"hoặc", "hay", "or"}
+
+
+class ShortAnswerEngine:
+    """Antonym check and result shape come from the grader, so both paths grade alike."""
+
+    def __init__(self, config: GradingConfig,
+                 contradicts: Callable[[str, str], bool],
+                 build_result: Callable[[float, str, str], Dict[str, Any]],
+                 preprocess: Optional[Callable[[str], str]] = None):
+        self.config = config
+        self.contradicts = contradicts
+        self._result = build_result
+        self.preprocess = preprocess
+
+    def _clean(self, text: str) -> str:
+        if self.preprocess:
+            text = self.preprocess(text)
+        return normalize_text(expand_abbreviations(text))
+
+    def is_applicable(self, model_text: str) -> bool:
+        """Model answer is short enough for the lexical engine."""
+        n_tokens = len(normalize_text(model_text).split())
+        return 0 < n_tokens <= self.config.short_answer_max_tokens
+
+    def grade(self, student_text: str, model_text: str, max_points: float, grading_mode: str = "general") -> Optional[Dict[str, Any]]:
+        if not self.is_applicable(model_text):
+            return None
+
+        m_clean = self._clean(model_text)
+        s_clean = self._clean(student_text)
+        m_tokens, s_tokens = m_clean.split(), s_clean.split()
+        if not m_tokens or not s_tokens:
+            return None
+        if len(s_tokens) > len(m_tokens) + self.config.short_answer_max_extra_tokens:
+            return None  # SV viết dài -> để pipeline đầy đủ xử lý
+
+        # 1. Exact / normalized match
+        if s_clean == m_clean:
+            return self._result(max_points, "Khớp chính xác đáp án ngắn.", "Exact")
+
+        # 2. Number / year check
+        m_nums = extract_numbers(model_text)
+        if m_nums:
+            s_nums = extract_numbers(student_text)
+            if not s_nums:
+                return None
+            if not m_nums.intersection(s_nums):
+                return self._result(0.0, "Sai số liệu/Năm.", "Wrong")
+            if s_nums - m_nums:
+                return None  # Trả lời nước đôi nhiều số liệu
+
+        # 3. Antonym guardrail
+        if self.contradicts(student_text, model_text):
+            explanation = "Sai bản chất thuật ngữ." if grading_mode == "technical" else "Sai lệch bản chất cốt lõi."
+            return self._result(max_points * 0.05, explanation, "Contradiction")
+
+        s_set, m_set = set(s_tokens), set(m_tokens)
+        if (s_set - m_set) & (NEGATION_TOKENS | HEDGE_TOKENS):
+            return None
+
+        # 4. Diacritic-insensitive exact / fuzzy match
+        s_plain, m_plain = remove_vietnamese_diacritics(s_clean), remove_vietnamese_diacritics(m_clean)
+        if s_plain == m_plain:
+            return self._result(max_points, "Khớp đáp án (bỏ qua dấu).", "Typo")
+
+        # 5. Whole model answer contained in a short student answer ("Thủ đô là Hà Nội")
+        if f" {m_plain} " in f" {s_plain} ":
+            return self._result(max_points, "Chứa đáp án chính xác.", "Exact")
+
+        ratio = SequenceMatcher(None, s_plain, m_plain).ratio()
+        if ratio >= self.config.exact_match_threshold:
+            return self._result(max_points, "Khớp hoàn toàn.", "Typo")
+        if ratio >= self.config.short_answer_fuzzy_threshold:
+            return self._result(max_points * 0.75, "Đúng ý nhưng sai lỗi chính tả.", "Typo")
+
+        # Không đủ bằng chứng từ vựng (có thể là từ đồng nghĩa) -> escalate
+        return None
@@ -210,6 +210,16 @@ def check_passive_voice(text: str) -> bool:
     if not text: return False
     return any(marker in text.lower() for marker in PASSIVE_MARKERS)
 
+NUMBER_PATTERN = re.compile(r'-?\d+(?:[\.,]\d+)?')
+
+def extract_numbers(text: str) -> Set[float]:
+    """Số liệu/năm trong câu ("3,5" = 3.5), dùng chung cho grader và short-answer engine"""
+    nums = set()
+    for x in NUMBER_PATTERN.findall(text or ""):
+        try: nums.add(float(x.replace(',', '.')))
+        except ValueError: pass
+    return nums
+
 def normalize_text(text: str) -> str:
     if not text: return ""
     text = re.sub(r'[^\w\s\u00C0-\u1EF9]', '', text)
@@ -0,0 +1,321 @@
+# On-demand profiling for live requests (admin-only, off by default)
+# - Per request: header X-Profile-Token: <AI_PROFILE_TOKEN> (optional X-Profile-Mode: sample|cprofile)
+#   or a sampled fraction of requests (AI_PROFILE_SAMPLE_RATE, sampling profiler only)
+# - "sample": wall-clock stack sampler restricted to the threads running the grader for that
+#   request -> collapsed stacks (flamegraph.pl / speedscope / inferno compatible)
+# - "cprofile": cProfile inside the grader sections -> pstats text (+ .prof file if AI_PROFILE_DIR)
+# - Results: response header X-Profile-Id, ring buffer at /debug/profile/{id}, optional AI_PROFILE_DIR
+# - /debug/profile?seconds=N samples every thread of the process
+# Safe to keep in production builds: without AI_PROFILE_TOKEN and AI_PROFILE_SAMPLE_RATE nothing
+# is ever profiled and profile_section() costs one contextvar lookup.
+import contextvars
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from app.tracing import current_trace_id
+
+PROFILE_TOKEN = os.getenv("AI_PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = min(max(float(os.getenv("AI_PROFILE_SAMPLE_RATE", "0") or 0), 0.0), 0.05)
+PROFILE_DIR = os.getenv("AI_PROFILE_DIR", "")
+PROFILE_BUFFER_SIZE = int(os.getenv("AI_PROFILE_BUFFER_SIZE", "50"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("AI_PROFILE_MAX_CONCURRENT", "2"))
+PROFILE_INTERVAL_MS = float(os.getenv("AI_PROFILE_INTERVAL_MS", "5"))
+PROCESS_PROFILE_MAX_SECONDS = 60.0
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+PROFILE_MODES = ("sample", "cprofile")
+
+# Never profiled: the debug endpoints themselves and the scrape endpoint
+_SKIP_PREFIXES = ("/debug/", "/metrics")
+
+# Leaf frames of threads that are just waiting (threadpool workers, event loop)
+_IDLE_LEAVES = {
+    ("wait", "threading.py"), ("get", "queue.py"), ("select", "selectors.py"),
+    ("_worker", "thread.py"), ("run", "_asyncio.py"),
+}
+
+
+def profile_requested(token: Optional[str]) -> bool:
+    """X-Profile-Token matches AI_PROFILE_TOKEN (constant time): profile this request.
+    Access to the /debug endpoints is app.admin.require_admin, not this."""
+    return bool(PROFILE_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+# ===== STACK SAMPLER =====
+
+_path_cache: Dict[str, str] = {}
+
+
+def _short_path(filename: str) -> str:
+    short = _path_cache.get(filename)
+    if short is None:
+        short = filename.replace("\\", "/")
+        for marker in ("/site-packages/", "/ai_services/", "/lib/python"):
+            idx = short.rfind(marker)
+            if idx >= 0:
+                short = short[idx + len(marker):]
+                break
+        _path_cache[filename] = short
+    return short
+
+
+def _collapse(frame, skip_idle: bool = True) -> Optional[str]:
+    """Root-first 'func (file:line);...' stack; None for an idle leaf."""
+    code = frame.f_code
+    if skip_idle and (code.co_name, os.path.basename(code.co_filename)) in _IDLE_LEAVES:
+        return None
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class StackSampler(threading.Thread):
+    """Samples sys._current_frames() every interval for the threads accepted by thread_filter."""
+
+    def __init__(self, interval: float, thread_filter: Callable[[int], bool], skip_idle: bool = True):
+        super().__init__(daemon=True, name="ai-profiler")
+        self.interval = interval
+        self.thread_filter = thread_filter
+        self.skip_idle = skip_idle
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me or not self.thread_filter(tid):
+                    continue
+                stack = _collapse(frame, self.skip_idle)
+                if stack:
+                    self.counts[stack] += 1
+            self.samples += 1
+
+    def stop(self) -> "StackSampler":
+        self._stop_event.set()
+        self.join()
+        return self
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.counts.most_common()) + "\n"
+
+
+# ===== PER-REQUEST SESSIONS =====
+
+class ProfileSession:
+    def __init__(self, mode: str, path: str, trigger: str):
+        self.profile_id = current_trace_id() or uuid.uuid4().hex
+        self.mode = mode
+        self.path = path
+        self.trigger = trigger
+        self._lock = threading.Lock()
+        self._depth: Dict[int, int] = {}  # thread id -> nesting of profile_section()
+        self._profiles: List[cProfile.Profile] = []
+        self._start = time.perf_counter()
+        self._sampler = None
+        if mode == "sample":
+            self._sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0, self._depth.__contains__)
+            self._sampler.start()
+
+    def enter(self) -> Optional[cProfile.Profile]:
+        tid = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get(tid, 0)
+            self._depth[tid] = depth + 1
+        if self.mode == "cprofile" and depth == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler already owns this interpreter/thread
+                return None
+            return profile
+        return None
+
+    def exit(self, profile: Optional[cProfile.Profile]):
+        if profile is not None:
+            profile.disable()
+        tid = threading.get_ident()
+        with self._lock:
+            if profile is not None:
+                self._profiles.append(profile)
+            depth = self._depth.get(tid, 1) - 1
+            if depth <= 0:
+                self._depth.pop(tid, None)
+            else:
+                self._depth[tid] = depth
+
+    def finish(self, status: int) -> Dict[str, Any]:
+        result = {
+            "profile_id": self.profile_id,
+            "mode": self.mode,
+            "trigger": self.trigger,
+            "path": self.path,
+            "status_code": status,
+            "created_at": time.time(),
+            "duration_ms": round((time.perf_counter() - self._start) * 1000, 3),
+        }
+        if self._sampler is not None:
+            sampler = self._sampler.stop()
+            result.update(samples=sampler.samples, stacks=len(sampler.counts), collapsed=sampler.collapsed())
+        else:
+            with self._lock:
+                profiles = list(self._profiles)
+            result["sections"] = len(profiles)
+            result["stats"] = ""
+            if profiles:
+                stats = pstats.Stats(profiles[0], stream=io.StringIO())
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                out = io.StringIO()
+                stats.stream = out
+                stats.sort_stats("cumulative").print_stats(60)
+                result["stats"] = out.getvalue()
+                if PROFILE_DIR:
+                    try:
+                        stats.dump_stats(os.path.join(PROFILE_DIR, f"{self.profile_id}.prof"))
+                    except OSError:
+                        pass
+        return result
+
+
+_active_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar("ai_profile_session", default=None)
+
+_sessions_lock = threading.Lock()
+_running_sessions = 0
+_recent_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_process_lock = threading.Lock()
+
+
+class profile_section:
+    """
+    with profile_section(): ...
+    Marks code that belongs to the profiled request (UniversityGrader.grade runs in a worker
+    thread, not on the event loop). No-op unless the current request is being profiled.
+    """
+    __slots__ = ("_session", "_profile")
+
+    def __enter__(self):
+        self._session = _active_session.get()
+        if self._session is not None:
+            self._profile = self._session.enter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._session is not None:
+            self._session.exit(self._profile)
+        return False
+
+
+def _store(result: Dict[str, Any]):
+    with _sessions_lock:
+        _recent_profiles.pop(result["profile_id"], None)
+        _recent_profiles[result["profile_id"]] = result
+        while len(_recent_profiles) > PROFILE_BUFFER_SIZE:
+            _recent_profiles.popitem(last=False)
+    if PROFILE_DIR and "collapsed" in result:
+        try:
+            with open(os.path.join(PROFILE_DIR, f"{result['profile_id']}.collapsed"), "w", encoding="utf-8") as f:
+                f.write(result["collapsed"])
+        except OSError:
+            pass
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _sessions_lock:
+        return _recent_profiles.get(profile_id)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    with _sessions_lock:
+        profiles = list(_recent_profiles.values())
+    return [{k: v for k, v in p.items() if k not in ("collapsed", "stats")} for p in reversed(profiles)]
+
+
+def profile_process(seconds: float, interval_ms: float = 10.0, include_idle: bool = False) -> Optional[Dict[str, Any]]:
+    """Sample every thread of the process for `seconds`. None if another process profile is running."""
+    if not _process_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(seconds, 0.1), PROCESS_PROFILE_MAX_SECONDS)
+        caller = threading.get_ident()
+        sampler = StackSampler(max(interval_ms, 1.0) / 1000.0, lambda tid: tid != caller, skip_idle=not include_idle)
+        sampler.start()
+        time.sleep(seconds)
+        sampler.stop()
+        return {"seconds": seconds, "samples": sampler.samples, "stacks": len(sampler.counts), "collapsed": sampler.collapsed()}
+    finally:
+        _process_lock.release()
+
+
+# ===== MIDDLEWARE =====
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: starts a ProfileSession for opted-in requests, adds X-Profile-Id."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _requested_mode(self, scope) -> Optional[tuple]:
+        path = scope.get("path", "")
+        if path.startswith(_SKIP_PREFIXES):
+            return None
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        if profile_requested(headers.get("x-profile-token")):
+            mode = headers.get("x-profile-mode", "sample").strip().lower()
+            return (mode if mode in PROFILE_MODES else "sample"), "header"
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sample", "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        global _running_sessions
+        if scope["type"] != "http" or not PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        requested = self._requested_mode(scope)
+        if requested is None:
+            await self.app(scope, receive, send)
+            return
+        with _sessions_lock:
+            if _running_sessions >= PROFILE_MAX_CONCURRENT:
+                requested = None
+            else:
+                _running_sessions += 1
+        if requested is None:
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(requested[0], scope.get("path", ""), requested[1])
+        token = _active_session.set(session)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.profile_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active_session.reset(token)
+            try:
+                _store(session.finish(status["code"]))
+            finally:
+                with _sessions_lock:
+                    _running_sessions -= 1
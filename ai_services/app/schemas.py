@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 class GradeRequest(BaseModel):
     student_answer: str
     model_answer: str
     max_points: float
     grading_mode: Optional[str] = "general"
+    callback_url: Optional[str] = None  # Nhận kết quả chấm lại nếu bài bị chấm tạm (quá tải)
 
 class GradeResponse(BaseModel):
     score: float
@@ -13,3 +14,43 @@ class GradeResponse(BaseModel):
     explanation: str
     fact_multiplier: float
     error: Optional[str] = None
+    degraded: bool = False  # Điểm tạm (lexical, quá tải) -> kết quả đầy đủ qua regrade_id
+    regrade_id: Optional[str] = None
+
+class BatchAnswer(BaseModel):
+    answer_id: Optional[str] = None
+    student_answer: str
+
+class BatchGradeRequest(BaseModel):
+    model_answer: str
+    max_points: float
+    grading_mode: Optional[str] = "general"
+    answers: List[BatchAnswer]
+
+class BatchGradeItem(GradeResponse):
+    answer_id: Optional[str] = None
+    cluster_id: int
+    propagation: str  # graded | exact | similar | lexical
+
+class BatchGradeResponse(BaseModel):
+    results: List[BatchGradeItem]
+    cluster_stats: Dict[str, Any]
+
+class PrepareQuestion(BaseModel):
+    question_id: Optional[str] = None
+    model_answer: str
+    grading_mode: Optional[str] = "general"
+
+class PrepareQuestionsRequest(BaseModel):
+    questions: List[PrepareQuestion]
+    release: List[PrepareQuestion] = []  # Đáp án cũ (đề đã sửa) -> bỏ ghim
+
+class RegradeAnswer(BatchAnswer):
+    previous_score: Optional[float] = None
+
+class RegradeQuestionRequest(BaseModel):
+    old_model_answer: str = ""
+    new_model_answer: str
+    max_points: float
+    grading_mode: Optional[str] = "general"
+    answers: List[RegradeAnswer]
@@ -1,22 +1,22 @@
 #Security middleware for AI service
 #Handles IP filtering, request logging, and threat detection
 import logging
-from fastapi import Request, Response
+import os
+import random
+import re
+import time
+from fastapi import Response
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import datetime
 import json
+from typing import Dict, Optional
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('security.log'),
-        logging.StreamHandler()
-    ]
-)
+from app.ip_reputation import ALLOW, BLOCK, BLOCK_TTL, REPUTATION
+from app.log_pipeline import setup_logging
+from app.tracing import span
+
+# Configure logging: queue + background writer, rotating security.log (app/log_pipeline.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 WHITELIST = {
@@ -25,7 +25,7 @@ WHITELIST = {
     "localhost",
     "103.252.136.61"
 }
-BLACKLIST = set()
+# Blocks (IPs, CIDRs, with optional expiry) and extra allowed CIDRs: app/ip_reputation.py
 
 BLOCKED_METHODS = {"CONNECT", "TRACE", "TRACK"}
 
@@ -34,129 +34,216 @@ SUSPICIOUS_PATTERNS = [
     "/phpmyadmin", "/.env", "/.git", "/config",
     "/backup", "/database", "/sql"
 ]
+# One regex pass over the lowercased path instead of a substring scan per pattern
+SUSPICIOUS_PATH_RE = re.compile("|".join(
+    re.escape(p) for p in sorted({p.lower() for p in SUSPICIOUS_PATTERNS}, key=len, reverse=True)))
+
+# Fraction of [ALLOWED] lines logged (1 = all, 0 = none); blocks are always logged
+ALLOWED_LOG_SAMPLE = float(os.getenv("AI_SECURITY_ALLOWED_SAMPLE", "1.0"))
 
-request_counts = defaultdict(list)
 RATE_LIMIT = 3000  # Max requests per minute
 RATE_WINDOW = 60  # seconds
+RATE_BUCKETS = 12  # 5s buckets: the window slides in 5s steps
+RATE_MAX_KEYS = 100_000  # IPs tracked at once (spoofed X-Forwarded-For floods)
+
+
+class _Window:
+    __slots__ = ("slot", "counts", "total")
+
+    def __init__(self, buckets: int, slot: int):
+        self.slot = slot  # newest bucket seen
+        self.counts = [0] * buckets
+        self.total = 0
+
+
+class SlidingWindowLimiter:
+    """
+    Requests per key over the last `window` seconds, counted in `buckets` fixed slots:
+    fixed memory per key and O(buckets) worst case per hit instead of a list of timestamps.
+    Keys idle for a whole window are evicted every `window` seconds.
+    Event loop only (no locks), like AdmissionController.
+    """
+
+    def __init__(self, limit: int = RATE_LIMIT, window: float = RATE_WINDOW, buckets: int = RATE_BUCKETS,
+                 max_keys: int = RATE_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.buckets = max(1, buckets)
+        self.bucket_width = window / self.buckets
+        self.max_keys = max_keys
+        self._windows: Dict[str, _Window] = {}
+        self._next_evict = 0.0
+        self.evicted = 0
+
+    def hit(self, key: str, now: Optional[float] = None) -> bool:
+        """Count one request for key; True when it is over the limit."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_evict:
+            self.evict(now)
+        slot = int(now // self.bucket_width)
+        window = self._windows.get(key)
+        if window is None:
+            if len(self._windows) >= self.max_keys:
+                self._windows.pop(next(iter(self._windows)))  # oldest key
+                self.evicted += 1
+            window = self._windows[key] = _Window(self.buckets, slot)
+        elif slot > window.slot:
+            counts = window.counts
+            if slot - window.slot >= self.buckets:
+                counts[:] = [0] * self.buckets
+                window.total = 0
+            else:
+                for s in range(window.slot + 1, slot + 1):
+                    i = s % self.buckets
+                    window.total -= counts[i]
+                    counts[i] = 0
+            window.slot = slot
+        window.counts[window.slot % self.buckets] += 1
+        window.total += 1
+        return window.total > self.limit
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Drop keys with no request in the last window."""
+        now = time.monotonic() if now is None else now
+        stale_slot = int(now // self.bucket_width) - self.buckets
+        stale = [k for k, w in self._windows.items() if w.slot <= stale_slot]
+        for k in stale:
+            del self._windows[k]
+        self.evicted += len(stale)
+        self._next_evict = now + self.window
+        return len(stale)
+
+    def count(self, key: str) -> int:
+        window = self._windows.get(key)
+        return window.total if window else 0
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+
+RATE_LIMITER = SlidingWindowLimiter()
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+
+class SecurityMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware task/body plumbing per request)."""
+
+    def __init__(self, app, limiter: SlidingWindowLimiter = RATE_LIMITER):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with span("middleware.security") as security_span:
+            rejection = self._check(scope, security_span)
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+
+        # Process request
+        await self.app(scope, receive, send)
+
+    def _check(self, scope, security_span) -> Optional[Response]:
+        """Returns a rejection response, or None to let the request through."""
+        method = scope.get("method", "")
+        path = scope.get("path", "")
         # Get client IP
-        client_ip = self._get_client_ip(request)
+        client_ip = self._get_client_ip(scope)
         
         # 1. Check whitelist (allow immediately)
         if client_ip in WHITELIST:
-            return await call_next(request)
+            security_span.set(decision="whitelisted")
+            return None
         
-        # 2. Check blacklist (block immediately)
-        if client_ip in BLACKLIST:
-            logger.warning(f"[BLOCKED] Blacklisted IP: {client_ip} - {request.method} {request.url.path}")
+        # 2. Check reputation table: allowed CIDRs pass, blocked IPs/CIDRs are rejected
+        verdict = REPUTATION.check(client_ip)
+        if verdict == ALLOW:
+            security_span.set(decision="whitelisted")
+            return None
+        if verdict == BLOCK:
+            security_span.set(decision="blacklisted")
+            logger.warning(f"[BLOCKED] Blacklisted IP: {client_ip} - {method} {path}")
             return JSONResponse(
                 status_code=403,
                 content={"detail": "Access forbidden"}
             )
         
         # 3. Block dangerous methods
-        if request.method in BLOCKED_METHODS:
-            self._log_suspicious(client_ip, request, "Dangerous HTTP method")
-            self._add_to_blacklist(client_ip, f"Used {request.method} method")
+        if method in BLOCKED_METHODS:
+            security_span.set(decision="blocked_method")
+            self._log_suspicious(client_ip, scope, "Dangerous HTTP method")
+            self._add_to_blacklist(client_ip, f"Used {method} method")
             return JSONResponse(
                 status_code=405,
                 content={"detail": "Method not allowed"}
             )
         
         # 4. Check suspicious URL patterns
-        path = request.url.path.lower()
-        if any(pattern in path for pattern in SUSPICIOUS_PATTERNS):
-            self._log_suspicious(client_ip, request, "Suspicious URL pattern")
-            self._add_to_blacklist(client_ip, f"Accessed suspicious path: {path}")
+        path_lower = path.lower()
+        if SUSPICIOUS_PATH_RE.search(path_lower):
+            security_span.set(decision="suspicious_path")
+            self._log_suspicious(client_ip, scope, "Suspicious URL pattern")
+            self._add_to_blacklist(client_ip, f"Accessed suspicious path: {path_lower}")
             return JSONResponse(
                 status_code=404,
                 content={"detail": "Not found"}
             )
         
         # 5. Rate limiting (NOT blacklisting - allow retry)
-        if self._is_rate_limited(client_ip):
-            logger.warning(f"[RATE_LIMITED] {client_ip} - {request.method} {request.url.path}")
+        if self.limiter.hit(client_ip):
+            security_span.set(decision="rate_limited")
+            logger.warning(f"[RATE_LIMITED] {client_ip} - {method} {path}")
             return JSONResponse(
                 status_code=429,
                 content={"detail": "Too many requests. Please retry after a moment."}
             )
         
         # 6. Log valid request
-        logger.info(f"[ALLOWED] {client_ip} - {request.method} {request.url.path}")
-        
-        # Process request
-        response = await call_next(request)
-        return response
+        security_span.set(decision="allowed")
+        if ALLOWED_LOG_SAMPLE >= 1 or (ALLOWED_LOG_SAMPLE > 0 and random.random() < ALLOWED_LOG_SAMPLE):
+            logger.info(f"[ALLOWED] {client_ip} - {method} {path}")
+        return None
     
-    def _get_client_ip(self, request: Request) -> str:
+    def _get_client_ip(self, scope) -> str:
         """Extract real client IP from request headers"""
         # Check common proxy headers
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        
-        real_ip = request.headers.get("X-Real-IP")
+        real_ip = None
+        for key, value in scope.get("headers", []):
+            if key == b"x-forwarded-for" and value:
+                return value.decode("latin-1").split(",")[0].strip()
+            if key == b"x-real-ip" and real_ip is None:
+                real_ip = value.decode("latin-1")
         if real_ip:
             return real_ip
         
         # Fallback to direct client
-        if request.client:
-            return request.client.host
+        client = scope.get("client")
+        if client:
+            return client[0]
         
         return "unknown"
     
-    def _log_suspicious(self, ip: str, request: Request, reason: str):
+    def _log_suspicious(self, ip: str, scope, reason: str):
         """Log detailed information about suspicious request"""
         log_data = {
             "timestamp": datetime.now().isoformat(),
             "ip": ip,
-            "method": request.method,
-            "path": request.url.path,
-            "query": str(request.url.query),
-            "headers": dict(request.headers),
+            "method": scope.get("method", ""),
+            "path": scope.get("path", ""),
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "headers": {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])},
             "reason": reason,
         }
-        logger.warning(f"[SUSPICIOUS] {json.dumps(log_data, indent=2)}")
+        logger.warning(f"[SUSPICIOUS] {json.dumps(log_data, ensure_ascii=False)}")
     
     def _add_to_blacklist(self, ip: str, reason: str):
         """Add IP to blacklist and log the action"""
-        if ip not in BLACKLIST and ip not in WHITELIST:
-            BLACKLIST.add(ip)
+        # Persisted by the reputation table's batched writer, not in the request path
+        if ip not in WHITELIST and REPUTATION.block(ip, reason, BLOCK_TTL):
             logger.error(f"[BLACKLIST] IP added: {ip} - Reason: {reason}")
-            # Write to file for persistence
-            with open("blacklist.txt", "a") as f:
-                f.write(f"{datetime.now().isoformat()} - {ip} - {reason}\n")
-    
-    def _is_rate_limited(self, ip: str) -> bool:
-        """Check if IP has exceeded rate limit"""
-        now = datetime.now()
-        cutoff = now - timedelta(seconds=RATE_WINDOW)
-        
-        # Clean old requests
-        request_counts[ip] = [
-            req_time for req_time in request_counts[ip]
-            if req_time > cutoff
-        ]
-        
-        # Add current request
-        request_counts[ip].append(now)
-        
-        # Check limit
-        return len(request_counts[ip]) > RATE_LIMIT
 
 
 def load_blacklist():
-    """Load blacklist from file on startup"""
-    try:
-        with open("blacklist.txt", "r") as f:
-            for line in f:
-                if " - " in line:
-                    parts = line.strip().split(" - ")
-                    if len(parts) >= 2:
-                        ip = parts[1]
-                        BLACKLIST.add(ip)
-        logger.info(f"[Security] Loaded {len(BLACKLIST)} IPs from blacklist")
-    except FileNotFoundError:
-        logger.info("[Security] No existing blacklist file found, starting fresh")
+    """Load the IP reputation table on startup (imports the legacy blacklist.txt once)"""
+    REPUTATION.load()
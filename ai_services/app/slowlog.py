@@ -0,0 +1,293 @@
+# Slow-grading capture + offline replay
+# - Every UniversityGrader.grade() call is timed; calls at or above the rolling p-threshold
+#   (AI_SLOW_PERCENTILE of the last AI_SLOW_WINDOW gradings, never below AI_SLOW_MIN_MS)
+#   are captured with the full GradeRequest, stage timings (StageClock) and the result
+# - In-memory ring buffer (/debug/slow, X-Admin-Token only: captures hold student answers)
+#   + optional on-disk ring (AI_SLOW_FILE, two rotated JSON-lines files of AI_SLOW_FILE_MAX entries each)
+# - Replay: python -m app.slowlog replay slow.jsonl [--repeat 3] [--out r.json] [--compare old.json]
+#   re-runs the captures through the calculate_score() pipeline in-process and compares timings and scores
+# Disable with AI_SLOW_CAPTURE_ENABLED=0.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.tracing import current_trace_id
+
+SLOW_CAPTURE_ENABLED = os.getenv("AI_SLOW_CAPTURE_ENABLED", "1").lower() not in ("0", "false", "no")
+SLOW_PERCENTILE = float(os.getenv("AI_SLOW_PERCENTILE", "99"))
+SLOW_MIN_MS = float(os.getenv("AI_SLOW_MIN_MS", "250"))
+SLOW_WINDOW = int(os.getenv("AI_SLOW_WINDOW", "2000"))
+SLOW_BUFFER_SIZE = int(os.getenv("AI_SLOW_BUFFER_SIZE", "100"))
+SLOW_FILE = os.getenv("AI_SLOW_FILE", "")
+SLOW_FILE_MAX = int(os.getenv("AI_SLOW_FILE_MAX", "1000"))
+
+# Percentile threshold is re-computed every N observations, and only once the window has
+# enough samples (before that only AI_SLOW_MIN_MS applies)
+_RECOMPUTE_EVERY = 50
+_MIN_SAMPLES = 100
+
+_code_version: Optional[str] = None
+
+
+def code_version() -> str:
+    """AI_CODE_VERSION, else the git commit of the checkout, else 'unknown'."""
+    global _code_version
+    if _code_version is None:
+        version = os.getenv("AI_CODE_VERSION", "")
+        if not version:
+            try:
+                version = subprocess.run(
+                    ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                    capture_output=True, text=True, timeout=2).stdout.strip()
+            except (OSError, subprocess.SubprocessError):
+                version = ""
+        _code_version = version or "unknown"
+    return _code_version
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted sequence."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+class SlowCapture:
+    def __init__(self, pct: float = SLOW_PERCENTILE, min_ms: float = SLOW_MIN_MS, window: int = SLOW_WINDOW,
+                 buffer_size: int = SLOW_BUFFER_SIZE, path: str = SLOW_FILE, file_max: int = SLOW_FILE_MAX):
+        self.pct = pct
+        self.min_ms = min_ms
+        self.path = path
+        self.file_max = file_max
+        self._lock = threading.Lock()
+        self._window: deque = deque(maxlen=window)
+        self._threshold_ms = min_ms
+        self._since_recompute = 0
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._file_entries: Optional[int] = None
+        self.observed = 0
+        self.captured = 0
+
+    def check(self, duration_ms: float) -> Optional[float]:
+        """Record one grading latency; returns the threshold if it should be captured, else None."""
+        with self._lock:
+            self.observed += 1
+            self._window.append(duration_ms)
+            self._since_recompute += 1
+            if self._since_recompute >= _RECOMPUTE_EVERY and len(self._window) >= _MIN_SAMPLES:
+                self._since_recompute = 0
+                self._threshold_ms = max(self.min_ms, percentile(self._window, self.pct))
+            threshold = self._threshold_ms
+        return threshold if duration_ms >= threshold else None
+
+    def capture(self, duration_ms: float, threshold_ms: float, request: Dict[str, Any],
+                stages: Iterable[Tuple[str, float]], result: Dict[str, Any]):
+        entry = {
+            "captured_at": time.time(),
+            "code_version": code_version(),
+            "trace_id": current_trace_id(),
+            "duration_ms": round(duration_ms, 3),
+            "threshold_ms": round(threshold_ms, 3),
+            "request": request,
+            "stages": [{"stage": name, "ms": round(seconds * 1000, 3)} for name, seconds in stages],
+            "result": result,
+        }
+        with self._lock:
+            self.captured += 1
+            self._buffer.append(entry)
+            if self.path:
+                self._append_file(entry)
+
+    def _append_file(self, entry: Dict[str, Any]):
+        """Two-file ring: path holds the newest entries, path + '.1' the previous generation."""
+        try:
+            if self._file_entries is None:
+                self._file_entries = _count_lines(self.path)
+            if self._file_entries >= self.file_max:
+                os.replace(self.path, self.path + ".1")
+                self._file_entries = 0
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file_entries += 1
+        except OSError:
+            pass
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._buffer)
+        return list(reversed(entries))[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"observed": self.observed, "captured": self.captured, "buffered": len(self._buffer),
+                    "percentile": self.pct, "threshold_ms": round(self._threshold_ms, 3),
+                    "file": self.path or None}
+
+
+def _count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+SLOW_CAPTURE = SlowCapture()
+
+
+def observe_grading(duration_ms: float, student_text: str, model_text: str, max_points: float, grading_mode: str,
+                    stages: Iterable[Tuple[str, float]], result: Dict[str, Any]):
+    if not SLOW_CAPTURE_ENABLED:
+        return
+    threshold = SLOW_CAPTURE.check(duration_ms)
+    if threshold is None:
+        return
+    request = {"student_answer": student_text, "model_answer": model_text,
+               "max_points": max_points, "grading_mode": grading_mode}
+    SLOW_CAPTURE.capture(duration_ms, threshold, request, stages, result)
+
+
+# ===== REPLAY =====
+
+def load_captures(paths: Sequence[str]) -> List[Dict[str, Any]]:
+    """JSON-lines capture files (the '.1' generation is read first when present)."""
+    entries: List[Dict[str, Any]] = []
+    for path in paths:
+        for candidate in (path + ".1", path):
+            if not os.path.exists(candidate):
+                continue
+            with open(candidate, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entries.append(json.loads(line))
+    return entries
+
+
+def replay(entries: Sequence[Dict[str, Any]], repeat: int = 1, warmup: bool = True) -> List[Dict[str, Any]]:
+    """
+    Re-run captured requests in-process. replay_ms is the first run (caches as cold as the
+    capture order allows); with repeat > 1, warm_ms is the fastest of the remaining runs.
+    """
+    from app.metrics import NULL_CLOCK, StageClock
+    from app.nlp import get_grader
+
+    grader = get_grader()
+    if warmup and entries:
+        req = entries[0]["request"]
+        # _grade() directly: replays must not be captured again (AI_SLOW_FILE may point at the input)
+        grader._grade(req["student_answer"], req["model_answer"], req["max_points"], req.get("grading_mode") or "general", NULL_CLOCK)
+
+    rows = []
+    for i, entry in enumerate(entries):
+        req = entry["request"]
+        runs = []
+        for _ in range(max(1, repeat)):
+            clock = StageClock()
+            start = time.perf_counter()
+            result = grader._grade(req["student_answer"], req["model_answer"], req["max_points"],
+                                   req.get("grading_mode") or "general", clock)
+            runs.append(((time.perf_counter() - start) * 1000, clock.stages, result))
+        ms, stages, result = runs[0]
+        captured_score = entry["result"].get("score")
+        rows.append({
+            "index": i,
+            "trace_id": entry.get("trace_id"),
+            "captured_version": entry.get("code_version"),
+            "captured_ms": entry.get("duration_ms"),
+            "replay_ms": round(ms, 3),
+            "warm_ms": round(min(run[0] for run in runs[1:]), 3) if len(runs) > 1 else None,
+            "captured_score": captured_score,
+            "replay_score": result["score"],
+            "score_changed": captured_score is None or abs(float(captured_score) - result["score"]) > 1e-6,
+            "stages": [{"stage": name, "ms": round(seconds * 1000, 3)} for name, seconds in stages],
+        })
+    return rows
+
+
+def summarize(rows: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    replay_ms = [r["replay_ms"] for r in rows]
+    captured_ms = [r["captured_ms"] for r in rows if r.get("captured_ms") is not None]
+    stage_totals: Dict[str, float] = {}
+    for r in rows:
+        for s in r["stages"]:
+            stage_totals[s["stage"]] = stage_totals.get(s["stage"], 0.0) + s["ms"]
+    return {
+        "requests": len(rows),
+        "code_version": code_version(),
+        "captured_p50_ms": percentile(captured_ms, 50), "captured_p95_ms": percentile(captured_ms, 95),
+        "replay_p50_ms": percentile(replay_ms, 50), "replay_p95_ms": percentile(replay_ms, 95),
+        "replay_total_ms": round(sum(replay_ms), 3),
+        "score_changed": sum(1 for r in rows if r["score_changed"]),
+        "stage_total_ms": {k: round(v, 3) for k, v in sorted(stage_totals.items(), key=lambda kv: -kv[1])},
+    }
+
+
+def compare(current: Sequence[Dict[str, Any]], previous: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Row-by-row comparison of two replay outputs of the same capture file."""
+    pairs = list(zip(previous, current))
+    speedups = [p["replay_ms"] / c["replay_ms"] for p, c in pairs if c["replay_ms"] > 0]
+    score_diffs = [(p["index"], p["replay_score"], c["replay_score"]) for p, c in pairs
+                   if abs(p["replay_score"] - c["replay_score"]) > 1e-6]
+    return {
+        "pairs": len(pairs),
+        "previous_total_ms": round(sum(p["replay_ms"] for p, _ in pairs), 3),
+        "current_total_ms": round(sum(c["replay_ms"] for _, c in pairs), 3),
+        "median_speedup": round(percentile(speedups, 50), 3) if speedups else None,
+        "score_diffs": len(score_diffs),
+        "score_diff_examples": score_diffs[:20],
+    }
+
+
+def _print_table(rows: Sequence[Dict[str, Any]]):
+    print(f"{'#':>4} {'captured ms':>12} {'replay ms':>10} {'score':>14}  top stage")
+    for r in rows:
+        top = max(r["stages"], key=lambda s: s["ms"]) if r["stages"] else {"stage": "-", "ms": 0}
+        score = f"{r['captured_score']}->{r['replay_score']}" if r["score_changed"] else str(r["replay_score"])
+        print(f"{r['index']:>4} {r['captured_ms'] or 0:>12.1f} {r['replay_ms']:>10.1f} {score:>14}  {top['stage']} ({top['ms']:.1f} ms)")
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m app.slowlog", description="Replay captured slow gradings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rp = sub.add_parser("replay", help="re-run captures through calculate_score in-process")
+    rp.add_argument("files", nargs="+", help="capture files (AI_SLOW_FILE or a saved /debug/slow?format=jsonl)")
+    rp.add_argument("--repeat", type=int, default=1, help="runs per request (first = replay_ms, fastest of the rest = warm_ms)")
+    rp.add_argument("--limit", type=int, default=0, help="only the first N captures")
+    rp.add_argument("--no-warmup", action="store_true")
+    rp.add_argument("--out", help="write {summary, rows} JSON for a later --compare")
+    rp.add_argument("--compare", help="previous --out file (e.g. produced on another commit)")
+    args = parser.parse_args(argv)
+
+    entries = load_captures(args.files)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("No captures found.")
+        return 1
+
+    rows = replay(entries, repeat=args.repeat, warmup=not args.no_warmup)
+    summary = summarize(rows)
+    _print_table(rows)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print(json.dumps({"compare": compare(rows, previous["rows"]),
+                          "previous_version": previous["summary"].get("code_version")}, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# Request tracing for the AI service (OTLP-style JSON spans)
+# - Trace id comes from the caller (traceparent / X-Trace-Id / X-Request-ID / X-Correlation-ID)
+#   so AI-service spans line up with AIService.js job logs; generated if missing
+# - Spans: HTTP request, security middleware, grader stages, model batches, DB calls
+# - Finished traces go to an in-memory ring buffer (/debug/traces) and optionally
+#   a JSON-lines file (AI_TRACE_FILE), one span per line
+# Disable with AI_TRACING_ENABLED=0. Outside a traced request span() is a no-op.
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.metrics import add_stage_listener
+
+TRACING_ENABLED = os.getenv("AI_TRACING_ENABLED", "1").lower() not in ("0", "false", "no")
+TRACE_BUFFER_SIZE = int(os.getenv("AI_TRACE_BUFFER_SIZE", "200"))
+TRACE_FILE = os.getenv("AI_TRACE_FILE", "")
+# Spans kept per trace (a batch grade can produce thousands of stage spans)
+MAX_SPANS_PER_TRACE = int(os.getenv("AI_TRACE_MAX_SPANS", "2000"))
+
+TRACE_ID_HEADERS = ("x-trace-id", "x-request-id", "x-correlation-id")
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# perf_counter() -> unix epoch nanoseconds
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def _now_ns() -> int:
+    return time.perf_counter_ns() + _EPOCH_OFFSET_NS
+
+
+def perf_to_unix_ns(perf_seconds: float) -> int:
+    return int(perf_seconds * 1e9) + _EPOCH_OFFSET_NS
+
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "dropped", "lock")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]):
+        with self.lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+_current_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("ai_current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("ai_current_span", default=None)
+
+_buffer_lock = threading.Lock()
+_recent_traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_file_lock = threading.Lock()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def _record(name: str, start_ns: int, end_ns: int, span_id: str, parent_id: Optional[str],
+            attributes: Dict[str, Any], error: Optional[str] = None):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.add({
+        "traceId": trace.trace_id,
+        "spanId": span_id,
+        "parentSpanId": parent_id or "",
+        "name": name,
+        "startTimeUnixNano": start_ns,
+        "endTimeUnixNano": end_ns,
+        "durationMs": round((end_ns - start_ns) / 1e6, 3),
+        "attributes": attributes,
+        "status": {"code": "ERROR", "message": error} if error else {"code": "OK"},
+    })
+
+
+class span:
+    """
+    with span("model.cross_encoder", batch_size=8): ...
+    Child of the current span; recorded only inside an active trace.
+    """
+    __slots__ = ("name", "attributes", "_start", "_span_id", "_token", "_active")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._active = False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        if _current_trace.get() is None:
+            return self
+        self._active = True
+        self._span_id = _new_span_id()
+        self._token = _current_span.set(self._span_id)
+        self._start = _now_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._active:
+            return False
+        end = _now_ns()
+        _current_span.reset(self._token)
+        _record(self.name, self._start, end, self._span_id, _current_span.get(), self.attributes,
+                f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+
+def record_stage(name: str, start_perf: float, end_perf: float):
+    """StageClock listener: a grader stage becomes a child span of the current span."""
+    if _current_trace.get() is None:
+        return
+    _record(f"grader.{name}", perf_to_unix_ns(start_perf), perf_to_unix_ns(end_perf),
+            _new_span_id(), _current_span.get(), {})
+
+
+def trace_id_from_headers(headers: Dict[str, str]) -> Optional[str]:
+    """traceparent (W3C) first, then the plain id headers sent by the Node backend."""
+    traceparent = headers.get("traceparent", "")
+    match = _TRACEPARENT.match(traceparent.strip().lower())
+    if match:
+        return match.group(1)
+    for header in TRACE_ID_HEADERS:
+        value = headers.get(header)
+        if value:
+            return value.strip()[:128]
+    return None
+
+
+def _finish_trace(trace: _Trace, root: Dict[str, Any]):
+    with trace.lock:
+        spans = list(trace.spans)
+        dropped = trace.dropped
+    summary = {
+        "traceId": trace.trace_id,
+        "name": root["name"],
+        "startTimeUnixNano": root["startTimeUnixNano"],
+        "durationMs": root["durationMs"],
+        "status": root["status"],
+        "attributes": root["attributes"],
+        "spanCount": len(spans),
+        "droppedSpans": dropped,
+        "spans": spans,
+    }
+    with _buffer_lock:
+        # Same trace id (backend retry) -> keep the latest attempt
+        _recent_traces.pop(trace.trace_id, None)
+        _recent_traces[trace.trace_id] = summary
+        while len(_recent_traces) > TRACE_BUFFER_SIZE:
+            _recent_traces.popitem(last=False)
+    if TRACE_FILE:
+        try:
+            with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                for s in spans:
+                    f.write(json.dumps(s, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+
+def get_traces(limit: int = 50, trace_id: Optional[str] = None, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+    with _buffer_lock:
+        if trace_id:
+            return [_recent_traces[trace_id]] if trace_id in _recent_traces else []
+        traces = list(_recent_traces.values())
+    traces = [t for t in reversed(traces) if t["durationMs"] >= min_duration_ms]
+    return traces[:limit]
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware: opens the trace + root HTTP span, echoes X-Trace-Id."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        trace = _Trace(trace_id_from_headers(headers) or uuid.uuid4().hex)
+        root_id = _new_span_id()
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root_id)
+        attributes = {"http.method": scope.get("method", ""), "http.target": scope.get("path", "")}
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode("latin-1"))]
+            await send(message)
+
+        start = _now_ns()
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            end = _now_ns()
+            attributes["http.status_code"] = status["code"]
+            error = error or (f"HTTP {status['code']}" if status["code"] >= 500 else None)
+            root = {
+                "traceId": trace.trace_id,
+                "spanId": root_id,
+                "parentSpanId": "",
+                "name": f"HTTP {scope.get('method', '')} {scope.get('path', '')}",
+                "startTimeUnixNano": start,
+                "endTimeUnixNano": end,
+                "durationMs": round((end - start) / 1e6, 3),
+                "attributes": attributes,
+                "status": {"code": "ERROR", "message": error} if error else {"code": "OK"},
+            }
+            with trace.lock:
+                trace.spans.append(root)  # Root span is never dropped
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            _finish_trace(trace, root)
+
+
+if TRACING_ENABLED:
+    add_stage_listener(record_stage)
@@ -0,0 +1,276 @@
+"""
+eval_configs.py
+Accuracy-vs-latency evaluation of GradingConfig sweeps.
+
+Every grading sample of the bundled datasets (university_training_data.json scores,
+learned_data.json instructor-confirmed scores) is graded under each configuration of a grid.
+Work runs in a process pool; each worker loads the models once (pool initializer) and builds
+one UniversityGrader per configuration on top of the shared AIModel singleton.
+
+    cd ai_services
+    python -m benchmarks.eval_configs --stub-model \\
+        --grid entailment_threshold=0.45,0.5,0.55 --grid cascade_enabled=true,false
+    python -m benchmarks.eval_configs --grid-file sweep.json --workers 4 --budget 0.02 --out eval.json
+    AI_FAST_ENCODER=sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \
+        python -m benchmarks.eval_configs --grid cascade_enabled=true,false    # cascade vs mpnet only
+
+Reported per configuration: MAE and normalized MAE (|score - instructor| / max_points),
+agreement rate (normalized error <= --agree-tolerance), mean/p50/p95 latency per grading and
+the early-exit stage mix. The recommendation is the fastest configuration whose normalized MAE
+is within --budget of the default configuration.
+
+Dataset memory is disabled unless --dataset-memory: otherwise every sample is graded by
+looking itself up in the dataset it came from.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, fields
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from benchmarks.load_test import DATASET_PATHS  # noqa: E402
+
+DEFAULT_NAME = "default"
+
+
+def load_labeled_samples() -> List[Dict[str, Any]]:
+    """(student, model, max_points, instructor score) from both datasets."""
+    samples = []
+    for path in DATASET_PATHS:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for q in data.get("grading_questions", []):
+                for s in q.get("grading_samples", []):
+                    if s.get("score") is None:
+                        continue
+                    samples.append({"student_answer": s["student_answer"], "model_answer": q["model_answer"],
+                                    "max_points": float(q.get("max_points", 1.0)), "score": float(s["score"]),
+                                    "source": q.get("id", "")})
+        else:
+            for s in data:
+                if s.get("student_answer") and s.get("model_answer") and s.get("confirmed_score") is not None:
+                    samples.append({"student_answer": s["student_answer"], "model_answer": s["model_answer"],
+                                    "max_points": float(s.get("max_points", 1.0)), "score": float(s["confirmed_score"]),
+                                    "source": "learned"})
+    return samples
+
+
+# ===== GRID =====
+
+def _parse_value(field_type, raw: str):
+    raw = raw.strip()
+    if field_type in (bool, "bool"):
+        return raw.lower() in ("1", "true", "yes", "on")
+    if field_type in (int, "int"):
+        return int(raw)
+    return float(raw)
+
+
+def build_grid(specs: Sequence[str], grid_file: Optional[str]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Cartesian product of --grid name=v1,v2 axes (+ explicit configs from --grid-file); default first."""
+    from app.nlp.config import GradingConfig
+
+    types = {f.name: f.type for f in fields(GradingConfig)}
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if name not in types:
+            raise SystemExit(f"Unknown GradingConfig field: {name}")
+        axes.append([(name, _parse_value(types[name], v)) for v in values.split(",") if v.strip()])
+
+    configs: List[Tuple[str, Dict[str, Any]]] = [(DEFAULT_NAME, {})]
+    for combo in itertools.product(*axes) if axes else []:
+        overrides = dict(combo)
+        configs.append((",".join(f"{k}={v}" for k, v in overrides.items()), overrides))
+    if grid_file:
+        with open(grid_file, "r", encoding="utf-8") as f:
+            for i, overrides in enumerate(json.load(f)):
+                name = overrides.pop("name", None)
+                unknown = set(overrides) - set(types)
+                if unknown:
+                    raise SystemExit(f"Unknown GradingConfig fields in {grid_file}: {sorted(unknown)}")
+                configs.append((name or ",".join(f"{k}={v}" for k, v in overrides.items()) or f"config{i}", overrides))
+    return configs
+
+
+# ===== WORKER =====
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(stub_model: bool, dataset_memory: bool):
+    """Pool initializer: load the models once per worker process."""
+    import logging
+    import warnings
+    logging.disable(logging.INFO)
+    warnings.filterwarnings("ignore")
+    if stub_model:
+        from benchmarks.stub_model import install_stub_model
+        install_stub_model()
+    from app.nlp.grader import UniversityGrader
+    from app.nlp.model import get_ai_model
+    get_ai_model()
+    _worker["dataset_memory"] = dataset_memory
+    _worker["graders"] = {}
+    # One throwaway grading: dataset indexes, regexes and lazy imports must not count
+    # against whichever configuration happens to run first in this worker
+    UniversityGrader().grade("Pháp luật do nhà nước ban hành.", "Pháp luật là hệ thống quy tắc do nhà nước ban hành.", 1.0)
+
+
+def _grader_for(name: str, overrides: Dict[str, Any]):
+    from app.nlp.config import GradingConfig
+    from app.nlp.grader import UniversityGrader
+
+    grader = _worker["graders"].get(name)
+    if grader is None:
+        config = GradingConfig(**{"dataset_memory_enabled": _worker["dataset_memory"], **overrides})
+        grader = _worker["graders"][name] = UniversityGrader(config)
+    return grader
+
+
+def _clear_model_caches():
+    from app.nlp.model import get_ai_model
+    ai = get_ai_model()
+    for cache in ai._embedding_caches.values():
+        cache.clear()
+    ai._nli_cache.clear()
+
+
+def _run_task(name: str, overrides: Dict[str, Any], samples: List[Dict[str, Any]], cold: bool) -> Dict[str, Any]:
+    from app.metrics import StageClock
+
+    grader = _grader_for(name, overrides)
+    if cold:
+        # Chunks of different configs share the worker's AIModel: start each chunk cold
+        _clear_model_caches()
+        grader._model_artifacts.clear()
+    rows = []
+    for s in samples:
+        clock = StageClock()
+        start = time.perf_counter()
+        result = grader._grade(s["student_answer"], s["model_answer"], s["max_points"], "general", clock)
+        ms = (time.perf_counter() - start) * 1000
+        rows.append({"index": s["index"], "score": result["score"], "ms": ms,
+                     "exit": clock.stages[-1][0] if clock.stages else "none"})
+    return {"name": name, "rows": rows, "pid": os.getpid()}
+
+
+# ===== REPORT =====
+
+def _percentile(values: Sequence[float], pct: float) -> float:
+    from app.slowlog import percentile
+    return percentile(values, pct)
+
+
+def summarize(name: str, overrides: Dict[str, Any], rows: List[Dict[str, Any]], samples: List[Dict[str, Any]],
+              agree_tolerance: float) -> Dict[str, Any]:
+    errors, norm_errors, latencies, exits = [], [], [], {}
+    for r in rows:
+        s = samples[r["index"]]
+        err = abs(r["score"] - s["score"])
+        errors.append(err)
+        norm_errors.append(err / s["max_points"] if s["max_points"] > 0 else err)
+        latencies.append(r["ms"])
+        exits[r["exit"]] = exits.get(r["exit"], 0) + 1
+    n = len(rows) or 1
+    return {
+        "name": name,
+        "overrides": overrides,
+        "samples": len(rows),
+        "mae": round(sum(errors) / n, 4),
+        "nmae": round(sum(norm_errors) / n, 4),
+        "agreement": round(sum(1 for e in norm_errors if e <= agree_tolerance) / n, 4),
+        "mean_ms": round(sum(latencies) / n, 3),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "total_s": round(sum(latencies) / 1000, 3),
+        "exits": dict(sorted(exits.items(), key=lambda kv: -kv[1])),
+    }
+
+
+def recommend(results: List[Dict[str, Any]], budget: float) -> Optional[Dict[str, Any]]:
+    """Fastest configuration with nmae <= default nmae + budget."""
+    baseline = next((r for r in results if r["name"] == DEFAULT_NAME), None)
+    if baseline is None:
+        return None
+    eligible = [r for r in results if r["nmae"] <= baseline["nmae"] + budget]
+    return min(eligible, key=lambda r: r["mean_ms"]) if eligible else None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.eval_configs", description="GradingConfig accuracy/latency sweep.")
+    parser.add_argument("--grid", action="append", default=[], help="field=v1,v2 (repeatable, cartesian product)")
+    parser.add_argument("--grid-file", help='JSON list of override dicts, e.g. [{"name": "fast", "cascade_high": 0.8}]')
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=0, help="only the first N samples")
+    parser.add_argument("--agree-tolerance", type=float, default=0.10, help="normalized error counted as agreement")
+    parser.add_argument("--budget", type=float, default=0.02, help="allowed nMAE increase over the default config")
+    parser.add_argument("--warm", action="store_true", help="keep model caches between chunks")
+    parser.add_argument("--dataset-memory", action="store_true", help="keep dataset memory on (samples look themselves up)")
+    parser.add_argument("--stub-model", action="store_true", help="offline stub encoders (benchmarks/stub_model.py)")
+    parser.add_argument("--out", help="write {configs, results, recommendation} JSON")
+    args = parser.parse_args(argv)
+
+    configs = build_grid(args.grid, args.grid_file)
+    samples = load_labeled_samples()
+    if args.limit:
+        samples = samples[:args.limit]
+    for i, s in enumerate(samples):
+        s["index"] = i
+    chunks = [samples[i:i + args.chunk_size] for i in range(0, len(samples), args.chunk_size)]
+    print(f"{len(configs)} configs x {len(samples)} samples, {len(chunks)} chunks each, {args.workers} workers")
+
+    start = time.perf_counter()
+    collected: Dict[str, List[Dict[str, Any]]] = {name: [] for name, _ in configs}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.stub_model, args.dataset_memory)) as pool:
+        # Chunk-major order: every configuration sees the same mix of early/late (busy) pool time
+        futures = [pool.submit(_run_task, name, overrides, chunk, not args.warm)
+                   for chunk in chunks for name, overrides in configs]
+        for future in as_completed(futures):
+            out = future.result()
+            collected[out["name"]].extend(out["rows"])
+    wall = time.perf_counter() - start
+
+    results = [summarize(name, overrides, collected[name], samples, args.agree_tolerance) for name, overrides in configs]
+    best = recommend(results, args.budget)
+
+    print(f"\n{'config':<48} {'MAE':>7} {'nMAE':>7} {'agree':>7} {'mean ms':>9} {'p95 ms':>9}")
+    for r in sorted(results, key=lambda r: r["mean_ms"]):
+        mark = " *" if best and r["name"] == best["name"] else ""
+        print(f"{r['name'][:48]:<48} {r['mae']:>7.3f} {r['nmae']:>7.3f} {r['agreement'] * 100:>6.1f}% {r['mean_ms']:>9.2f} {r['p95_ms']:>9.2f}{mark}")
+    if best:
+        print(f"\n* fastest within nMAE budget +{args.budget}: {best['name']}")
+    print(f"wall {wall:.1f}s")
+
+    if args.out:
+        from app.nlp.config import GradingConfig
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({
+                "defaults": asdict(GradingConfig()),
+                "models": "stub" if args.stub_model else "real",
+                "dataset_memory": args.dataset_memory,
+                "samples": len(samples),
+                "wall_s": round(wall, 3),
+                "results": results,
+                "recommendation": best["name"] if best else None,
+            }, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+load_test.py
+Load generator for POST /grade: how many requests/s one AI node sustains before
+AIService.js starts hitting its 90 s GRADING_TIMEOUT.
+
+Replays grading_samples from app/university_training_data.json and app/learned_data.json
+at a target arrival rate (open loop, Poisson arrivals) with a concurrency cap and a
+grading-mode mix. Either in-process over ASGI (no network, no uvicorn) or against a running
+server:
+
+    cd ai_services
+    python -m benchmarks.load_test --rate 2,4,8,16 --duration 30 --concurrency 32 --stub-model
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --rate 5 --duration 60 \\
+        --mode-mix general=0.8,technical=0.2 --csv capacity.csv --requests-csv requests.csv
+
+Latency is measured from the scheduled arrival time (not from when a concurrency slot freed
+up), so queueing inside the client is counted like queueing in AIService.js would be.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+DATASET_PATHS = (
+    os.path.join(BASE_DIR, "app", "university_training_data.json"),
+    os.path.join(BASE_DIR, "app", "learned_data.json"),
+)
+AISERVICE_TIMEOUT = 90.0  # GRADING_TIMEOUT in backend/src/services/AIService.js
+
+
+def load_samples() -> List[Dict[str, Any]]:
+    """GradeRequest bodies from both datasets (learned_data.json is a flat list of corrections)."""
+    samples = []
+    for path in DATASET_PATHS:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for q in data.get("grading_questions", []):
+                for s in q.get("grading_samples", []):
+                    samples.append({"student_answer": s["student_answer"], "model_answer": q["model_answer"],
+                                    "max_points": float(q.get("max_points", 1.0))})
+        else:
+            for s in data:
+                if s.get("student_answer") and s.get("model_answer"):
+                    samples.append({"student_answer": s["student_answer"], "model_answer": s["model_answer"],
+                                    "max_points": float(s.get("max_points", 1.0))})
+    return samples
+
+
+def parse_mode_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        mode, _, weight = part.partition("=")
+        mix.append((mode.strip(), float(weight or 1)))
+    total = sum(w for _, w in mix) or 1.0
+    return [(m, w / total) for m, w in mix]
+
+
+def split_pools(samples: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """technical requests replay code questions, general requests the rest."""
+    from app.nlp.code_analyzer import CodeAnalyzer
+    analyzer = CodeAnalyzer()
+    pools: Dict[str, List[Dict[str, Any]]] = {"general": [], "technical": []}
+    for s in samples:
+        pools["technical" if analyzer.detect_answer_type(s["model_answer"]) == "code" else "general"].append(s)
+    return pools
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    from app.slowlog import percentile as _percentile
+    return _percentile(values, pct)
+
+
+class LoadRun:
+    def __init__(self, client, pools, mode_mix, rate: float, duration: float, concurrency: int,
+                 timeout: float, seed: int):
+        self.client = client
+        self.pools = pools
+        self.mode_mix = mode_mix
+        self.rate = rate
+        self.duration = duration
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.records: List[Dict[str, Any]] = []
+
+    def _next_body(self) -> Dict[str, Any]:
+        r = self.rng.random()
+        mode = self.mode_mix[-1][0]
+        for m, weight in self.mode_mix:
+            if r < weight:
+                mode = m
+                break
+            r -= weight
+        pool = self.pools.get(mode) or self.pools["general"] or self.pools["technical"]
+        return {**self.rng.choice(pool), "grading_mode": mode}
+
+    async def _one(self, index: int, scheduled: float, body: Dict[str, Any]):
+        async with self.slots:
+            started = time.perf_counter()
+            status, error = 0, ""
+            try:
+                response = await asyncio.wait_for(self.client.post("/grade", json=body), self.timeout)
+                status = response.status_code
+                if status >= 400:
+                    error = f"http_{status}"
+            except asyncio.TimeoutError:
+                error = "timeout"
+            except Exception as e:
+                error = type(e).__name__
+            finished = time.perf_counter()
+        self.records.append({
+            "index": index,
+            "mode": body["grading_mode"],
+            "scheduled_s": round(scheduled - self.t0, 4),
+            "queue_ms": round((started - scheduled) * 1000, 3),
+            "latency_ms": round((finished - scheduled) * 1000, 3),
+            "service_ms": round((finished - started) * 1000, 3),
+            "status": status,
+            "error": error,
+        })
+
+    async def run(self) -> Dict[str, Any]:
+        self.t0 = time.perf_counter()
+        tasks = []
+        next_at = self.t0
+        index = 0
+        while True:
+            # Poisson arrivals (rate <= 0: closed loop, as fast as the concurrency cap allows)
+            if self.rate > 0:
+                next_at += self.rng.expovariate(self.rate)
+                if next_at - self.t0 >= self.duration:
+                    break
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scheduled = next_at
+            else:
+                if time.perf_counter() - self.t0 >= self.duration:
+                    break
+                await self.slots.acquire()
+                self.slots.release()
+                scheduled = time.perf_counter()
+            tasks.append(asyncio.create_task(self._one(index, scheduled, self._next_body())))
+            index += 1
+            if self.rate <= 0:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return self.summary(time.perf_counter() - self.t0)
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        ok = [r for r in self.records if not r["error"]]
+        latencies = [r["latency_ms"] for r in ok]
+        errors: Dict[str, int] = {}
+        for r in self.records:
+            if r["error"]:
+                errors[r["error"]] = errors.get(r["error"], 0) + 1
+        return {
+            "target_rps": self.rate,
+            "requests": len(self.records),
+            "ok": len(ok),
+            "errors": sum(errors.values()),
+            "error_rate": round(sum(errors.values()) / len(self.records), 4) if self.records else 0.0,
+            "throughput_rps": round(len(ok) / wall, 3) if wall > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies) if latencies else 0.0,
+            "mean_queue_ms": round(sum(r["queue_ms"] for r in ok) / len(ok), 3) if ok else 0.0,
+            "over_aiservice_timeout": sum(1 for v in latencies if v >= AISERVICE_TIMEOUT * 1000),
+            "wall_s": round(wall, 3),
+            "error_breakdown": errors,
+        }
+
+
+def _make_client(url: Optional[str], timeout: float):
+    import httpx
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+    from app.main import app, startup_event
+    startup_event()  # ASGITransport does not run the startup hooks
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=timeout)
+
+
+async def _run_steps(args) -> List[Dict[str, Any]]:
+    samples = load_samples()
+    pools = split_pools(samples)
+    mix = parse_mode_mix(args.mode_mix)
+    rates = [float(r) for r in str(args.rate).split(",") if r.strip()]
+    rows, all_records = [], []
+    async with _make_client(args.url, args.timeout) as client:
+        if args.warmup:
+            for body in samples[:args.warmup]:
+                await client.post("/grade", json={**body, "grading_mode": "general"})
+        for step, rate in enumerate(rates):
+            run = LoadRun(client, pools, mix, rate, args.duration, args.concurrency, args.timeout, args.seed + step)
+            summary = await run.run()
+            summary["concurrency"] = args.concurrency
+            summary["mode_mix"] = args.mode_mix
+            rows.append(summary)
+            all_records.extend({**r, "target_rps": rate} for r in run.records)
+            print(f"rate {rate:>7.2f}/s  done {summary['ok']:>5}/{summary['requests']:<5} "
+                  f"thru {summary['throughput_rps']:>7.2f}/s  p50 {summary['p50_ms']:>9.1f}  p95 {summary['p95_ms']:>9.1f}  "
+                  f"p99 {summary['p99_ms']:>9.1f} ms  err {summary['error_rate'] * 100:5.1f}%  {summary['error_breakdown'] or ''}")
+    if args.requests_csv:
+        _write_csv(args.requests_csv, all_records)
+    return rows
+
+
+def _write_csv(path: str, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    fields = list(rows[0].keys())
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: json.dumps(v) if isinstance(v, dict) else v for k, v in row.items()})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test", description="Replay grading samples against /grade.")
+    parser.add_argument("--url", help="running server (default: in-process ASGI)")
+    parser.add_argument("--rate", default="2", help="target requests/s; comma list = one step per rate; 0 = closed loop")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step")
+    parser.add_argument("--concurrency", type=int, default=16, help="max requests in flight")
+    parser.add_argument("--mode-mix", default="general=0.8,technical=0.2")
+    parser.add_argument("--timeout", type=float, default=AISERVICE_TIMEOUT)
+    parser.add_argument("--warmup", type=int, default=5, help="sequential requests before measuring")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stub-model", action="store_true", help="in-process only: offline stub encoders")
+    parser.add_argument("--csv", help="one summary row per rate step (capacity planning)")
+    parser.add_argument("--requests-csv", help="one row per request")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+    if args.stub_model and not args.url:
+        from benchmarks.stub_model import install_stub_model
+        install_stub_model()
+
+    rows = asyncio.run(_run_steps(args))
+    if args.csv:
+        _write_csv(args.csv, rows)
+        print(f"Saved {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,537 @@
+"""
+run_benchmarks.py
+In-process micro-benchmarks for every grading pipeline stage.
+
+Inputs come from app/university_training_data.json (grading samples) and
+data/comprehensive_cheating_dataset.csv (behavior sessions). Results are written as JSON
+(benchmarks/results/<git-sha>.json by default) so two commits can be compared:
+
+    cd ai_services
+    python -m benchmarks.run_benchmarks                         # stub models, all benchmarks
+    python -m benchmarks.run_benchmarks -k grader --rounds 10
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<old-sha>.json
+    python -m benchmarks.run_benchmarks --real-models           # load the real encoders
+
+By default the sentence-transformers models are replaced by benchmarks/stub_model.py so the
+suite runs offline; model-dependent numbers then measure the pipeline around the models.
+Times are seconds per input item (one grading, one string, one event list).
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+DATASET_PATH = os.path.join(BASE_DIR, "app", "university_training_data.json")
+BEHAVIOR_CSV = os.path.join(BASE_DIR, "data", "comprehensive_cheating_dataset.csv")
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+
+# name -> (group, setup); setup() returns (fn, items) where fn() processes `items` inputs once
+BENCHMARKS: Dict[str, Tuple[str, Callable[[], Tuple[Callable[[], Any], int]]]] = {}
+
+
+def benchmark(name: str, group: str):
+    def register(setup):
+        BENCHMARKS[name] = (group, setup)
+        return setup
+    return register
+
+
+# ===== INPUTS =====
+
+_cases: Optional[Dict[str, Any]] = None
+
+
+def _perturb(text: str) -> str:
+    """Deterministic paraphrase-like edit (drops every 5th word) so dataset memory misses."""
+    words = text.split()
+    if len(words) < 6:
+        return text + " nói chung"
+    return " ".join(w for i, w in enumerate(words) if i % 5 != 2)
+
+
+def load_cases() -> Dict[str, Any]:
+    global _cases
+    if _cases is None:
+        with open(DATASET_PATH, "r", encoding="utf-8") as f:
+            questions = json.load(f)["grading_questions"]
+        pairs = []
+        for q in questions:
+            for sample in q.get("grading_samples", []):
+                pairs.append((sample["student_answer"], q["model_answer"], float(q.get("max_points", 1.0))))
+        _cases = {
+            "questions": questions,
+            "pairs": pairs,
+            "texts": [p[0] for p in pairs] + [q["model_answer"] for q in questions],
+            # Every 5th sample keeps the grader benchmarks short but covers all categories
+            "grading": pairs[::5],
+            "grading_perturbed": [(_perturb(s), m, p) for s, m, p in pairs[::5]],
+        }
+    return _cases
+
+
+def load_behavior_sessions(limit: int = 100) -> List[List[Dict[str, Any]]]:
+    """Raw event lists rebuilt from the per-session feature rows of the cheating dataset."""
+    counters = {
+        "tab_switches": "tab_switch", "blur_events": "window_blur", "blocked_keys": "blocked_key",
+        "fullscreen_exits": "fullscreen_lost", "copy_attempts": "copy", "paste_attempts": "paste",
+        "mouse_outside_count": "mouse_outside", "screenshot_attempts": "screenshot_attempt",
+    }
+    sessions = []
+    with open(BEHAVIOR_CSV, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            events = []
+            for column, event_type in counters.items():
+                for _ in range(int(float(row.get(column) or 0))):
+                    events.append({"event_type": event_type, "details": {}})
+            if events and float(row.get("max_blur_duration_ms") or 0) > 0:
+                events.append({"event_type": "window_blur", "details": {"duration_ms": float(row["max_blur_duration_ms"])}})
+            sessions.append(events)
+            if len(sessions) >= limit:
+                break
+    return sessions
+
+
+def _clear_grader_caches(grader):
+    from app import dataset_learning
+
+    ai = grader.ai
+    for cache in ai._embedding_caches.values():
+        cache.clear()
+    ai._nli_cache.clear()
+    grader._model_artifacts.clear()
+    grader.code_analyzer._model_profiles.clear()
+    dataset_learning.current_snapshot().candidate_cache.clear()
+
+
+# ===== BENCHMARKS =====
+
+@benchmark("similarity.levenshtein_distance", "similarity")
+def bench_levenshtein():
+    from app.nlp.similarity import levenshtein_distance
+    # Short answers only: the DP is O(n*m), long essays would dominate the round
+    pairs = [(s[:120], m[:120]) for s, m, _ in load_cases()["pairs"][::3]]
+
+    def run():
+        for a, b in pairs:
+            levenshtein_distance(a, b)
+    return run, len(pairs)
+
+
+@benchmark("tokenizer.normalize_synonyms", "tokenizer")
+def bench_normalize_synonyms():
+    from app.nlp.tokenizer import normalize_synonyms
+    texts = load_cases()["texts"]
+
+    def run():
+        for t in texts:
+            normalize_synonyms(t)
+    return run, len(texts)
+
+
+@benchmark("logic.preprocess", "logic")
+def bench_logic_preprocess():
+    from app.nlp.contradiction import LogicAnalyzer
+    analyzer = LogicAnalyzer()
+    texts = load_cases()["texts"]
+
+    def run():
+        for t in texts:
+            analyzer.preprocess(t)
+    return run, len(texts)
+
+
+@benchmark("code_analyzer.grade", "code_analyzer")
+def bench_code_analyzer_grade():
+    from app.nlp.code_analyzer import CodeAnalyzer
+    analyzer = CodeAnalyzer()
+    pairs = [(m, s, p) for s, m, p in load_cases()["pairs"] if analyzer.detect_answer_type(m) == "code"]
+
+    def run():
+        analyzer._model_profiles.clear()
+        for model, student, points in pairs:
+            analyzer.grade(model, student, points)
+    return run, len(pairs)
+
+
+@benchmark("code_analyzer.detect_answer_type", "code_analyzer")
+def bench_code_analyzer_detect():
+    from app.nlp.code_analyzer import CodeAnalyzer
+    analyzer = CodeAnalyzer()
+    texts = load_cases()["texts"]
+
+    def run():
+        for t in texts:
+            analyzer.detect_answer_type(t)
+    return run, len(texts)
+
+
+@benchmark("dataset.find_similar_to_grading.hit", "dataset")
+def bench_dataset_hit():
+    from app import dataset_learning
+    pairs = load_cases()["grading"]
+
+    def run():
+        for s, m, p in pairs:
+            dataset_learning.find_similar_to_grading(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("dataset.find_similar_to_grading.miss", "dataset")
+def bench_dataset_miss():
+    from app import dataset_learning
+    pairs = load_cases()["grading_perturbed"]
+
+    def run():
+        for s, m, p in pairs:
+            dataset_learning.find_similar_to_grading(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("grader.grade_lexical", "grader")
+def bench_grade_lexical():
+    from app.nlp import get_grader
+    grader = get_grader()
+    pairs = load_cases()["grading_perturbed"]
+
+    def run():
+        for s, m, p in pairs:
+            grader.grade_lexical(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("grader.grade.cold", "grader")
+def bench_grade_cold():
+    from app.nlp import get_grader
+    grader = get_grader()
+    pairs = load_cases()["grading_perturbed"]
+
+    def run():
+        _clear_grader_caches(grader)
+        for s, m, p in pairs:
+            grader.grade(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("grader.grade.warm", "grader")
+def bench_grade_warm():
+    from app.nlp import get_grader
+    grader = get_grader()
+    pairs = load_cases()["grading_perturbed"]
+    for s, m, p in pairs:
+        grader.grade(s, m, p)
+
+    def run():
+        for s, m, p in pairs:
+            grader.grade(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("grader.grade.dataset_hit", "grader")
+def bench_grade_dataset_hit():
+    from app.nlp import get_grader
+    grader = get_grader()
+    pairs = load_cases()["grading"]
+
+    def run():
+        for s, m, p in pairs:
+            grader.grade(s, m, p)
+    return run, len(pairs)
+
+
+@benchmark("behavior.detect_cheating", "behavior")
+def bench_detect_cheating():
+    from app.nlp.behavior_detection import BehaviorDetectionModel
+    model = BehaviorDetectionModel()
+    sessions = load_behavior_sessions()
+
+    def run():
+        for events in sessions:
+            model.detect_cheating(events)
+    return run, len(sessions)
+
+
+@benchmark("behavior.detect_cheating_batch", "behavior")
+def bench_detect_cheating_batch():
+    from app.nlp.behavior_detection import BehaviorDetectionModel
+    model = BehaviorDetectionModel()
+    sessions = load_behavior_sessions()
+
+    def run():
+        model.detect_cheating_batch(sessions)
+    return run, len(sessions)
+
+
+# Security: configured 3000 req/min per IP, steady state (a full window of history per IP)
+SECURITY_IPS = [f"10.0.0.{i}" for i in range(1, 5)]
+SECURITY_HITS = 1000
+
+
+def _legacy_rate_history():
+    """Pre-ASGI SecurityMiddleware state: a full window of datetimes per IP."""
+    from datetime import datetime, timedelta
+    from app.security import RATE_LIMIT, RATE_WINDOW
+    now = datetime.now()
+    step = timedelta(seconds=RATE_WINDOW / RATE_LIMIT)
+    return {ip: [now - step * i for i in range(RATE_LIMIT - 1, 0, -1)] for ip in SECURITY_IPS}
+
+
+def _legacy_is_rate_limited(request_counts, ip: str) -> bool:
+    """SecurityMiddleware._is_rate_limited before the bucketed limiter (reference only)."""
+    from datetime import datetime, timedelta
+    from app.security import RATE_LIMIT, RATE_WINDOW
+    now = datetime.now()
+    cutoff = now - timedelta(seconds=RATE_WINDOW)
+    request_counts[ip] = [t for t in request_counts[ip] if t > cutoff]
+    request_counts[ip].append(now)
+    return len(request_counts[ip]) > RATE_LIMIT
+
+
+def _warm_limiter():
+    """Bucketed limiter with the same full window per IP; returns (limiter, now)."""
+    from app.security import RATE_LIMIT, RATE_WINDOW, SlidingWindowLimiter
+    limiter = SlidingWindowLimiter(limit=RATE_LIMIT * 1000)
+    start = time.monotonic() - RATE_WINDOW
+    step = RATE_WINDOW / RATE_LIMIT
+    for i in range(RATE_LIMIT - 1):
+        for ip in SECURITY_IPS:
+            limiter.hit(ip, start + i * step)
+    return limiter, start + RATE_LIMIT * step
+
+
+@benchmark("security.rate_limit.legacy", "security")
+def bench_rate_limit_legacy():
+    def run():
+        counts = _legacy_rate_history()
+        for i in range(SECURITY_HITS):
+            _legacy_is_rate_limited(counts, SECURITY_IPS[i % len(SECURITY_IPS)])
+    return run, SECURITY_HITS
+
+
+@benchmark("security.rate_limit", "security")
+def bench_rate_limit():
+    from app.security import RATE_LIMIT, RATE_WINDOW
+    limiter, now = _warm_limiter()
+    step = RATE_WINDOW / RATE_LIMIT / len(SECURITY_IPS)  # each IP at the configured rate
+
+    def run():
+        nonlocal now
+        for i in range(SECURITY_HITS):
+            now += step
+            limiter.hit(SECURITY_IPS[i % len(SECURITY_IPS)], now)
+    return run, SECURITY_HITS
+
+
+def _asgi_requests(middleware, n: int):
+    """Drive n GET /health requests through an ASGI middleware (no server, no client)."""
+    import asyncio
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scopes = [{
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/health", "raw_path": b"/health", "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"ai"), (b"x-forwarded-for", ip.encode())], "client": (ip, 50000), "server": ("ai", 8000),
+    } for ip in SECURITY_IPS]
+
+    async def drive():
+        for i in range(n):
+            await middleware(dict(scopes[i % len(scopes)]), receive, send)
+    return lambda: asyncio.run(drive())
+
+
+async def _ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", b"2")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+@benchmark("security.middleware.legacy", "security")
+def bench_security_middleware_legacy():
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from starlette.responses import JSONResponse
+    from app.security import BLOCKED_METHODS, SUSPICIOUS_PATTERNS, WHITELIST
+    BLACKLIST = set()
+    state = {"counts": _legacy_rate_history()}
+
+    class LegacySecurityMiddleware(BaseHTTPMiddleware):
+        # dispatch() of the BaseHTTPMiddleware implementation, allowed path only
+        async def dispatch(self, request, call_next):
+            ip = request.headers.get("X-Forwarded-For", "").split(",")[0].strip() or request.client.host
+            if ip in WHITELIST:
+                return await call_next(request)
+            if ip in BLACKLIST or request.method in BLOCKED_METHODS:
+                return JSONResponse(status_code=403, content={"detail": "Access forbidden"})
+            path = request.url.path.lower()
+            if any(pattern in path for pattern in SUSPICIOUS_PATTERNS):
+                return JSONResponse(status_code=404, content={"detail": "Not found"})
+            if _legacy_is_rate_limited(state["counts"], ip):
+                return JSONResponse(status_code=429, content={"detail": "Too many requests."})
+            return await call_next(request)
+
+    drive = _asgi_requests(LegacySecurityMiddleware(_ok_app), SECURITY_HITS)
+
+    def run():
+        state["counts"] = _legacy_rate_history()
+        drive()
+    return run, SECURITY_HITS
+
+
+@benchmark("security.middleware", "security")
+def bench_security_middleware():
+    from app.security import SecurityMiddleware
+    limiter, _ = _warm_limiter()
+    return _asgi_requests(SecurityMiddleware(_ok_app, limiter), SECURITY_HITS), SECURITY_HITS
+
+
+# ===== RUNNER =====
+
+def measure(fn: Callable[[], Any], items: int, rounds: int, min_time: float) -> Dict[str, Any]:
+    """Calibrate loops so one round takes >= min_time, then time `rounds` rounds."""
+    fn()  # warm-up (imports, lazy indexes)
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 16:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    per_item = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_item.append((time.perf_counter() - start) / (loops * max(1, items)))
+    median = statistics.median(per_item)
+    return {
+        "items": items,
+        "loops": loops,
+        "rounds": rounds,
+        "min": min(per_item),
+        "median": median,
+        "mean": statistics.fmean(per_item),
+        "stdev": statistics.stdev(per_item) if len(per_item) > 1 else 0.0,
+        "ops_per_sec": round(1.0 / median, 2) if median > 0 else None,
+        "unit": "s/item",
+    }
+
+
+def _git_sha() -> str:
+    from app.slowlog import code_version
+    return code_version()
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    rows = []
+    for name, result in current["benchmarks"].items():
+        old = previous.get("benchmarks", {}).get(name)
+        if not old or not old.get("median"):
+            continue
+        ratio = result["median"] / old["median"]
+        status = "regression" if ratio > 1 + tolerance else "faster" if ratio < 1 - tolerance else "same"
+        rows.append({"name": name, "old": old["median"], "new": result["median"], "ratio": round(ratio, 3), "status": status})
+    return rows
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run_benchmarks", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("-k", "--filter", default="", help="regex on benchmark names")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round (loops are calibrated)")
+    parser.add_argument("--real-models", action="store_true", help="use the real sentence-transformers models")
+    parser.add_argument("--fast-tier", action="store_true", help="stub: also install a fast encoder tier")
+    parser.add_argument("--out", help="result JSON (default benchmarks/results/<git-sha>.json)")
+    parser.add_argument("--compare", help="previous result JSON")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change reported as regression/faster")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args(argv)
+
+    selected = [n for n in BENCHMARKS if re.search(args.filter, n)]
+    if args.list:
+        print("\n".join(selected))
+        return 0
+
+    # Quiet the grader's per-answer INFO logs and sklearn's pickle-version warning
+    import logging
+    import warnings
+    logging.disable(logging.INFO)
+    warnings.filterwarnings("ignore", message=".*Trying to unpickle.*")
+
+    if not args.real_models:
+        from benchmarks.stub_model import install_stub_model
+        install_stub_model(fast_tier=args.fast_tier)
+
+    results: Dict[str, Any] = {}
+    print(f"{'benchmark':<42} {'median':>12} {'min':>12} {'stdev':>8} {'items':>6} {'loops':>6}")
+    for name in selected:
+        group, setup = BENCHMARKS[name]
+        try:
+            fn, items = setup()
+            result = measure(fn, items, args.rounds, args.min_time)
+        except Exception as e:
+            print(f"{name:<42} ERROR {type(e).__name__}: {e}")
+            results[name] = {"group": group, "error": f"{type(e).__name__}: {e}"}
+            continue
+        results[name] = {"group": group, **result}
+        spread = result["stdev"] / result["median"] * 100 if result["median"] else 0.0
+        print(f"{name:<42} {_fmt(result['median']):>12} {_fmt(result['min']):>12} {spread:>7.1f}% {items:>6} {result['loops']:>6}")
+
+    report = {
+        "meta": {
+            "code_version": _git_sha(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "models": "real" if args.real_models else "stub",
+            "rounds": args.rounds,
+            "min_time": args.min_time,
+        },
+        "benchmarks": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{report['meta']['code_version']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("meta", {}).get("models") != report["meta"]["models"]:
+            print("⚠️ Comparing stub-model and real-model results")
+        rows = compare({"benchmarks": {k: v for k, v in results.items() if "median" in v}}, previous, args.tolerance)
+        print(f"\nvs {previous.get('meta', {}).get('code_version', args.compare)}")
+        for row in rows:
+            print(f"{row['name']:<42} {_fmt(row['old']):>12} -> {_fmt(row['new']):>12}  x{row['ratio']:<6} {row['status']}")
+        if args.fail_on_regression and any(r["status"] == "regression" for r in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,6 +44,20 @@ TEST_CASES = [
     }
 ]
 
+def print_encoder_tier_stats(stats_url):
+    # Thống kê 2 tầng Bi-Encoder (MiniLM -> mpnet) sau khi chạy bộ test
+    try:
+        stats = requests.get(stats_url, timeout=10).json()["stats"]
+    except Exception as e:
+        print(f"⚠️ Không lấy được /model/stats: {e}")
+        return
+    for tier, info in stats["tiers"].items():
+        cache = info["cache"]
+        print(f"🧠 Tier {tier:<4} ({info['model']}): encoded={info['texts_encoded']}, "
+              f"cache hit={cache['hit_rate']:.0%}, memory={info['total_bytes'] / 1024**2:.1f} MB")
+    cascade = stats["cascade"]
+    print(f"🔀 Cascade: {cascade['fast_accepted']} ý chấm bằng model nhỏ, {cascade['escalated']} ý escalate lên mpnet")
+
 def run_tests():
     print("======================================================================")
     print("🧪 KIỂM THỬ CHẤT LƯỢNG CHẤM ĐIỂM AI - MÔN ĐẠI CƯƠNG (PHÁP LUẬT / TRIẾT)")
@@ -93,6 +107,7 @@ def run_tests():
     speed_status = "NHANH" if avg_time < 1.0 else ("TẠM ỔN" if avg_time < 2.5 else "CHẬM")
     print(f"⏳ Cần trung bình {avg_time:.3f} giây / 1 câu hỏi.")
     print(f"🐢 Tốc độ chấm: {speed_status}")
+    print_encoder_tier_stats(API_URL.replace("/grade", "/model/stats"))
     print("======================================================================")
 
 if __name__ == "__main__":
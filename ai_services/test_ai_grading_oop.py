@@ -2,6 +2,8 @@ import requests
 import time
 import json
 
+from test_ai_grading_general import print_encoder_tier_stats
+
 # URL AI Service gốc hoặc Production
 URL = "http://localhost:8000/grade"
 
@@ -111,6 +113,7 @@ def run_evaluation():
             print("⚡ Tốc độ chấm: TỐT (Hoàn toàn đáp ứng thời gian thực cho kỳ thi)")
         else:
             print("🐢 Tốc độ chấm: CHẬM (Tạm ổn nhưng cần kiểm tra lại tài nguyên server)")
+        print_encoder_tier_stats(URL.replace("/grade", "/model/stats"))
     print("="*70)
 
 if __name__ == '__main__':
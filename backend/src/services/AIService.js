@@ -12,6 +12,16 @@ const RETRY_DELAY_BASE = 2000;       // 2 second base delay
 const RECOVERY_INTERVAL = 10000;     // Check for pending/failed every 10s
 const STALE_TIMEOUT = 180000;        // 3 minutes - mark as stale if in_progress too long
 const IMMEDIATE_RETRY_DELAY = 3000;  // Retry failed submission after 3s
+const MAX_RETRY_AFTER = 120000;      // Cap for the AI service's Retry-After (429 backpressure)
+
+// AI-service admission priority (X-Grading-Priority): regrade > bulk > recovery
+const PRIORITY_BULK = 'bulk';
+const PRIORITY_RECOVERY = 'recovery';
+
+// Degraded (overload) scores from the AI service are provisional; the corrected full-pipeline
+// score is fetched from GET /grade/regrades once the AI service has regraded it
+const DEGRADED_BATCH = 100;            // regrade ids per poll request
+const DEGRADED_MAX_AGE = 3600000;      // give up after 1h (AI service restarted / result evicted)
 
 // ═══════════════════════════════════════════════════════
 // JOB TRACKING & DEDUPLICATION
@@ -20,6 +30,8 @@ let activeJobs = 0;
 let recoveryInterval = null;
 let isRecovering = false;
 const inFlightSubmissions = new Set();  // Deduplication: track in-flight submission IDs
+const degradedRegrades = new Map();     // regrade_id -> { answerId, submissionId, provisionalScore, maxPoints, createdAt }
+let isApplyingRegrades = false;
 
 /**
  * Initialize the AI grading service with recovery
@@ -39,6 +51,9 @@ const initialize = () => {
         if (!isRecovering) {
             recoverPendingSubmissions();
         }
+        if (!isApplyingRegrades && degradedRegrades.size > 0) {
+            applyDegradedRegrades();
+        }
     }, RECOVERY_INTERVAL);
 
     console.log(`[AIService] ✅ Background recovery worker started (every ${RECOVERY_INTERVAL / 1000}s)`);
@@ -133,8 +148,9 @@ const gradeSubmission = async (submissionId) => {
  * Process a single submission with full deduplication and retry.
  * @param {number} submissionId 
  * @param {number} retryAttempt - 0 = first try, 1 = immediate retry
+ * @param {string} priority - AI-service queue class ('bulk' for new submissions, 'recovery' for sweeps)
  */
-const processSubmission = async (submissionId, retryAttempt = 0) => {
+const processSubmission = async (submissionId, retryAttempt = 0, priority = PRIORITY_BULK) => {
     // ── DEDUP: Already processing this submission? ──
     if (inFlightSubmissions.has(submissionId)) {
         console.log(`[AIService] ⚡ Submission ${submissionId} already being processed in-flight, skipping`);
@@ -170,7 +186,7 @@ const processSubmission = async (submissionId, retryAttempt = 0) => {
         console.log(`[AIService] 🚀 Processing submission ${submissionId} (attempt ${retryAttempt + 1}). Active: ${activeJobs}/${MAX_CONCURRENT_JOBS}`);
 
         // Perform grading
-        await performGrading(submissionId, conn);
+        await performGrading(submissionId, conn, priority);
 
         // Mark as completed
         await conn.query(`
@@ -204,7 +220,7 @@ const processSubmission = async (submissionId, retryAttempt = 0) => {
         if (retryAttempt < 1) {
             console.log(`[AIService] 🔄 Scheduling immediate retry for submission ${submissionId} in ${IMMEDIATE_RETRY_DELAY}ms...`);
             inFlightSubmissions.delete(submissionId);  // Allow retry to claim
-            setTimeout(() => processSubmission(submissionId, retryAttempt + 1), IMMEDIATE_RETRY_DELAY);
+            setTimeout(() => processSubmission(submissionId, retryAttempt + 1, priority), IMMEDIATE_RETRY_DELAY);
         }
     } finally {
         activeJobs = Math.max(0, activeJobs - 1);
@@ -221,7 +237,7 @@ const processSubmission = async (submissionId, retryAttempt = 0) => {
  * Grade all essays in a submission.
  * Per-answer resilience: if 1 essay fails, others still get saved.
  */
-const performGrading = async (submissionId, conn) => {
+const performGrading = async (submissionId, conn, priority = PRIORITY_BULK) => {
     const startTime = Date.now();
 
     // Fetch Essay Answers
@@ -261,7 +277,8 @@ const performGrading = async (submissionId, conn) => {
         }
 
         try {
-            const aiResult = await callAIService(ans.answer_text, ans.model_answer, ans.max_points, ans.grading_mode);
+            const traceId = `sub-${submissionId}-ans-${ans.id}`;
+            const aiResult = await callAIService(ans.answer_text, ans.model_answer, ans.max_points, ans.grading_mode, 0, traceId, priority);
 
             if (aiResult && aiResult.score !== undefined) {
                 let { score, confidence, explanation, type } = aiResult;
@@ -288,6 +305,16 @@ const performGrading = async (submissionId, conn) => {
                     WHERE id = ?
                 `, [score, ans.id]);
 
+                if (aiResult.degraded && aiResult.regrade_id) {
+                    degradedRegrades.set(aiResult.regrade_id, {
+                        answerId: ans.id,
+                        submissionId,
+                        provisionalScore: score,
+                        maxPoints: ans.max_points,
+                        createdAt: Date.now()
+                    });
+                }
+
                 // Log to ai_logs
                 try {
                     await conn.query(`
@@ -358,8 +385,9 @@ const performGrading = async (submissionId, conn) => {
 /**
  * Call AI Service with retry and timeout.
  * On retryable errors, backs off exponentially.
+ * On 429 (AI service queue full), waits for the Retry-After it sends instead.
  */
-const callAIService = async (studentAnswer, modelAnswer, maxPoints, gradingMode = 'general', retryCount = 0) => {
+const callAIService = async (studentAnswer, modelAnswer, maxPoints, gradingMode = 'general', retryCount = 0, traceId = null, priority = PRIORITY_BULK) => {
     try {
         const response = await axios.post(`${AI_SERVICE_URL}/grade`, {
             student_answer: studentAnswer,
@@ -368,7 +396,14 @@ const callAIService = async (studentAnswer, modelAnswer, maxPoints, gradingMode
             grading_mode: gradingMode
         }, {
             timeout: GRADING_TIMEOUT,
-            headers: { 'Content-Type': 'application/json' }
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Grading-Priority': priority,
+                // AI service aborts the grading once we stop waiting for it
+                'X-Deadline-Ms': String(GRADING_TIMEOUT),
+                // Correlates this call with AI-service spans (GET /debug/traces?trace_id=..., X-Admin-Token)
+                ...(traceId ? { 'X-Trace-Id': traceId } : {})
+            }
         });
 
         return response.data;
@@ -378,10 +413,14 @@ const callAIService = async (studentAnswer, modelAnswer, maxPoints, gradingMode
             || err.response?.status >= 500;
 
         if (retryCount < MAX_RETRIES && isRetryable) {
-            const delay = RETRY_DELAY_BASE * Math.pow(2, retryCount);
-            console.log(`[AIService] 🔄 Retry ${retryCount + 1}/${MAX_RETRIES} for AI call after ${delay}ms (${err.code || err.response?.status || 'unknown'})`);
+            const retryAfter = parseInt(err.response?.headers?.['retry-after'], 10);
+            const delay = err.response?.status === 429 && retryAfter > 0
+                // Server-computed drain time + jitter so queued callers don't return in lockstep
+                ? Math.min(retryAfter * 1000, MAX_RETRY_AFTER) + Math.floor(Math.random() * 1000)
+                : RETRY_DELAY_BASE * Math.pow(2, retryCount);
+            console.log(`[AIService] 🔄 Retry ${retryCount + 1}/${MAX_RETRIES} for AI call after ${delay}ms (${err.code || err.response?.status || 'unknown'})${traceId ? ` [trace ${traceId}]` : ''}`);
             await new Promise(r => setTimeout(r, delay));
-            return callAIService(studentAnswer, modelAnswer, maxPoints, gradingMode, retryCount + 1);
+            return callAIService(studentAnswer, modelAnswer, maxPoints, gradingMode, retryCount + 1, traceId, priority);
         }
 
         if (err.code === 'ECONNREFUSED') {
@@ -450,7 +489,7 @@ const recoverPendingSubmissions = async () => {
                 }
 
                 // Process it
-                processSubmission(sub.id);
+                processSubmission(sub.id, 0, PRIORITY_RECOVERY);
 
                 // Small delay between starting jobs to avoid burst
                 await new Promise(r => setTimeout(r, 200));
@@ -465,6 +504,80 @@ const recoverPendingSubmissions = async () => {
     }
 };
 
+// ═══════════════════════════════════════════════════════
+// DEGRADED SCORE CORRECTION
+// ═══════════════════════════════════════════════════════
+
+/**
+ * Replace provisional (degraded) AI scores with the AI service's full regrade.
+ * Only answers still holding the provisional score are touched, so an instructor's
+ * manual grade is never overwritten.
+ */
+const applyDegradedRegrades = async () => {
+    if (isApplyingRegrades) return;
+    isApplyingRegrades = true;
+
+    let conn;
+    try {
+        const ids = Array.from(degradedRegrades.keys());
+        const finished = [];
+        for (let i = 0; i < ids.length; i += DEGRADED_BATCH) {
+            const response = await axios.get(`${AI_SERVICE_URL}/grade/regrades`, {
+                params: { ids: ids.slice(i, i + DEGRADED_BATCH).join(',') },
+                timeout: GRADING_TIMEOUT
+            });
+            finished.push(...response.data.results.filter(r => r.status !== 'pending'));
+        }
+
+        conn = await pool.getConnection();
+        let corrected = 0;
+        for (const regrade of finished) {
+            const pending = degradedRegrades.get(regrade.regrade_id);
+            degradedRegrades.delete(regrade.regrade_id);
+            if (!pending || regrade.status !== 'done' || typeof regrade.result?.score !== 'number') {
+                continue;  // failed regrade: the provisional score stands
+            }
+
+            const score = Math.min(Math.max(regrade.result.score, 0), pending.maxPoints);
+            const delta = score - pending.provisionalScore;
+            if (delta === 0) continue;
+
+            const [updated] = await conn.query(`
+                UPDATE student_answers 
+                SET score = ?, graded_at = NOW()
+                WHERE id = ? AND score = ? AND status = 'graded'
+            `, [score, pending.answerId, pending.provisionalScore]);
+
+            if (updated.affectedRows > 0) {
+                await conn.query(`
+                    UPDATE submissions 
+                    SET ai_score = ai_score + ?, 
+                        suggested_total_score = suggested_total_score + ?
+                    WHERE id = ?
+                `, [delta, delta, pending.submissionId]);
+                corrected++;
+            }
+        }
+
+        // AI service restarted or evicted the result: keep the provisional score
+        const now = Date.now();
+        for (const [regradeId, pending] of degradedRegrades) {
+            if (now - pending.createdAt > DEGRADED_MAX_AGE) {
+                degradedRegrades.delete(regradeId);
+            }
+        }
+
+        if (corrected > 0) {
+            console.log(`[AIService] 🔁 Applied ${corrected} full regrades of degraded scores (${degradedRegrades.size} still pending)`);
+        }
+    } catch (err) {
+        console.error(`[AIService] Degraded regrade poll error:`, err.message);
+    } finally {
+        isApplyingRegrades = false;
+        if (conn) conn.release();
+    }
+};
+
 // ═══════════════════════════════════════════════════════
 // UTILITY FUNCTIONS
 // ═══════════════════════════════════════════════════════
@@ -489,6 +602,7 @@ const getQueueStatus = async () => {
             active: activeJobs,
             maxConcurrent: MAX_CONCURRENT_JOBS,
             inFlight: Array.from(inFlightSubmissions),
+            degradedPending: degradedRegrades.size,
             dbStats: stats
         };
     } catch (err) {
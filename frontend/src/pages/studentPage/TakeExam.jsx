@@ -5,6 +5,18 @@ import { SOCKET_URL } from "../../api/config";
 import io from "socket.io-client";
 import { useInactivityMonitor } from "../../hooks/useInactivityMonitor";
 
+const AI_URL = import.meta.env.VITE_AI_SERVER_URL || "http://localhost:8000";
+
+// Nộp bài -> kết thúc session hành vi trên AI server ngay (không để chờ hết TTL)
+const endBehaviorSession = (examId) => {
+  const studentId = localStorage.getItem("student_id") || "0";
+  axiosClient
+    .delete(`${AI_URL}/api/ai/behavior/session/${parseInt(studentId)}/${parseInt(examId)}`, {
+      baseURL: "" // Bỏ qua baseURL mặc định vì trỏ sang AI server
+    })
+    .catch(() => { }); // 404 = chưa gửi event nào, không có session
+};
+
 export default function TakeExam() {
   const { examId } = useParams();
   const [search] = useSearchParams();
@@ -60,7 +72,6 @@ export default function TakeExam() {
   const sessionEventsRef = useRef([]); // Thu thập events cho AI
   const aiCheckIntervalRef = useRef(null); // Interval Timer
   const lastAIFireRef = useRef(0); // Chống spam AI
-  const AI_URL = import.meta.env.VITE_AI_SERVER_URL || "http://localhost:8000";
 
   // ===== Snapshot & Recording Refs & State =====
   const mediaStreamRef = useRef(null);
@@ -258,6 +269,7 @@ export default function TakeExam() {
             if (beMcq != null) setMcqScore(beMcq);
             if (beAi != null) setAiScore(beAi);
             if (beSum != null) setTotalScore(beSum);
+            endBehaviorSession(examId);
 
             setShowModal(true);
             sessionStorage.removeItem("pending_exam_duration");
@@ -997,7 +1009,8 @@ export default function TakeExam() {
 
       try {
         const studentId = localStorage.getItem("student_id") || "0";
-        const res = await axiosClient.post(`${AI_URL}/api/ai/detect-behavior`, {
+        // Session endpoint: server aggregates the events of the whole exam, only new ones are sent
+        const res = await axiosClient.post(`${AI_URL}/api/ai/behavior/session/events`, {
           student_id: parseInt(studentId),
           exam_id: parseInt(examId),
           events: eventsToSend,
@@ -1200,6 +1213,7 @@ export default function TakeExam() {
         setTotalScore(mcq + (beAi || 0));
       }
       setShowModal(true);
+      endBehaviorSession(examId);
 
       sessionStorage.removeItem("pending_exam_duration");
       sessionStorage.removeItem("exam_flags");